@@ -0,0 +1,45 @@
+from datetime import datetime, time
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.managers import SoftDeleteQueryset
+from core.tasks import purge_before, purge_soft_deleted_rows
+
+
+class Command(BaseCommand):
+    help = 'Hard deletes rows soft deleted before the retention date, in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--model', action='append', dest='models',
+            help='app_label.Model to purge (repeatable), defaults to SOFT_DELETE_PURGE_MODELS',
+        )
+        parser.add_argument('--before', help='Purge rows deleted before this date (YYYY-MM-DD)')
+        parser.add_argument('--retention-days', type=int, help='Purge rows deleted more than this many days ago')
+        parser.add_argument('--chunk-size', type=int, default=settings.SOFT_DELETE_CHUNK_SIZE, help='Rows per DELETE')
+        parser.add_argument('--dry-run', action='store_true', help='Only count the rows that would be purged')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            date = parse_date(options['before'])
+            if date is None:
+                raise CommandError(f"Invalid --before date: {options['before']}")
+            before = timezone.make_aware(datetime.combine(date, time.min))
+        else:
+            before = purge_before(options['retention_days'])
+        labels = options['models'] or settings.SOFT_DELETE_PURGE_MODELS
+
+        if options['dry_run']:
+            for label in labels:
+                count = SoftDeleteQueryset(apps.get_model(label)).only_deleted().filter(deleted_date__lt=before).count()
+                self.stdout.write(f"{label}: {count} rows deleted before {before:%Y-%m-%d %H:%M}")
+            return
+
+        purged = purge_soft_deleted_rows(labels, before, options['chunk_size'])
+        for label, count in purged.items():
+            self.stdout.write(f"{label}: purged {count} rows")
+        self.stdout.write(self.style.SUCCESS(f"Purged {sum(purged.values())} soft deleted rows"))
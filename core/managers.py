@@ -1,23 +1,71 @@
+from django.conf import settings
 from django.db.models.query import QuerySet
 from django.db.models import Manager
 from django.utils import timezone
 
+
 class SoftDeleteQueryset(QuerySet):
     def only_deleted(self):
         return self.filter(is_deleted=True)
-    
+
     def not_deleted(self):
         return self.filter(is_deleted=False)
-    
-    def soft_delete(self):
-        return self.update(is_deleted=True, deleted_date=timezone.now())
-    
-    def restore(self):
-        return self.update(is_delete=False, deleted_date=None)
-    
+
+    def update_in_chunks(self, chunk_size=None, **values):
+        """
+        update(**values) in statements of at most `chunk_size` rows (default
+        SOFT_DELETE_CHUNK_SIZE), walking the primary keys in order, so a large
+        bulk change never holds one long transaction and its row locks.
+        chunk_size=0 runs a single update().
+        """
+        if chunk_size is None:
+            chunk_size = settings.SOFT_DELETE_CHUNK_SIZE
+        if not chunk_size:
+            return self.update(**values)
+        pending = self.order_by("pk")
+        updated = 0
+        last_pk = None
+        while True:
+            page = pending if last_pk is None else pending.filter(pk__gt=last_pk)
+            pks = list(page.values_list("pk", flat=True)[:chunk_size])
+            if not pks:
+                return updated
+            updated += self.filter(pk__in=pks).update(**values)
+            last_pk = pks[-1]
+
+    def soft_delete(self, chunk_size=None):
+        # Rows deleted earlier keep their deleted_date, it drives purge()
+        return self.not_deleted().update_in_chunks(chunk_size, is_deleted=True, deleted_date=timezone.now())
+
+    def restore(self, chunk_size=None):
+        return self.only_deleted().update_in_chunks(chunk_size, is_deleted=False, deleted_date=None)
+
+    def purge(self, before, chunk_size=None):
+        """
+        Hard deletes the rows soft deleted before `before`, `chunk_size` at a
+        time (default SOFT_DELETE_CHUNK_SIZE). Related rows follow their
+        on_delete rule like with delete().
+
+        Returns:
+            int: Rows of this model removed.
+        """
+        chunk_size = chunk_size or settings.SOFT_DELETE_CHUNK_SIZE
+        expired = self.only_deleted().filter(deleted_date__lt=before).order_by("pk")
+        # The real QuerySet.delete(), SoftDeleteOnlyQuerySet only flags rows
+        base = self.model._base_manager.using(self.db)
+        label = self.model._meta.label
+        purged = 0
+        while True:
+            pks = list(expired.values_list("pk", flat=True)[:chunk_size])
+            if not pks:
+                return purged
+            _, deleted = base.filter(pk__in=pks).delete()
+            purged += deleted.get(label, 0)
+
+
 class SoftDeleteOnlyQuerySet(SoftDeleteQueryset):
     def delete(self):
-        return self.update(is_delete=True, deleted_date=timezone.now())
+        return self.soft_delete()
 
 
 class SoftDeleteManager(Manager):
@@ -25,12 +73,15 @@ class SoftDeleteManager(Manager):
 
     def get_queryset(self):
         return self.queryset(self.model, using=self._db).not_deleted()
-    
+
     def only_deleted(self):
         return self.queryset(self.model, using=self._db).only_deleted()
 
-    def with_deleted(self): 
+    def with_deleted(self):
         return self.queryset(self.model, using=self._db)
-    
+
+    def purge(self, before, chunk_size=None):
+        return self.with_deleted().purge(before, chunk_size)
+
 class SoftDeleteOnlyManager(SoftDeleteManager):
     queryset=SoftDeleteOnlyQuerySet
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from celery import shared_task
+from django.apps import apps
+from django.conf import settings
+from django.utils import timezone
+
+from core.managers import SoftDeleteQueryset
+
+
+def purge_before(retention_days=None):
+    """
+    Cut-off date of the soft delete retention period.
+    """
+    if retention_days is None:
+        retention_days = settings.SOFT_DELETE_RETENTION_DAYS
+    return timezone.now() - timedelta(days=retention_days)
+
+
+def purge_soft_deleted_rows(model_labels=None, before=None, chunk_size=None):
+    """
+    Hard deletes rows of the SOFT_DELETE_PURGE_MODELS that were soft deleted
+    before the retention cut-off. Models may use any manager (users.User keeps
+    Django's UserManager), so the purge goes through SoftDeleteQueryset.
+
+    Returns:
+        dict: Model label -> rows removed.
+    """
+    before = before or purge_before()
+    purged = {}
+    for label in model_labels or settings.SOFT_DELETE_PURGE_MODELS:
+        model = apps.get_model(label)
+        purged[label] = SoftDeleteQueryset(model).purge(before, chunk_size)
+    return purged
+
+
+@shared_task
+def purge_soft_deleted():
+    """
+    Periodic Task (CELERY_BEAT_SCHEDULE): purges expired soft deleted rows in batches.
+    """
+    purged = purge_soft_deleted_rows()
+    return ", ".join(f"{label}: {count}" for label, count in purged.items()) or "Nothing to purge."
@@ -1,3 +1,217 @@
-from django.test import TestCase
+import json
+from datetime import timedelta
+from io import StringIO
+from urllib.parse import parse_qsl, urlparse
 
-# Create your tests here.
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.exceptions import NotFound
+from rest_framework.generics import GenericAPIView
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.managers import SoftDeleteOnlyQuerySet
+from core.tasks import purge_soft_deleted, purge_soft_deleted_rows
+from core.utils import CustomPageNumberPagination
+from derma.models import AssessmentImage
+from users.models import User
+
+
+class SoftDeleteQuerysetTests(TestCase):
+    """
+    Bulk soft delete, restore and purge, on AssessmentImage.
+    """
+
+    def setUp(self):
+        self.images = [
+            AssessmentImage.objects.create(image_file=f"assessments/{i}.jpg", image_width=10, image_height=10)
+            for i in range(5)
+        ]
+
+    def ids(self, queryset):
+        return sorted(queryset.values_list("id", flat=True))
+
+    def test_restore_clears_the_flag(self):
+        AssessmentImage.objects.all().soft_delete()
+        self.assertEqual(AssessmentImage.objects.count(), 0)
+
+        restored = AssessmentImage.objects.only_deleted().restore()
+
+        self.assertEqual(restored, 5)
+        self.assertEqual(AssessmentImage.objects.count(), 5)
+        self.assertFalse(AssessmentImage.objects.filter(deleted_date__isnull=False).exists())
+
+    def test_soft_delete_only_queryset_delete_flags_rows(self):
+        SoftDeleteOnlyQuerySet(AssessmentImage).filter(id=self.images[0].id).delete()
+
+        self.assertEqual(self.ids(AssessmentImage.objects.only_deleted()), [self.images[0].id])
+        self.assertEqual(AssessmentImage.objects.with_deleted().count(), 5)
+
+    @override_settings(SOFT_DELETE_CHUNK_SIZE=2)
+    def test_chunked_soft_delete_keeps_earlier_deleted_date(self):
+        earlier = timezone.now() - timedelta(days=30)
+        AssessmentImage.objects.with_deleted().filter(id=self.images[0].id).update(
+            is_deleted=True, deleted_date=earlier
+        )
+
+        with self.assertNumQueries(5):
+            # Three pages of ids plus two UPDATEs for the four live rows
+            deleted = AssessmentImage.objects.with_deleted().soft_delete()
+
+        self.assertEqual(deleted, 4)
+        self.assertEqual(AssessmentImage.objects.only_deleted().count(), 5)
+        self.assertEqual(AssessmentImage.objects.only_deleted().get(id=self.images[0].id).deleted_date, earlier)
+
+    def test_unchunked_soft_delete_is_one_update(self):
+        with self.assertNumQueries(1):
+            AssessmentImage.objects.with_deleted().soft_delete(chunk_size=0)
+        self.assertEqual(AssessmentImage.objects.count(), 0)
+
+    def test_purge_removes_rows_deleted_before_the_cut_off(self):
+        now = timezone.now()
+        old, recent = self.images[0].id, self.images[1].id
+        AssessmentImage.objects.with_deleted().filter(id=old).update(
+            is_deleted=True, deleted_date=now - timedelta(days=100)
+        )
+        AssessmentImage.objects.with_deleted().filter(id=recent).update(
+            is_deleted=True, deleted_date=now - timedelta(days=10)
+        )
+
+        purged = AssessmentImage.objects.purge(now - timedelta(days=90), chunk_size=1)
+
+        self.assertEqual(purged, 1)
+        self.assertFalse(AssessmentImage.objects.with_deleted().filter(id=old).exists())
+        self.assertEqual(self.ids(AssessmentImage.objects.only_deleted()), [recent])
+        self.assertEqual(AssessmentImage.objects.count(), 3)
+
+
+@override_settings(SOFT_DELETE_PURGE_MODELS=["derma.AssessmentImage"], SOFT_DELETE_RETENTION_DAYS=90)
+class PurgeSoftDeletedTests(TestCase):
+    """
+    The scheduled purge task and the purge_soft_deleted command.
+    """
+
+    def setUp(self):
+        now = timezone.now()
+        self.expired, self.kept, self.live = (
+            AssessmentImage.objects.create(image_file=f"assessments/{i}.jpg", image_width=10, image_height=10)
+            for i in range(3)
+        )
+        for image, days in ((self.expired, 100), (self.kept, 10)):
+            AssessmentImage.objects.with_deleted().filter(id=image.id).update(
+                is_deleted=True, deleted_date=now - timedelta(days=days)
+            )
+
+    def remaining(self):
+        return sorted(AssessmentImage.objects.with_deleted().values_list("id", flat=True))
+
+    def test_purge_rows_uses_the_retention_period(self):
+        self.assertEqual(purge_soft_deleted_rows(), {"derma.AssessmentImage": 1})
+        self.assertEqual(self.remaining(), [self.kept.id, self.live.id])
+
+    def test_task_is_registered(self):
+        self.assertEqual(purge_soft_deleted.name, "core.tasks.purge_soft_deleted")
+        self.assertEqual(purge_soft_deleted(), "derma.AssessmentImage: 1")
+
+    def test_command_dry_run_only_counts(self):
+        out = StringIO()
+        call_command("purge_soft_deleted", "--dry-run", stdout=out)
+        self.assertIn("derma.AssessmentImage: 1 rows", out.getvalue())
+        self.assertEqual(len(self.remaining()), 3)
+
+    def test_command_purges_before_a_date(self):
+        out = StringIO()
+        before = (timezone.now() - timedelta(days=5)).date().isoformat()
+        call_command("purge_soft_deleted", "--before", before, stdout=out)
+        self.assertIn("Purged 2 soft deleted rows", out.getvalue())
+        self.assertEqual(self.remaining(), [self.live.id])
+
+
+class ImageSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AssessmentImage
+        fields = ["id", "diagnosis_class"]
+
+
+class ImageListView(GenericAPIView):
+    queryset = AssessmentImage.objects.order_by("id")
+    serializer_class = ImageSerializer
+
+
+class CustomPageNumberPaginationTests(TestCase):
+    """
+    Keyset and page_size=none modes of CustomPageNumberPagination.
+    """
+
+    # Minutes added to date_created per image: ties at 3 and 4 minutes
+    OFFSETS = [5, 3, 3, 3, 1, 4, 4]
+
+    def setUp(self):
+        self.factory = APIRequestFactory()
+        base = timezone.now() - timedelta(days=1)
+        keys = []
+        for offset in self.OFFSETS:
+            image = AssessmentImage.objects.create(image_file="assessments/x.jpg", image_width=10, image_height=10)
+            AssessmentImage.objects.filter(id=image.id).update(date_created=base + timedelta(minutes=offset))
+            keys.append((offset, image.id))
+        self.expected = [image_id for _, image_id in sorted(keys)]
+
+    def paginate(self, params, queryset=None, **attributes):
+        request = Request(self.factory.get("/images/", params))
+        view = ImageListView()
+        view.request, view.format_kwarg = request, None
+        paginator = CustomPageNumberPagination()
+        for name, value in attributes.items():
+            setattr(paginator, name, value)
+        rows = paginator.paginate_queryset(view.get_queryset() if queryset is None else queryset, request, view)
+        return paginator, paginator.get_paginated_response([row.id for row in rows])
+
+    def link_params(self, link):
+        return dict(parse_qsl(urlparse(link).query, keep_blank_values=True))
+
+    def walk(self, params, direction):
+        """
+        Follows the `direction` links from `params`. Returns the pages and the last response.
+        """
+        pages = []
+        while params is not None:
+            _, response = self.paginate(params)
+            pages.append(response.data["results"])
+            link = response.data[direction]
+            params = self.link_params(link) if link else None
+        return pages, response
+
+    def test_next_cursors_walk_every_row_once(self):
+        pages, _ = self.walk({"cursor": "", "page_size": 3}, "next")
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertEqual(sum(pages, []), self.expected)
+
+    def test_previous_cursors_walk_back(self):
+        _, last = self.walk({"cursor": "", "page_size": 3}, "next")
+        pages, first = self.walk(self.link_params(last.data["previous"]), "previous")
+
+        self.assertEqual(pages, [self.expected[3:6], self.expected[:3]])
+        self.assertIsNotNone(first.data["next"])
+
+    def test_rows_without_date_created_are_left_out(self):
+        AssessmentImage.objects.filter(id=self.expected[0]).update(date_created=None)
+        pages, _ = self.walk({"cursor": "", "page_size": 2}, "next")
+        self.assertEqual(sum(pages, []), self.expected[1:])
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ("garbage!!", "W10", "WyJub3QgYSBkYXRlIiwxLDBd"):
+            with self.subTest(cursor=cursor), self.assertRaises(NotFound):
+                self.paginate({"cursor": cursor})
+
+    def test_cursor_on_model_without_date_created_uses_pages(self):
+        User.objects.create_user(username="student", password="secret")
+        paginator, response = self.paginate({"cursor": "abc"}, queryset=User.objects.order_by("id"))
+        self.assertFalse(paginator.keyset)
+        self.assertEqual(response.data["count"], 1)
+
+    def test_page_size_none_streams_one_array(self):
+        _, response = self.paginate({"page_size": "none"}, stream_chunk_size=2)
+        body = b"".join(response.streaming_content)
+        self.assertEqual([row["id"] for row in json.loads(body)], sorted(self.expected))
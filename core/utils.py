@@ -1,15 +1,24 @@
+import base64
+import binascii
 import datetime
 import json
 from collections import OrderedDict
+from itertools import islice
 from typing import List
 
 import nepali_datetime
-from django.core.exceptions import ValidationError
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.core.validators import BaseValidator
+from django.db.models import Q, prefetch_related_objects
+from django.http import StreamingHttpResponse
+from django.utils.dateparse import parse_datetime
 from django.utils.translation import gettext as _
 from djangorestframework_camel_case.render import CamelCaseJSONRenderer
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 import numpy as np
 
 
@@ -78,24 +87,65 @@ class MaxFileSizeValidator(BaseValidator):
 
 
 class CustomPageNumberPagination(PageNumberPagination):
+    """
+    Page number pagination with two extra modes:
+
+    - keyset: opt in with `keyset_pagination = True` on the view or a `cursor`
+      query param (empty for the first page), the latter only for models that
+      have the keyset_ordering fields. Rows are ordered by
+      (date_created, id) and each page starts after an opaque cursor, so there
+      is no COUNT(*) and no OFFSET scan, however deep the page. Rows without a
+      date_created have no position and are left out.
+    - page_size=none: the whole queryset is streamed as a JSON array, fetched
+      and serialized `stream_chunk_size` rows at a time.
+    """
+
     page_size = 10
     page_size_query_param = "page_size"
     max_page_size = 1000
 
-    def paginate_queryset(self, queryset, request, view):
+    cursor_query_param = "cursor"
+    # Both fields must sort in the same direction
+    keyset_ordering = ("date_created", "id")
+    stream_chunk_size = 2000
+    invalid_cursor_message = _("Invalid cursor")
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.view = view
+        self.keyset = False
+        self.stream_queryset = None
+
         actual_page_size = request.query_params.get(self.page_size_query_param, None)
-        if actual_page_size and (str(actual_page_size) in ["0", "none"]):
+        if actual_page_size and str(actual_page_size).lower() == "none":
+            # Serialized lazily by get_paginated_response()
+            self.stream_queryset = queryset
+            return []
+        if getattr(view, "keyset_pagination", False) or (
+            self.cursor_query_param in request.query_params and self.supports_keyset(queryset)
+        ):
+            self.keyset = True
+            return self.paginate_keyset(queryset, request)
+        if actual_page_size and str(actual_page_size) == "0":
             queryset_count = queryset.count()
             if queryset_count > 0:
                 self.page_size = queryset_count
         return super().paginate_queryset(queryset, request, view)
 
     def get_paginated_response(self, data):
-        actual_page_size = self.request.query_params.get(
-            self.page_size_query_param, None
-        )
-        if actual_page_size and str(actual_page_size).lower() == "none":
-            return Response(data)
+        if self.stream_queryset is not None:
+            return self.get_streaming_response(self.stream_queryset)
+        if self.keyset:
+            return Response(
+                OrderedDict(
+                    [
+                        ("next", self.get_next_link()),
+                        ("previous", self.get_previous_link()),
+                        ("pageSize", self.keyset_page_size),
+                        ("results", data),
+                    ]
+                )
+            )
         return Response(
             OrderedDict(
                 [
@@ -115,6 +165,127 @@ class CustomPageNumberPagination(PageNumberPagination):
             )
         )
 
+    # Keyset mode
+
+    def supports_keyset(self, queryset):
+        """
+        True when the queryset's model has every keyset_ordering field (users.User
+        has date_joined, not date_created), so a stray ?cursor= can't cause a 500.
+        """
+        try:
+            for field in self.keyset_ordering:
+                queryset.model._meta.get_field(field.lstrip("-"))
+        except FieldDoesNotExist:
+            return False
+        return True
+
+    def encode_cursor(self, row, reverse):
+        fields = [field.lstrip("-") for field in self.keyset_ordering]
+        date_value, pk = (getattr(row, field) for field in fields)
+        payload = json.dumps([date_value.isoformat(), pk, int(reverse)], separators=(",", ":"))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        """
+        Returns ((date_created, id), reverse), or None for the first page.
+        """
+        if not cursor:
+            return None
+        try:
+            padded = cursor + "=" * (-len(cursor) % 4)
+            date_value, pk, reverse = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            position = (parse_datetime(date_value), int(pk))
+        except (binascii.Error, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if position[0] is None:
+            raise NotFound(self.invalid_cursor_message)
+        return position, bool(reverse)
+
+    def paginate_keyset(self, queryset, request):
+        self.keyset_page_size = self.get_page_size(request)
+        decoded = self.decode_cursor(request.query_params.get(self.cursor_query_param))
+        position, reverse = decoded if decoded else (None, False)
+
+        ordering = list(self.keyset_ordering)
+        if reverse:
+            ordering = [field[1:] if field.startswith("-") else "-" + field for field in ordering]
+        date_field, pk_field = (field.lstrip("-") for field in ordering)
+        # date_created is nullable: a NULL can't be compared with a cursor or encoded in one
+        queryset = queryset.filter(**{f"{date_field}__isnull": False}).order_by(*ordering)
+        if position is not None:
+            # Rows strictly after the cursor in the fetch order
+            op = "lt" if ordering[0].startswith("-") else "gt"
+            date_value, pk = position
+            queryset = queryset.filter(
+                Q(**{f"{date_field}__{op}": date_value}) | Q(**{date_field: date_value, f"{pk_field}__{op}": pk})
+            )
+
+        # One extra row tells whether there is another page that way
+        rows = list(queryset[: self.keyset_page_size + 1])
+        has_more = len(rows) > self.keyset_page_size
+        rows = rows[: self.keyset_page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.keyset_rows = rows
+        return rows
+
+    def _cursor_link(self, cursor):
+        url = remove_query_param(self.request.build_absolute_uri(), self.page_query_param)
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if not self.has_next or not self.keyset_rows:
+            return None
+        return self._cursor_link(self.encode_cursor(self.keyset_rows[-1], reverse=False))
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        if not self.has_previous or not self.keyset_rows:
+            return None
+        return self._cursor_link(self.encode_cursor(self.keyset_rows[0], reverse=True))
+
+    # page_size=none
+
+    def get_streaming_response(self, queryset):
+        """
+        Streams `queryset` as one JSON array without holding it in memory. Each
+        chunk is serialized with the view's serializer and rendered with the
+        negotiated JSON renderer (camel case included).
+        """
+        renderer = getattr(self.request, "accepted_renderer", None)
+        if not isinstance(renderer, JSONRenderer):
+            renderer = JSONRenderer()
+        view = self.view
+        prefetch = queryset._prefetch_related_lookups
+        chunk_size = self.stream_chunk_size
+
+        def stream():
+            yield b"["
+            rows = queryset.iterator(chunk_size=chunk_size)
+            first = True
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                if prefetch:
+                    # iterator() drops prefetch_related, do it per chunk instead
+                    prefetch_related_objects(chunk, *prefetch)
+                body = renderer.render(view.get_serializer(chunk, many=True).data)
+                # Strip the brackets of the rendered list
+                body = body.strip()[1:-1]
+                if body:
+                    yield body if first else b"," + body
+                    first = False
+            yield b"]"
+
+        return StreamingHttpResponse(stream(), content_type=renderer.media_type)
+
 
 def convert_to_nepali_numbers(number):
     nepali_digits = ["०", "१", "२", "३", "४", "५", "६", "७", "८", "९"]
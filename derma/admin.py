@@ -2,4 +2,5 @@ from django.contrib import admin
 from derma.models import *
 # Register your models here.
 admin.site.register(UserAttempt)
-admin.site.register(AssessmentImage)
\ No newline at end of file
+admin.site.register(AssessmentImage)
+admin.site.register(LesionClass)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class DermaConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'derma'
+
+    def ready(self):
+        import derma.signals  # noqa: F401
@@ -0,0 +1,266 @@
+"""
+Benchmarks for the grading hot path.
+
+Runs on synthetic, seeded lesion layouts and needs neither Postgres nor Redis:
+
+    python -m derma.benchmarks --sizes 1 10 100 --baseline benchmarks/grading.json
+
+exits 1 when a case's p50 is more than --tolerance slower than the committed
+baseline. Timings depend on the machine, so re-record the baseline on the
+machine that runs the check (and commit it with changes that are meant to
+move the numbers):
+
+    python -m derma.benchmarks --baseline benchmarks/grading.json --save-baseline
+
+The `benchmark_grading` management command runs the same suite and adds the
+in-memory part of the Celery task (derma.tasks.apply_grade).
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from derma.spatial import build_grid_index
+from derma.utils import COCO_IOU_THRESHOLDS, calculate_iou, compile_ground_truth, grade_submission
+
+LAYOUTS = ("sparse", "dense", "adversarial")
+SIZES = (1, 10, 100, 1000)
+LESION_CLASSES = ("papule", "pustule", "nodule", "cyst")
+
+# p50 may grow by this fraction over the baseline before it counts as a regression
+DEFAULT_TOLERANCE = 0.25
+
+
+def _lesion(rng, layout, n):
+    if layout == "sparse":
+        # Small lesions on a canvas that grows with n, so overlaps stay rare
+        side = rng.uniform(8, 30)
+        extent = 100 * max(n, 1) ** 0.5
+        x, y = rng.uniform(0, extent), rng.uniform(0, extent)
+    elif layout == "dense":
+        # Crowded acne: large lesions packed into a small area
+        side = rng.uniform(20, 60)
+        extent = 15 * max(n, 1) ** 0.5
+        x, y = rng.uniform(0, extent), rng.uniform(0, extent)
+    elif layout == "adversarial":
+        # Every box overlaps every other one: worst case for the grid index
+        side = rng.uniform(95, 105)
+        x, y = 500 + rng.uniform(-5, 5), 500 + rng.uniform(-5, 5)
+    else:
+        raise ValueError(f"Unknown layout '{layout}', expected one of {LAYOUTS}")
+    return {
+        "x": x,
+        "y": y,
+        "width": side * rng.uniform(0.8, 1.2),
+        "height": side * rng.uniform(0.8, 1.2),
+        "label": rng.choice(LESION_CLASSES),
+    }
+
+
+def generate_case(n, layout, seed=0):
+    """
+    Seeded synthetic submission: `n` ground truth lesions and `n` student boxes.
+    About 70% of the student boxes are jittered copies of real lesions (some
+    with the wrong label), the rest are random, in shuffled drawing order.
+
+    Returns:
+        tuple: (ground_truth_boxes, user_boxes)
+    """
+    rng = random.Random(f"{seed}:{layout}:{n}")
+    ground_truth = [_lesion(rng, layout, n) for _ in range(n)]
+
+    user_boxes = []
+    for i in range(n):
+        if rng.random() < 0.7:
+            box = dict(ground_truth[i])
+            jitter = 0.15 * box["width"]
+            box["x"] += rng.uniform(-jitter, jitter)
+            box["y"] += rng.uniform(-jitter, jitter)
+            if rng.random() < 0.2:
+                box["label"] = rng.choice(LESION_CLASSES)
+        else:
+            box = _lesion(rng, layout, n)
+        user_boxes.append(box)
+    rng.shuffle(user_boxes)
+    return ground_truth, user_boxes
+
+
+def engine_functions():
+    """
+    Benchmarked engines. Each entry builds, from one case, the callable that
+    is timed, so one-off work (like the stored grid index) stays outside.
+    """
+
+    def scalar_iou(ground_truth, user_boxes):
+        return lambda: [calculate_iou(u, g) for u in user_boxes for g in ground_truth]
+
+    def python(ground_truth, user_boxes):
+        return lambda: grade_submission(ground_truth, user_boxes, engine="python")
+
+    def numpy_dense(ground_truth, user_boxes):
+        return lambda: grade_submission(ground_truth, user_boxes, engine="numpy")
+
+    def auto(ground_truth, user_boxes):
+        return lambda: grade_submission(ground_truth, user_boxes, engine="auto")
+
+    def indexed(ground_truth, user_boxes):
+        compiled = compile_ground_truth(ground_truth, build_grid_index(ground_truth))
+        return lambda: grade_submission(compiled, user_boxes)
+
+    def optimal(ground_truth, user_boxes):
+        compiled = compile_ground_truth(ground_truth, build_grid_index(ground_truth))
+        return lambda: grade_submission(compiled, user_boxes, matching="optimal")
+
+    def multi_threshold(ground_truth, user_boxes):
+        compiled = compile_ground_truth(ground_truth, build_grid_index(ground_truth))
+        return lambda: grade_submission(compiled, user_boxes, iou_thresholds=COCO_IOU_THRESHOLDS)
+
+    return {
+        "calculate_iou": scalar_iou,
+        "python": python,
+        "numpy": numpy_dense,
+        "auto": auto,
+        "indexed": indexed,
+        "optimal": optimal,
+        "multi_threshold": multi_threshold,
+    }
+
+
+def time_function(func, min_time=0.2, min_repeats=3, max_repeats=1000):
+    """
+    Calls `func` until `min_time` seconds have passed (bounded by the repeat
+    limits) and returns ops/sec with the p50/p99 latency in milliseconds.
+    """
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < max_repeats:
+        t0 = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - t0)
+        if len(samples) >= min_repeats and time.perf_counter() - started >= min_time:
+            break
+    samples = np.array(samples)
+    return {
+        "ops_per_sec": round(float(1 / samples.mean()), 2),
+        "p50_ms": round(float(np.percentile(samples, 50)) * 1000, 4),
+        "p99_ms": round(float(np.percentile(samples, 99)) * 1000, 4),
+        "repeats": len(samples),
+    }
+
+
+def run_suite(engines=None, layouts=LAYOUTS, sizes=SIZES, seed=0, min_time=0.2, extra_engines=None, log=None):
+    """
+    Times every engine on every layout and size.
+
+    Args:
+        engines (list): Names from engine_functions(), all by default.
+        extra_engines (dict): Additional name -> factory entries (see engine_functions).
+        log (callable): Receives one line per finished case.
+
+    Returns:
+        dict: "engine/layout/size" -> time_function() result.
+    """
+    available = engine_functions()
+    available.update(extra_engines or {})
+    selected = engines or list(available)
+
+    results = {}
+    for layout in layouts:
+        for size in sizes:
+            ground_truth, user_boxes = generate_case(size, layout, seed)
+            for name in selected:
+                if name not in available:
+                    raise ValueError(f"Unknown engine '{name}', expected one of {sorted(available)}")
+                stats = time_function(available[name](ground_truth, user_boxes), min_time=min_time)
+                key = f"{name}/{layout}/{size}"
+                results[key] = stats
+                if log:
+                    log(format_result(key, stats))
+    return results
+
+
+def format_result(key, stats):
+    return (
+        f"{key:<32} {stats['ops_per_sec']:>12.1f} ops/s"
+        f"   p50 {stats['p50_ms']:>10.3f} ms   p99 {stats['p99_ms']:>10.3f} ms"
+    )
+
+
+def compare_to_baseline(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Cases whose p50 got slower than the baseline by more than `tolerance`.
+
+    Returns:
+        list: (key, baseline_p50_ms, current_p50_ms) tuples.
+    """
+    regressions = []
+    for key, stats in results.items():
+        reference = baseline.get(key)
+        if reference and stats["p50_ms"] > reference["p50_ms"] * (1 + tolerance):
+            regressions.append((key, reference["p50_ms"], stats["p50_ms"]))
+    return regressions
+
+
+def add_arguments(parser):
+    """
+    Command line options shared by `python -m derma.benchmarks` and the management command.
+    """
+    parser.add_argument("--engines", nargs="+", help="Engines to run (default: all)")
+    parser.add_argument("--layouts", nargs="+", default=list(LAYOUTS), choices=LAYOUTS)
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(SIZES))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-time", type=float, default=0.2, help="Seconds spent on each case")
+    parser.add_argument("--baseline", help="JSON file with stored results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Write the results to --baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+
+
+def run_from_options(options, log, extra_engines=None):
+    """
+    Runs the suite for parsed options and handles the baseline file.
+
+    Returns:
+        list: Regressions, see compare_to_baseline().
+    """
+    results = run_suite(
+        engines=options["engines"],
+        layouts=options["layouts"],
+        sizes=options["sizes"],
+        seed=options["seed"],
+        min_time=options["min_time"],
+        extra_engines=extra_engines,
+        log=log,
+    )
+
+    baseline_path = options["baseline"]
+    if not baseline_path:
+        return []
+    if options["save_baseline"]:
+        os.makedirs(os.path.dirname(baseline_path) or ".", exist_ok=True)
+        with open(baseline_path, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        log(f"Baseline written to {baseline_path}")
+        return []
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    regressions = compare_to_baseline(results, baseline, options["tolerance"])
+    for key, before, after in regressions:
+        log(f"REGRESSION {key}: p50 {before:.3f} ms -> {after:.3f} ms")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the grading engines")
+    add_arguments(parser)
+    options = vars(parser.parse_args(argv))
+    regressions = run_from_options(options, log=print)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
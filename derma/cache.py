@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+
+from derma.models import AssessmentImage, LesionClass
+from derma.packing import compile_packed_ground_truth
+from derma.utils import compile_ground_truth
+
+# Redis key of one compiled ground truth version
+GROUND_TRUTH_CACHE_KEY = "derma:gt:{image_id}:{version}"
+
+
+class _LRU:
+    """
+    Small thread-safe in-process LRU, the first tier in front of Redis.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def discard(self, image_id):
+        with self._lock:
+            for key in [key for key in self._data if key[0] == image_id]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_cache = _LRU(settings.DERMA_GROUND_TRUTH_LRU_SIZE)
+
+
+def _version(date_modified):
+    # date_modified is bumped on every save(), so it versions the ground truth
+    return "none" if date_modified is None else f"{date_modified.timestamp():.6f}"
+
+
+def _load_ground_truth(image_id):
+    """
+    Reads and compiles one image's ground truth. With DERMA_GROUND_TRUTH_SOURCE
+    = "packed" the JSON column is skipped for images that have packed boxes.
+    """
+    fields = ["id", "ground_truth_index", "date_modified"]
+    # Like the attempt.assessment_image descriptor: soft deleted images still grade
+    images = AssessmentImage._base_manager
+    if settings.DERMA_GROUND_TRUTH_SOURCE == "packed":
+        image = images.only(
+            *fields, "ground_truth_packed", "image_width", "image_height"
+        ).get(id=image_id)
+        if image.ground_truth_packed is not None:
+            class_names = LesionClass.names(set(image.ground_truth_array["class_id"].tolist()) - {0})
+            compiled = compile_packed_ground_truth(
+                image.ground_truth_packed, image.image_width, image.image_height,
+                class_names, image.ground_truth_index,
+            )
+            return image, compiled
+
+    image = images.only(*fields, "ground_truth_labels").get(id=image_id)
+    return image, compile_ground_truth(image.ground_truth_labels, image.ground_truth_index)
+
+
+def get_compiled_ground_truth(image_id, date_modified):
+    """
+    Ground truth of an AssessmentImage as a CompiledGroundTruth.
+
+    Looks in the process LRU, then in CACHES['default'], and only then loads
+    and parses the row. Entries are keyed by (image_id, date_modified) so an
+    edited image is never served stale; callers can get date_modified cheaply
+    with select_related(...).only("assessment_image__date_modified").
+
+    Raises:
+        AssessmentImage.DoesNotExist
+    """
+    key = (image_id, _version(date_modified))
+    compiled = _local_cache.get(key)
+    if compiled is not None:
+        return compiled
+
+    redis_key = GROUND_TRUTH_CACHE_KEY.format(image_id=image_id, version=key[1])
+    compiled = cache.get(redis_key)
+    if compiled is None:
+        image, compiled = _load_ground_truth(image_id)
+        # The row may have changed since the caller read date_modified
+        key = (image_id, _version(image.date_modified))
+        redis_key = GROUND_TRUTH_CACHE_KEY.format(image_id=image_id, version=key[1])
+        cache.set(redis_key, compiled, settings.DERMA_GROUND_TRUTH_CACHE_TIMEOUT)
+
+    _local_cache.set(key, compiled)
+    return compiled
+
+
+def invalidate_compiled_ground_truth(image):
+    """
+    Drops the cached versions of an image. Connected to post_save/post_delete;
+    other processes stop using their copies because the version changes.
+    """
+    _local_cache.discard(image.id)
+    cache.delete(GROUND_TRUTH_CACHE_KEY.format(image_id=image.id, version=_version(image.date_modified)))
@@ -0,0 +1,205 @@
+import asyncio
+import json
+import logging
+
+from channels.db import database_sync_to_async
+from channels.generic.http import AsyncHttpConsumer
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from redis import asyncio as aioredis
+
+from derma.cache import get_compiled_ground_truth
+from derma.events import ATTEMPT_GRADED_CHANNEL, ATTEMPT_GRADED_PATTERN, failed_payload, graded_payload, grading_failed
+from derma.tasks import attempts_for_grading
+
+logger = logging.getLogger(__name__)
+
+# Seconds a request waits for the pub/sub subscription before carrying on without it
+HUB_CONNECT_TIMEOUT = 5
+
+
+class GradedAttemptHub:
+    """
+    One Redis pub/sub subscription per process, fanned out to every request
+    waiting on an attempt. Keeps the number of Redis connections independent
+    of the number of open streams.
+    """
+
+    def __init__(self):
+        self._waiters = {}
+        self._ready = None
+        self._listener = None
+
+    async def _ensure_listening(self):
+        if self._listener is None or self._listener.done():
+            self._ready = asyncio.Event()
+            self._listener = asyncio.ensure_future(self._listen())
+        try:
+            await asyncio.wait_for(self._ready.wait(), HUB_CONNECT_TIMEOUT)
+        except asyncio.TimeoutError:
+            # Redis is unreachable: the request still answers from the DB and times out
+            logger.warning("Graded attempt subscription not ready")
+
+    async def _listen(self):
+        prefix = ATTEMPT_GRADED_CHANNEL.format(attempt_id="")
+        while True:
+            client = aioredis.from_url(settings.CACHE_LOCATION)
+            try:
+                pubsub = client.pubsub()
+                await pubsub.psubscribe(ATTEMPT_GRADED_PATTERN)
+                self._ready.set()
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    attempt_id = int(message["channel"].decode()[len(prefix):])
+                    payload = json.loads(message["data"])
+                    for future in self._waiters.pop(attempt_id, ()):
+                        if not future.done():
+                            future.set_result(payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Graded attempt subscription lost, reconnecting")
+                await asyncio.sleep(1)
+            finally:
+                # Each reconnect opens a new client, the old one must not leak its connections
+                await client.aclose()
+
+    async def subscribe(self, attempt_id):
+        """
+        Future resolved with the graded payload of `attempt_id`. Subscribe
+        before reading the attempt from the DB so no publish can be missed.
+        """
+        await self._ensure_listening()
+        future = asyncio.get_event_loop().create_future()
+        self._waiters.setdefault(attempt_id, set()).add(future)
+        return future
+
+    def unsubscribe(self, attempt_id, future):
+        waiters = self._waiters.get(attempt_id)
+        if waiters is not None:
+            waiters.discard(future)
+            if not waiters:
+                del self._waiters[attempt_id]
+
+
+hub = GradedAttemptHub()
+
+
+@database_sync_to_async
+def get_attempt_state(attempt_id, user_id):
+    """
+    None when the attempt does not exist for this user, the graded payload once
+    it is graded, the failure when grading gave up, otherwise {"status": "processing"}.
+    """
+    attempt = attempts_for_grading().filter(id=attempt_id, user_id=user_id).first()
+    if attempt is None:
+        return None
+    if grading_failed(attempt):
+        return failed_payload(attempt)
+    if not attempt.is_graded:
+        return {"status": "processing"}
+    ground_truth = get_compiled_ground_truth(
+        attempt.assessment_image_id, attempt.assessment_image.date_modified
+    )
+    return graded_payload(attempt, ground_truth)
+
+
+def _encode(payload):
+    return json.dumps(payload, cls=DjangoJSONEncoder).encode()
+
+
+class AttemptResultConsumer(AsyncHttpConsumer):
+    """
+    Base for the push endpoints: waits on the pub/sub hub until the attempt
+    is graded instead of having the client poll AssessmentResultView.
+    """
+
+    timeout_setting = None
+
+    async def handle(self, body):
+        user = self.scope.get("user")
+        if user is None or not user.is_authenticated:
+            return await self.send_json(401, {"error": "Authentication credentials were not provided."})
+
+        attempt_id = self.scope["url_route"]["kwargs"]["attempt_id"]
+        future = await hub.subscribe(attempt_id)
+        try:
+            state = await get_attempt_state(attempt_id, user.id)
+            if state is None:
+                return await self.send_json(404, {"error": "Attempt not found"})
+            if state["status"] in ("complete", "failed"):
+                return await self.send_result(state)
+            await self.wait_for_result(future, getattr(settings, self.timeout_setting))
+        finally:
+            hub.unsubscribe(attempt_id, future)
+
+    async def send_json(self, status, payload):
+        await self.send_response(
+            status, _encode(payload), headers=[(b"Content-Type", b"application/json")]
+        )
+
+    async def send_result(self, payload):
+        raise NotImplementedError
+
+    async def wait_for_result(self, future, timeout):
+        raise NotImplementedError
+
+
+class AttemptEventStreamConsumer(AttemptResultConsumer):
+    """
+    Server-sent events: GET /api/derma/attempts/<id>/events/
+    Emits one `graded` event with the full report and closes the stream.
+    Comment lines keep proxies from closing an idle connection.
+    """
+
+    timeout_setting = "DERMA_RESULT_STREAM_TIMEOUT"
+
+    async def start_stream(self):
+        await self.send_headers(headers=[
+            (b"Content-Type", b"text/event-stream"),
+            (b"Cache-Control", b"no-cache"),
+            (b"X-Accel-Buffering", b"no"),
+        ])
+
+    async def send_result(self, payload):
+        await self.start_stream()
+        await self.send_body(b"event: graded\ndata: " + _encode(payload) + b"\n\n")
+
+    async def wait_for_result(self, future, timeout):
+        await self.start_stream()
+        loop = asyncio.get_event_loop()
+        deadline = loop.time() + timeout
+        keepalive = settings.DERMA_RESULT_STREAM_KEEPALIVE
+
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # The client reconnects (EventSource does so on its own)
+                return await self.send_body(b'event: timeout\ndata: {"status": "processing"}\n\n')
+            try:
+                payload = await asyncio.wait_for(asyncio.shield(future), min(keepalive, remaining))
+            except asyncio.TimeoutError:
+                await self.send_body(b": keepalive\n\n", more_body=True)
+                continue
+            return await self.send_body(b"event: graded\ndata: " + _encode(payload) + b"\n\n")
+
+
+class AttemptLongPollConsumer(AttemptResultConsumer):
+    """
+    Long-poll fallback for clients that can't hold a stream:
+    GET /api/derma/attempts/<id>/wait/ answers as soon as the attempt is
+    graded, or with {"status": "processing"} after DERMA_RESULT_LONG_POLL_TIMEOUT seconds.
+    """
+
+    timeout_setting = "DERMA_RESULT_LONG_POLL_TIMEOUT"
+
+    async def send_result(self, payload):
+        await self.send_json(200, payload)
+
+    async def wait_for_result(self, future, timeout):
+        try:
+            payload = await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            payload = {"status": "processing"}
+        await self.send_json(200, payload)
@@ -0,0 +1,100 @@
+"""
+Content-addressed delivery of AssessmentImage files and renditions.
+
+URLs name the exact bytes they return: the SHA-256 of the source file plus
+the rendition variant (size key and PPOI). Responses are therefore cacheable
+forever, the ETag is computed from the URL alone and a conditional GET is
+answered with 304 before any DB query. File bodies are handed to the web
+server (X-Accel-Redirect / X-Sendfile) when DERMA_MEDIA_SENDFILE is set.
+"""
+import mimetypes
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseRedirect
+from django.urls import reverse
+from django.views.decorators.http import condition, require_safe
+from versatileimagefield.utils import get_url_from_image_key
+
+from derma.models import AssessmentImage
+from derma.renditions import ppoi_key, rendition_name
+
+ORIGINAL_VARIANT = "original"
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# "<size_key>@<ppoi>", e.g. "crop__400x400@0.5x0.5"
+_VARIANT_RE = re.compile(r"^(?P<size_key>\w+)@(?P<ppoi>[\d.]+x[\d.]+)$")
+
+
+def image_variant(image, size_key=None):
+    # Crops depend on the PPOI, so it is part of the address
+    if size_key is None or size_key == "url":
+        return ORIGINAL_VARIANT
+    return f"{size_key}@{ppoi_key(image.image_ppoi)}"
+
+
+def image_delivery_url(image, size_key=None):
+    """
+    Immutable URL of an image or one of its renditions. Images ingested
+    before content hashes existed fall back to their MEDIA_URL address.
+    """
+    if not image.content_hash:
+        return image.image_file.url if size_key is None else get_url_from_image_key(image.image_file, size_key)
+    return reverse("derma-image", kwargs={"content_hash": image.content_hash, "variant": image_variant(image, size_key)})
+
+
+def _etag(request, content_hash, variant):
+    # The URL names the bytes, so the validator needs no lookup
+    return f"{content_hash}-{variant}"
+
+
+def _file_response(storage, name):
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    offload = settings.DERMA_MEDIA_SENDFILE
+    if offload == "x-accel-redirect":
+        response = HttpResponse(content_type=content_type)
+        # nginx decodes the header as a URI: spaces, '%' or '?' in a name must be escaped
+        response["X-Accel-Redirect"] = settings.DERMA_MEDIA_ACCEL_PREFIX + quote(name)
+    elif offload == "x-sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = storage.path(name)
+    else:
+        if not storage.exists(name):
+            raise Http404("Image file missing")
+        response = FileResponse(storage.open(name, "rb"), content_type=content_type)
+    return response
+
+
+@require_safe
+@condition(etag_func=_etag)
+def serve_image(request, content_hash, variant):
+    """
+    GET /api/derma/images/<sha256>/<variant>/
+
+    `variant` is "original" or "<size_key>@<ppoi>" as built by image_variant().
+    """
+    image = AssessmentImage.objects.filter(content_hash=content_hash).only(
+        "id", "image_file", "image_ppoi", "image_width", "image_height", "renditions"
+    ).first()
+    if image is None:
+        raise Http404("Image not found")
+
+    if variant == ORIGINAL_VARIANT:
+        name = image.image_file.name
+    else:
+        match = _VARIANT_RE.match(variant)
+        if match is None or match["ppoi"] != ppoi_key(image.image_ppoi):
+            # Unknown variant or a crop for an older PPOI: those bytes are gone
+            raise Http404("Unknown rendition")
+        size_key = match["size_key"]
+        if size_key not in image.renditions:
+            # Not warmed yet: send the client to the regular on-demand URL, uncached
+            response = HttpResponseRedirect(get_url_from_image_key(image.image_file, size_key))
+            response["Cache-Control"] = "no-cache"
+            return response
+        name = rendition_name(image.image_file, size_key)
+
+    response = _file_response(image.image_file.storage, name)
+    response["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
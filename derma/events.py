@@ -0,0 +1,69 @@
+import json
+import logging
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django_redis import get_redis_connection
+
+from derma.cache import get_compiled_ground_truth
+
+logger = logging.getLogger(__name__)
+
+# Redis pub/sub channel the grading tasks publish a finished report on
+ATTEMPT_GRADED_CHANNEL = "derma:attempt-graded:{attempt_id}"
+ATTEMPT_GRADED_PATTERN = ATTEMPT_GRADED_CHANNEL.format(attempt_id="*")
+
+
+def graded_payload(attempt, ground_truth):
+    """
+    Response body of a graded attempt, shared by the inline, polling and push paths.
+    `ground_truth` is the image's CompiledGroundTruth.
+    """
+    return {
+        "status": "complete",
+        "attempt_id": attempt.id,
+        "score": attempt.iou_score,
+        "feedback": attempt.detailed_report, # e.g. "You missed 2 cysts"
+        # Return the Ground Truths so the Frontend can draw the "Correct" boxes
+        # on top of the student's boxes for visual comparison
+        "ground_truth_boxes": ground_truth.boxes
+    }
+
+
+def grading_failed(attempt):
+    """
+    True when the grading task gave up on the attempt, see derma.tasks.try_grade.
+    """
+    return not attempt.is_graded and "grading_error" in (attempt.detailed_report or {})
+
+
+def failed_payload(attempt):
+    return {
+        "status": "failed",
+        "attempt_id": attempt.id,
+        "error": attempt.detailed_report["grading_error"],
+    }
+
+
+def publish_attempts_graded(attempts):
+    """
+    Pushes the final report (or failure) of freshly graded attempts to the stream consumers
+    (derma.consumers). Call it once the grades are committed. Best effort: a
+    client that misses the message still sees the graded row when it reconnects.
+    """
+    try:
+        pipe = get_redis_connection("default").pipeline(transaction=False)
+        for attempt in attempts:
+            if grading_failed(attempt):
+                payload = failed_payload(attempt)
+            else:
+                ground_truth = get_compiled_ground_truth(
+                    attempt.assessment_image_id, attempt.assessment_image.date_modified
+                )
+                payload = graded_payload(attempt, ground_truth)
+            pipe.publish(
+                ATTEMPT_GRADED_CHANNEL.format(attempt_id=attempt.id),
+                json.dumps(payload, cls=DjangoJSONEncoder),
+            )
+        pipe.execute()
+    except Exception:
+        logger.exception("Could not publish graded attempts")
@@ -0,0 +1,463 @@
+"""
+Staged ingestion of raw images into AssessmentImage rows.
+
+Each file goes through two independent stages that run on their own thread
+pools: prediction (network or model bound) and storage (disk or object store
+bound). Rows are written from the calling thread with bulk_create, so the DB
+connection is never shared between threads.
+"""
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from derma.metrics import INGEST_FILES, stage_timer
+from derma.models import AssessmentImage
+from derma.nms import filter_predictions
+from derma.phash import BKTree, phash_file, to_signed64, to_unsigned64
+from derma.placement import DEFAULT_PLACEMENT_MODE, place_file
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = (".jpg", ".png")
+# Default manifest location, inside the ingested folder
+MANIFEST_FILENAME = ".ingest_manifest.jsonl"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# A source file with its SHA-256 and the stat() values the hash was taken at.
+# phash is only computed for files that need ingesting; near_duplicates holds
+# the BK-tree items (image ids, or content hashes of this run) within radius
+SourceFile = namedtuple(
+    "SourceFile", ["path", "sha256", "size", "mtime_ns", "phash", "near_duplicates"], defaults=(None, ()),
+)
+
+
+def find_images(folder):
+    """
+    Paths of the images in `folder`, sorted so runs are reproducible.
+    """
+    return [
+        os.path.join(folder, filename)
+        for filename in sorted(os.listdir(folder))
+        if filename.endswith(IMAGE_EXTENSIONS)
+    ]
+
+
+# metadata entry recording where ground_truth_labels' x/y sit on a box. Rows
+# stored before it existed held Roboflow centres, see migration 0012
+BOX_ORIGIN_KEY = "box_origin"
+BOX_ORIGIN_TOP_LEFT = "top_left"
+
+
+def prediction_to_boxes(prediction):
+    """
+    Converts a Roboflow style prediction into ground truth boxes.
+
+    Prediction format:
+    {'predictions': [{'x': 100, 'y': 50, 'width': 20, 'height': 20, 'class': 'acne', 'confidence': 0.9}]}
+
+    Roboflow reports the box centre while grading (calculate_iou) and the
+    frontend use the top-left corner, so x and y are shifted here.
+    """
+    return [
+        {
+            "x": pred['x'] - pred['width'] / 2,
+            "y": pred['y'] - pred['height'] / 2,
+            "width": pred['width'],
+            "height": pred['height'],
+            "label": pred['class'],
+        }
+        for pred in prediction['predictions']
+    ]
+
+
+def threshold_predictions(raw_predictions, confidence, overlap):
+    """
+    Ground truth boxes from raw predictions at a confidence/overlap setting
+    (percentages), without calling the model.
+    """
+    return prediction_to_boxes({'predictions': filter_predictions(raw_predictions or [], confidence, overlap)})
+
+
+def prediction_image_size(prediction):
+    """
+    (width, height) reported with a prediction, or (None, None).
+    """
+    image = prediction.get('image') or {}
+    try:
+        return int(image['width']), int(image['height'])
+    except (KeyError, TypeError, ValueError):
+        return None, None
+
+
+def hash_file(path):
+    """
+    SHA-256 hex digest of a file, streamed in HASH_CHUNK_SIZE blocks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class IngestionManifest:
+    """
+    Append-only JSON lines record of the source files already handled:
+    {"path", "size", "mtime_ns", "sha256", "image_id"} per line, later lines win.
+
+    A file whose size and mtime match its entry is not read again, which is
+    what keeps re-runs over a large folder fast. Entries are appended once
+    their rows are committed, so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self._file = None
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line of a crashed run
+                        continue
+                    self.entries[entry["path"]] = entry
+
+    def lookup(self, path, stat):
+        entry = self.entries.get(os.path.abspath(path))
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry
+        return None
+
+    def record(self, source, image_id):
+        entry = {
+            "path": os.path.abspath(source.path),
+            "size": source.size,
+            "mtime_ns": source.mtime_ns,
+            "sha256": source.sha256,
+            "image_id": image_id,
+        }
+        if self.entries.get(entry["path"]) == entry:
+            return
+        self.entries[entry["path"]] = entry
+        if self.path:
+            if self._file is None:
+                self._file = open(self.path, 'a')
+            self._file.write(json.dumps(entry) + "\n")
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def store_image(path, placement=DEFAULT_PLACEMENT_MODE):
+    """
+    Puts the file into the storage of AssessmentImage.image_file and returns
+    the stored name. See derma.placement for the `placement` modes; none of
+    them reads the whole file into memory.
+    """
+    field = AssessmentImage._meta.get_field("image_file")
+    name = field.generate_filename(None, os.path.basename(path))
+    return place_file(field.storage, path, name, placement)
+
+
+class IngestionStats:
+    """
+    Counters of one pipeline run.
+    """
+
+    def __init__(self, total):
+        self.total = total
+        self.ingested = 0
+        self.skipped = 0
+        self.failed = 0
+        self.lesions = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        return self.ingested / max(self.elapsed, 1e-6)
+
+    def __str__(self):
+        return (
+            f"{self.ingested + self.skipped + self.failed}/{self.total} files, {self.ingested} ingested, "
+            f"{self.skipped} skipped, {self.failed} failed, {self.lesions} lesions, {self.rate:.1f} images/s"
+        )
+
+
+class IngestionPipeline:
+    """
+    Runs prediction and storage concurrently and bulk-creates the rows.
+
+    Args:
+        predictor (derma.predictors.Predictor): Gets predictor.batch_size
+            paths per call. Should be set up to return unfiltered predictions:
+            they are stored as raw_predictions and thresholded locally.
+        confidence (float): Minimum confidence in percent for ground_truth_labels.
+        overlap (float): NMS overlap in percent for ground_truth_labels.
+        manifest (IngestionManifest): Files already handled, see scan().
+        near_duplicate_radius (int): Hamming radius of the pHash near-duplicate
+            lookup, negative to turn it off.
+        skip_near_duplicates (bool): Skip near-duplicates instead of only
+            recording them in metadata['near_duplicate_of'].
+        predict_workers (int): Threads making prediction calls.
+        storage_workers (int): Threads writing files to storage.
+        hash_workers (int): Threads hashing new or changed files.
+        placement (str): How files are put into storage, see derma.placement.place_file.
+        renditions (derma.renditions.RenditionWarmer): Entered warmer that
+            gets every created image, or None to leave renditions to later.
+        batch_size (int): Rows per bulk_create.
+        diagnosis_class (str): Stored on every created AssessmentImage.
+        metadata (dict): Stored on every created AssessmentImage.
+        log (callable): Receives progress lines.
+        progress_every (int): Files between two progress lines.
+    """
+
+    def __init__(
+        self, predictor, confidence=40, overlap=30, manifest=None,
+        near_duplicate_radius=-1, skip_near_duplicates=False,
+        predict_workers=4, storage_workers=4, hash_workers=4,
+        placement=DEFAULT_PLACEMENT_MODE, renditions=None, batch_size=100,
+        diagnosis_class="Acne", metadata=None, log=None, progress_every=50,
+    ):
+        self.predictor = predictor
+        self.confidence = confidence
+        self.overlap = overlap
+        self.manifest = manifest or IngestionManifest(None)
+        self.near_duplicate_radius = near_duplicate_radius
+        self.skip_near_duplicates = skip_near_duplicates
+        self.predict_workers = max(predict_workers, 1)
+        self.storage_workers = max(storage_workers, 1)
+        self.hash_workers = max(hash_workers, 1)
+        self.placement = placement
+        self.renditions = renditions
+        self.batch_size = max(batch_size, 1)
+        self.diagnosis_class = diagnosis_class
+        self.metadata = metadata or {}
+        self.log = log or logger.info
+        self.progress_every = max(progress_every, 1)
+
+    def fingerprint(self, path, known=()):
+        """
+        SourceFile of `path`, hashing it only when the manifest has no entry
+        for its current size and mtime. The perceptual hash is computed here,
+        on the hash pool, and only for content missing from `known`.
+        """
+        with stage_timer("read"):
+            stat = os.stat(path)
+            entry = self.manifest.lookup(path, stat)
+        if entry:
+            return SourceFile(path, entry["sha256"], stat.st_size, stat.st_mtime_ns)
+        with stage_timer("hash", nbytes=stat.st_size):
+            sha256 = hash_file(path)
+        if sha256 in known:
+            return SourceFile(path, sha256, stat.st_size, stat.st_mtime_ns)
+        return SourceFile(path, sha256, stat.st_size, stat.st_mtime_ns, self.perceptual_hash(path))
+
+    def perceptual_hash(self, path):
+        if self.near_duplicate_radius < 0:
+            return None
+        try:
+            with stage_timer("phash"):
+                return phash_file(path)
+        except Exception:
+            logger.exception("Could not compute the perceptual hash of %s", path)
+            return None
+
+    def scan(self, paths, known, stats, similar):
+        """
+        Yields the SourceFiles that need prediction. Files whose content is
+        already an AssessmentImage (`known` maps content_hash -> id) or was
+        seen earlier in this run are skipped before any prediction work.
+
+        New files are looked up in `similar`, a BKTree of perceptual hashes,
+        and added to it so later files of the run are compared with them too.
+        """
+        with ThreadPoolExecutor(self.hash_workers, thread_name_prefix="hash") as hash_pool:
+            for source in hash_pool.map(partial(self.fingerprint, known=known), paths):
+                if source.sha256 in known:
+                    stats.skipped += 1
+                    INGEST_FILES.labels(outcome="skipped").inc()
+                    if known[source.sha256] is not None:
+                        self.manifest.record(source, known[source.sha256])
+                    continue
+                if self.near_duplicate_radius >= 0:
+                    if source.phash is None:
+                        # Hash came from the manifest (its image is gone) or the file was
+                        # claimed by a copy earlier in this run, which has since failed
+                        source = source._replace(phash=self.perceptual_hash(source.path))
+                    if source.phash is not None:
+                        matches = similar.search(source.phash, self.near_duplicate_radius)
+                        if matches and self.skip_near_duplicates:
+                            stats.skipped += 1
+                            INGEST_FILES.labels(outcome="near_duplicate").inc()
+                            continue
+                        source = source._replace(near_duplicates=tuple(item for _, item in matches))
+                        similar.add(source.phash, source.sha256)
+                # Claimed now so a copy later in this run is skipped too
+                known[source.sha256] = None
+                yield source
+
+    def predict_batch(self, paths):
+        with stage_timer("predict", items=len(paths)):
+            return self.predictor.predict_batch(paths)
+
+    def store(self, source):
+        with stage_timer("storage_write", nbytes=source.size):
+            return store_image(source.path, self.placement)
+
+    def build_row(self, source, stored_name, prediction, near_duplicates=()):
+        raw_predictions = prediction['predictions']
+        boxes = threshold_predictions(raw_predictions, self.confidence, self.overlap)
+        width, height = prediction_image_size(prediction)
+        row = AssessmentImage(
+            image_file=stored_name,
+            content_hash=source.sha256,
+            image_width=width,
+            image_height=height,
+            diagnosis_class=self.diagnosis_class,
+            raw_predictions=raw_predictions,
+            ground_truth_labels=boxes,
+            perceptual_hash=None if source.phash is None else to_signed64(source.phash),
+            metadata={**self.metadata, BOX_ORIGIN_KEY: BOX_ORIGIN_TOP_LEFT},
+        )
+        if near_duplicates:
+            row.metadata["near_duplicate_of"] = list(near_duplicates)
+        row.refresh_derived_fields()
+        return row
+
+    def flush(self, rows, stats, known):
+        if rows:
+            with stage_timer("db_write", items=len(rows)):
+                AssessmentImage.objects.bulk_create([row for _, row in rows], batch_size=self.batch_size)
+            for source, row in rows:
+                known[source.sha256] = row.id
+                self.manifest.record(source, row.id)
+                if self.renditions is not None:
+                    self.renditions.add(row.id, row.image_file.name, row.image_ppoi)
+            self.manifest.flush()
+            stats.ingested += len(rows)
+            INGEST_FILES.labels(outcome="ingested").inc(len(rows))
+            rows.clear()
+
+    def collect(self, job, rows, stats, storage, known):
+        sources, predicted, stored = job
+        try:
+            predictions = predicted.result()
+        except Exception:
+            logger.exception("Prediction failed for %s", ", ".join(source.path for source in sources))
+            predictions = [None] * len(sources)
+
+        for source, prediction, stored_file in zip(sources, predictions, stored):
+            try:
+                stored_name = stored_file.result()
+            except Exception:
+                logger.exception("Storing %s failed", source.path)
+                stats.failed += 1
+                INGEST_FILES.labels(outcome="failed").inc()
+                # Not in the manifest, so the next run retries it
+                known.pop(source.sha256, None)
+                continue
+            if prediction is None:
+                stats.failed += 1
+                INGEST_FILES.labels(outcome="failed").inc()
+                known.pop(source.sha256, None)
+                # Don't leave an orphan file behind for an image without a row
+                try:
+                    storage.delete(stored_name)
+                except Exception:
+                    logger.exception("Could not remove stored copy of %s", source.path)
+                continue
+
+            # Near-duplicates from this run are known by content hash until their rows exist
+            near_duplicates = [
+                item if isinstance(item, int) else known.get(item) for item in source.near_duplicates
+            ]
+            row = self.build_row(
+                source, stored_name, prediction, [image_id for image_id in near_duplicates if image_id]
+            )
+            rows.append((source, row))
+            stats.lesions += len(row.ground_truth_labels)
+
+    def run(self, paths):
+        """
+        Ingests `paths` and returns the IngestionStats.
+
+        Files already ingested are skipped first (see scan()). The rest are
+        predicted in batches of predictor.batch_size and stored one by one.
+        At most two batches per predict worker are in flight, so memory does
+        not grow with the number of files, and rows are created in input order.
+        """
+        stats = IngestionStats(len(paths))
+        # One query up front, then every duplicate check is a dict lookup
+        known = dict(
+            AssessmentImage.objects.with_deleted()
+            .filter(content_hash__isnull=False)
+            .values_list("content_hash", "id")
+        )
+        similar = BKTree()
+        if self.near_duplicate_radius >= 0:
+            similar = BKTree(
+                (to_unsigned64(phash), image_id)
+                for phash, image_id in AssessmentImage.objects.filter(perceptual_hash__isnull=False)
+                .values_list("perceptual_hash", "id")
+            )
+        storage = AssessmentImage._meta.get_field("image_file").storage
+        batch_size = max(self.predictor.batch_size, 1)
+        max_in_flight = 2 * self.predict_workers
+        in_flight = deque()
+        rows = []
+        logged = 0
+
+        def finish_oldest():
+            nonlocal logged
+            self.collect(in_flight.popleft(), rows, stats, storage, known)
+            if len(rows) >= self.batch_size:
+                self.flush(rows, stats, known)
+            done = stats.ingested + stats.skipped + stats.failed + len(rows)
+            if done - logged >= self.progress_every:
+                logged = done
+                self.log(str(stats))
+
+        def submit(batch):
+            in_flight.append((
+                batch,
+                predict_pool.submit(self.predict_batch, [source.path for source in batch]),
+                [storage_pool.submit(self.store, source) for source in batch],
+            ))
+            if len(in_flight) >= max_in_flight:
+                finish_oldest()
+
+        try:
+            with ThreadPoolExecutor(self.predict_workers, thread_name_prefix="predict") as predict_pool, \
+                    ThreadPoolExecutor(self.storage_workers, thread_name_prefix="storage") as storage_pool:
+                batch = []
+                for source in self.scan(paths, known, stats, similar):
+                    batch.append(source)
+                    if len(batch) == batch_size:
+                        submit(batch)
+                        batch = []
+                if batch:
+                    submit(batch)
+                while in_flight:
+                    finish_oldest()
+
+            self.flush(rows, stats, known)
+        finally:
+            self.manifest.flush()
+        return stats
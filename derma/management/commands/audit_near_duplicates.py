@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from derma.models import AssessmentImage
+from derma.phash import BKTree, phash_file, to_signed64, to_unsigned64
+
+# Rows hashed and written per round, bounds the rows held in memory
+BACKFILL_BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = 'Lists groups of near-duplicate AssessmentImages by perceptual hash distance'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--radius', type=int, default=settings.DERMA_NEAR_DUPLICATE_RADIUS, help='Hamming radius')
+        parser.add_argument('--backfill', action='store_true', help='First compute missing perceptual hashes from the image files')
+        parser.add_argument('--workers', type=int, default=4, help='Threads computing hashes for --backfill')
+        parser.add_argument('--limit', type=int, default=50, help='Groups to print, largest first')
+
+    def image_phash(self, image_id, name):
+        try:
+            with AssessmentImage._meta.get_field("image_file").storage.open(name, 'rb') as f:
+                return image_id, phash_file(f)
+        except Exception as e:
+            self.stderr.write(f"Image {image_id}: {e}")
+            return image_id, None
+
+    def backfill(self, workers):
+        missing = AssessmentImage.objects.filter(perceptual_hash__isnull=True).exclude(image_file="")
+        rows = missing.values_list("id", "image_file").iterator(chunk_size=2000)
+        done = 0
+        with ThreadPoolExecutor(workers) as pool:
+            # pool.map() submits its whole input at once, so it is fed one batch at a time
+            while True:
+                chunk = list(islice(rows, BACKFILL_BATCH_SIZE))
+                if not chunk:
+                    break
+                batch = [
+                    AssessmentImage(id=image_id, perceptual_hash=to_signed64(phash))
+                    for image_id, phash in pool.map(lambda row: self.image_phash(*row), chunk)
+                    if phash is not None
+                ]
+                AssessmentImage.objects.bulk_update(batch, ["perceptual_hash"])
+                done += len(batch)
+        self.stdout.write(f"Computed {done} perceptual hashes.")
+
+    def handle(self, *args, **options):
+        radius = options['radius']
+        if radius < 0:
+            raise CommandError('--radius must be 0 or more')
+        if options['backfill']:
+            self.backfill(options['workers'])
+
+        hashes = {
+            image_id: to_unsigned64(phash)
+            for image_id, phash in AssessmentImage.objects.filter(perceptual_hash__isnull=False)
+            .values_list("id", "perceptual_hash")
+        }
+        tree = BKTree((phash, image_id) for image_id, phash in hashes.items())
+
+        # Union-find over every pair within the radius
+        parent = {}
+
+        def find(image_id):
+            parent.setdefault(image_id, image_id)
+            while parent[image_id] != image_id:
+                parent[image_id] = parent[parent[image_id]]
+                image_id = parent[image_id]
+            return image_id
+
+        closest = {}
+        for image_id, phash in hashes.items():
+            for distance, other_id in tree.search(phash, radius):
+                if other_id == image_id:
+                    continue
+                parent[find(other_id)] = find(image_id)
+                closest[image_id] = min(distance, closest.get(image_id, distance))
+
+        groups = {}
+        for image_id in parent:
+            groups.setdefault(find(image_id), []).append(image_id)
+        groups = sorted((sorted(ids) for ids in groups.values() if len(ids) > 1), key=lambda ids: (-len(ids), ids[0]))
+
+        for ids in groups[:options['limit']]:
+            distances = ", ".join(f"{image_id}:{closest[image_id]}" for image_id in ids)
+            self.stdout.write(f"{len(ids)} images (id:closest distance) {distances}")
+
+        duplicates = sum(len(ids) - 1 for ids in groups)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(hashes)} hashed images, {len(groups)} near-duplicate groups, '
+            f'{duplicates} images beyond the first of each group (radius {radius}).'
+        ))
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from derma.models import AssessmentImage
+from derma.spatial import GRID_INDEX_VERSION, is_valid_index
+
+# Columns rewritten for every image
+BACKFILL_FIELDS = ["image_width", "image_height", "ground_truth_index", "ground_truth_packed", "date_modified"]
+
+
+class Command(BaseCommand):
+    help = 'Fills missing image sizes from the files and rebuilds the grid index and packed ground truth'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', type=int, action='append', dest='images', help='AssessmentImage id (repeatable)')
+        parser.add_argument('--all', action='store_true', help='Rebuild every image, not only incomplete ones')
+        parser.add_argument('--batch-size', type=int, default=500, help='Images per bulk_update')
+
+    def handle(self, *args, **options):
+        images = AssessmentImage.objects.with_deleted().filter(ground_truth_labels__isnull=False).order_by('id').only(
+            'id', 'image_file', 'image_width', 'image_height', 'ground_truth_labels', 'ground_truth_index',
+            'ground_truth_packed',
+        )
+        if options['images']:
+            images = images.filter(id__in=options['images'])
+        if not options['all']:
+            images = images.filter(
+                Q(image_width__isnull=True) | Q(ground_truth_index__isnull=True) | Q(ground_truth_packed__isnull=True)
+                | ~Q(ground_truth_index__version=GRID_INDEX_VERSION)
+            )
+
+        updated = unreadable = 0
+        batch = []
+        now = timezone.now()
+        for image in images.iterator(chunk_size=options['batch_size']):
+            if not (image.image_width and image.image_height) and image.image_file:
+                image.image_width, image.image_height = image.read_image_size()
+                if not image.image_width:
+                    unreadable += 1
+
+            stale_index = not is_valid_index(image.ground_truth_index, image.ground_truth_labels)
+            image.refresh_derived_fields(now, rebuild_index=options['all'] or stale_index)
+            batch.append(image)
+            updated += 1
+            if len(batch) >= options['batch_size']:
+                AssessmentImage.objects.bulk_update(batch, BACKFILL_FIELDS)
+                batch = []
+        if batch:
+            AssessmentImage.objects.bulk_update(batch, BACKFILL_FIELDS)
+
+        if unreadable:
+            self.stdout.write(self.style.WARNING(f'{unreadable} image files could not be read, left unpacked.'))
+        self.stdout.write(self.style.SUCCESS(f'Backfilled {updated} images.'))
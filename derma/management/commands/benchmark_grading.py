@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+from derma import benchmarks
+from derma.models import AssessmentImage, UserAttempt
+from derma.spatial import build_grid_index
+from derma.tasks import apply_grade
+from derma.utils import compile_ground_truth
+
+
+def task_engine(ground_truth, user_boxes):
+    """
+    The in-memory part of grade_student_attempt: apply_grade() on an unsaved
+    attempt with the ground truth the cache would hand out. No DB, no Redis.
+    """
+    compiled = compile_ground_truth(ground_truth, build_grid_index(ground_truth))
+    image = AssessmentImage(id=1, ground_truth_labels=ground_truth)
+
+    def run():
+        attempt = UserAttempt(assessment_image=image, user_boxes=user_boxes)
+        return apply_grade(attempt, compiled)
+
+    return run
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the grading engines on synthetic lesion layouts (no Postgres or Redis needed)'
+
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        benchmarks.add_arguments(parser)
+
+    def handle(self, *args, **options):
+        regressions = benchmarks.run_from_options(
+            options,
+            log=self.stdout.write,
+            extra_engines={"grade_student_attempt": task_engine},
+        )
+        if regressions:
+            raise CommandError(f"{len(regressions)} benchmark(s) slower than the baseline.")
+        self.stdout.write(self.style.SUCCESS('Benchmarks complete.'))
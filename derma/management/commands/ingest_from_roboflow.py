@@ -1,67 +1,119 @@
-from django.core.management.base import BaseCommand
-from django.core.files.base import ContentFile
-from derma.models import AssessmentImage
-from roboflow import Roboflow
-import requests
 import os
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from derma.ingestion import MANIFEST_FILENAME, IngestionManifest, IngestionPipeline, find_images
+from derma.metrics import write_metrics_file
+from derma.placement import DEFAULT_PLACEMENT_MODE, PLACEMENT_MODES
+from derma.predictors import PREDICTOR_BACKENDS, get_predictor
+from derma.renditions import RenditionWarmer
+
 
 class Command(BaseCommand):
     help = 'Fetches images and AI-predictions from Roboflow to build the Training Database'
 
-    def handle(self, *args, **kwargs):
-        # 1. SETUP ROBOFLOW
-        # (You get these from your Roboflow Dashboard)
-        rf = Roboflow(api_key="vfNK8WTwjjyHQtJ7MzsG")
-        project = rf.workspace().project("DermaVal")
-        model = project.version(1).model
-
-        # 2. DEFINE IMAGE SOURCE
+    def add_arguments(self, parser):
         # For this script, let's say we have a local folder of raw images
         # In a real PhD setup, this might be an S3 bucket or a hospital folder
-        image_folder = "./raw_images/" 
+        parser.add_argument('--folder', default='./raw_images/', help='Folder with the raw images')
+        parser.add_argument('--predictor', default='roboflow', choices=sorted(PREDICTOR_BACKENDS), help='Prediction backend')
+        parser.add_argument('--model', help="Weights (.pt/.onnx) for the 'local' backend")
+        parser.add_argument('--fixture', help="JSON predictions by filename for the 'fixture' backend")
+        parser.add_argument('--confidence', type=int, default=40, help='Minimum confidence in percent')
+        parser.add_argument('--overlap', type=int, default=30, help='NMS overlap in percent')
+        parser.add_argument('--predict-batch-size', type=int, help='Images per prediction call (backend default if omitted)')
+        parser.add_argument('--manifest', help=f'Manifest of handled files (default: <folder>/{MANIFEST_FILENAME})')
+        parser.add_argument(
+            '--near-duplicate-radius', type=int, default=settings.DERMA_NEAR_DUPLICATE_RADIUS,
+            help='pHash Hamming radius for near-duplicate detection, -1 to turn it off',
+        )
+        parser.add_argument('--skip-near-duplicates', action='store_true', help='Skip near-duplicates instead of flagging them')
+        parser.add_argument('--hash-workers', type=int, default=4, help='Concurrent SHA-256 hashing of new files')
+        parser.add_argument('--predict-workers', type=int, default=4, help='Concurrent prediction calls')
+        parser.add_argument('--storage-workers', type=int, default=4, help='Concurrent storage writes')
+        parser.add_argument(
+            '--placement', default=DEFAULT_PLACEMENT_MODE, choices=PLACEMENT_MODES,
+            help='How files reach MEDIA_ROOT: reflink/kernel copy (auto), hardlink, reflink, copy or stream',
+        )
+        parser.add_argument('--skip-renditions', action='store_true', help="Don't pre-generate renditions")
+        parser.add_argument('--rendition-workers', type=int, help='Processes generating renditions (default: CPU count)')
+        parser.add_argument('--batch-size', type=int, default=100, help='Rows per bulk_create')
+        parser.add_argument('--metrics-file', help='Write Prometheus text format stage metrics here on every progress line')
+        parser.add_argument('--progress-every', type=int, default=50, help='Files between progress lines')
+
+    def get_predictor(self, options):
+        # The model returns everything above the raw floor without NMS; the pipeline
+        # stores that and applies --confidence/--overlap itself (derma.nms)
+        kwargs = {
+            'confidence': settings.DERMA_RAW_PREDICTION_CONFIDENCE,
+            'overlap': 100,
+            'batch_size': options['predict_batch_size'],
+        }
+        if options['predictor'] == 'local':
+            kwargs['model_path'] = options['model']
+        elif options['predictor'] == 'fixture':
+            kwargs['fixture_path'] = options['fixture']
+        try:
+            return get_predictor(options['predictor'], **kwargs)
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
 
-        self.stdout.write("Starting AI Ingestion...")
+    def handle(self, *args, **options):
+        metrics_file = options['metrics_file']
 
-        for filename in os.listdir(image_folder):
-            if not filename.endswith((".jpg", ".png")):
-                continue
+        def log(line):
+            self.stdout.write(line)
+            if metrics_file:
+                write_metrics_file(metrics_file)
 
-            file_path = os.path.join(image_folder, filename)
-            
-            # --- THE AI MOMENT ---
-            # We pass the image to the Neural Network
-            prediction = model.predict(file_path, confidence=40, overlap=30).json()
-            
-            # Prediction format from Roboflow:
-            # {'predictions': [{'x': 100, 'y': 50, 'width': 20, 'height': 20, 'class': 'acne', 'confidence': 0.9}]}
-            
-            ground_truth_list = []
-            
-            # 3. CONVERT AI DATA TO DJANGO DATA
-            for pred in prediction['predictions']:
-                ground_truth_list.append({
-                    "x": pred['x'],
-                    "y": pred['y'],
-                    "width": pred['width'],
-                    "height": pred['height'],
-                    "label": pred['class']
-                })
+        # 1. SETUP THE PREDICTOR
+        predictor = self.get_predictor(options)
 
-            # 4. SAVE TO DATABASE
-            # This allows the "Student" to grade themselves against the "AI's" knowledge
-            with open(file_path, 'rb') as f:
-                img_content = ContentFile(f.read())
-                
-                # Create the entry in your database
-                assessment = AssessmentImage.objects.create(
+        # 2. DEFINE IMAGE SOURCE
+        paths = find_images(options['folder'])
+        self.stdout.write(
+            f"Starting AI Ingestion of {len(paths)} images with the '{options['predictor']}' "
+            f"predictor ({predictor.batch_size} per call)..."
+        )
+
+        # 3. PREDICT AND STORE CONCURRENTLY, 4. SAVE TO DATABASE IN BATCHES
+        # This allows the "Student" to grade themselves against the "AI's" knowledge
+        # Files already ingested are skipped by content hash, see IngestionPipeline.scan
+        manifest = IngestionManifest(options['manifest'] or os.path.join(options['folder'], MANIFEST_FILENAME))
+        if options['skip_renditions']:
+            warmer = nullcontext()
+        else:
+            warmer = RenditionWarmer(workers=options['rendition_workers'], log=log)
+
+        try:
+            with warmer as renditions:
+                pipeline = IngestionPipeline(
+                    predictor,
+                    confidence=options['confidence'],
+                    overlap=options['overlap'],
+                    manifest=manifest,
+                    near_duplicate_radius=options['near_duplicate_radius'],
+                    skip_near_duplicates=options['skip_near_duplicates'],
+                    predict_workers=options['predict_workers'],
+                    storage_workers=options['storage_workers'],
+                    hash_workers=options['hash_workers'],
+                    placement=options['placement'],
+                    renditions=renditions,
+                    batch_size=options['batch_size'],
                     diagnosis_class="Acne", # You can make this dynamic based on the majority label
-                    ground_truth_labels=ground_truth_list,
-                    metadata={"source": "Roboflow_Model_v1", "ai_confidence": 0.9}
+                    metadata={
+                        "source": predictor.source,
+                        "ai_confidence": options['confidence'] / 100,
+                        "ai_overlap": options['overlap'] / 100,
+                    },
+                    log=log,
+                    progress_every=options['progress_every'],
                 )
-                
-                # Save the image file to VersatileImageField
-                assessment.image_file.save(filename, img_content, save=True)
-
-            self.stdout.write(f"Ingested {filename} with {len(ground_truth_list)} lesions detected by AI.")
+                stats = pipeline.run(paths)
+        finally:
+            manifest.close()
 
-        self.stdout.write(self.style.SUCCESS('AI Ingestion Complete.'))
\ No newline at end of file
+        log(f"{stats} in {stats.elapsed:.1f}s")
+        self.stdout.write(self.style.SUCCESS('AI Ingestion Complete.'))
@@ -0,0 +1,214 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from derma.cache import get_compiled_ground_truth
+from derma.models import AssessmentImage, UserAttempt
+from derma.results import invalidate_results
+from derma.tasks import GRADED_FIELDS, grading_options
+from derma.utils import grade_submission
+
+logger = logging.getLogger(__name__)
+
+
+def grade_chunk(rows, ground_truths, options, grader_version):
+    """
+    Runs in a worker process: pure grading, no DB access. An attempt that
+    can't be graded (malformed user_boxes) is recorded as failed like
+    derma.tasks.try_grade does, so it doesn't abort the run or every --resume.
+
+    Args:
+        rows (list): (attempt_id, image_id, user_boxes) tuples.
+        ground_truths (dict): image_id -> CompiledGroundTruth.
+
+    Returns:
+        list: (attempt_id, iou_score, detailed_report, is_graded) tuples.
+    """
+    graded = []
+    for attempt_id, image_id, user_boxes in rows:
+        try:
+            results = grade_submission(ground_truths[image_id], user_boxes, **options)
+        except Exception as exc:
+            logger.exception("Could not regrade attempt %s", attempt_id)
+            report = {"grading_error": f"{type(exc).__name__}: {exc}", "grader_version": grader_version}
+            graded.append((attempt_id, None, report, False))
+            continue
+        results['detailed_report']['grader_version'] = grader_version
+        graded.append((attempt_id, results['iou_score'], results['detailed_report'], True))
+    return graded
+
+
+class InlineExecutor:
+    """
+    Stand-in for ProcessPoolExecutor when --workers 0.
+    """
+
+    class _Done:
+        def __init__(self, value):
+            self._value = value
+
+        def result(self):
+            return self._value
+
+    def submit(self, func, *args):
+        return self._Done(func(*args))
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class Command(BaseCommand):
+    help = 'Regrades stored UserAttempts in chunks with the current grading rules'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', type=int, action='append', dest='images', help='AssessmentImage id (repeatable)')
+        parser.add_argument('--user', type=int, action='append', dest='users', help='User id (repeatable)')
+        parser.add_argument('--since', help='Only attempts created at or after this date/datetime')
+        parser.add_argument('--until', help='Only attempts created before this date/datetime')
+        parser.add_argument('--grader-version', help="Only attempts graded with this grader version ('none' for unversioned)")
+        parser.add_argument('--outdated', action='store_true', help='Only attempts not graded with DERMA_GRADER_VERSION')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Attempts per chunk')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Grading processes, 0 grades in this process')
+        parser.add_argument('--checkpoint', help='JSON file recording the last regraded attempt id')
+        parser.add_argument('--resume', action='store_true', help='Continue after the id stored in --checkpoint')
+
+    def _parse_moment(self, value):
+        moment = parse_datetime(value)
+        if moment is None:
+            day = parse_date(value)
+            if day is None:
+                raise CommandError(f"Invalid date '{value}'")
+            moment = datetime.combine(day, datetime.min.time())
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def get_queryset(self, options):
+        attempts = UserAttempt.objects.all()
+        if options['images']:
+            attempts = attempts.filter(assessment_image_id__in=options['images'])
+        if options['users']:
+            attempts = attempts.filter(user_id__in=options['users'])
+        if options['since']:
+            attempts = attempts.filter(date_created__gte=self._parse_moment(options['since']))
+        if options['until']:
+            attempts = attempts.filter(date_created__lt=self._parse_moment(options['until']))
+        if options['grader_version'] == 'none':
+            attempts = attempts.exclude(detailed_report__has_key='grader_version')
+        elif options['grader_version']:
+            attempts = attempts.filter(detailed_report__grader_version=options['grader_version'])
+        if options['outdated']:
+            attempts = attempts.exclude(detailed_report__grader_version=settings.DERMA_GRADER_VERSION)
+        return attempts.order_by('id')
+
+    def read_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f).get('last_id')
+
+    def write_checkpoint(self, path, last_id, regraded):
+        if not path:
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_id': last_id, 'regraded': regraded, 'updated': timezone.now().isoformat()}, f)
+        os.replace(tmp_path, path)
+
+    def iter_chunks(self, attempts, chunk_size):
+        rows = attempts.values_list('id', 'assessment_image_id', 'user_boxes').iterator(chunk_size=chunk_size)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def load_ground_truths(self, chunk):
+        image_ids = {image_id for _, image_id, _ in chunk}
+        versions = AssessmentImage.objects.filter(id__in=image_ids).values_list('id', 'date_modified')
+        return {image_id: get_compiled_ground_truth(image_id, date_modified) for image_id, date_modified in versions}
+
+    def save_chunk(self, graded):
+        now = timezone.now()
+        attempts = [
+            UserAttempt(
+                id=attempt_id, iou_score=iou_score, detailed_report=report, is_graded=is_graded, date_modified=now
+            )
+            for attempt_id, iou_score, report, is_graded in graded
+        ]
+        UserAttempt.objects.bulk_update(attempts, GRADED_FIELDS)
+        # AssessmentResultView would keep serving the old reports
+        invalidate_results([attempt.id for attempt in attempts])
+
+    def handle(self, *args, **options):
+        if options['resume'] and not options['checkpoint']:
+            raise CommandError('--resume needs --checkpoint')
+
+        attempts = self.get_queryset(options)
+        regraded = 0
+        failed = 0
+        if options['resume']:
+            last_id = self.read_checkpoint(options['checkpoint'])
+            if last_id is not None:
+                attempts = attempts.filter(id__gt=last_id)
+                self.stdout.write(f"Resuming after attempt {last_id}")
+
+        grading = grading_options()
+        workers = options['workers']
+        if workers > 0:
+            # Spawned, not forked: the pool starts its workers at the first submit(),
+            # after queries have opened the DB connection a fork would share
+            executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=django.setup
+            )
+        else:
+            executor = InlineExecutor()
+
+        # Chunks in flight are bounded so memory stays flat on a full-table run
+        max_in_flight = max(workers, 1) * 2
+        in_flight = deque()
+        started = time.monotonic()
+
+        def finish_oldest():
+            nonlocal regraded, failed
+            last_id, future = in_flight.popleft()
+            graded = future.result()
+            self.save_chunk(graded)
+            regraded += len(graded)
+            failed += sum(1 for *_, is_graded in graded if not is_graded)
+            # Chunks finish in id order, so everything up to last_id is done
+            self.write_checkpoint(options['checkpoint'], last_id, regraded)
+            rate = regraded / max(time.monotonic() - started, 1e-6)
+            self.stdout.write(f"Regraded {regraded} attempts (up to id {last_id}, {rate:.0f}/s)")
+
+        try:
+            for chunk in self.iter_chunks(attempts, options['chunk_size']):
+                ground_truths = self.load_ground_truths(chunk)
+                # Attempts on soft-deleted images keep their last grade
+                rows = [row for row in chunk if row[1] in ground_truths]
+                future = executor.submit(grade_chunk, rows, ground_truths, grading, settings.DERMA_GRADER_VERSION)
+                in_flight.append((chunk[-1][0], future))
+                if len(in_flight) >= max_in_flight:
+                    finish_oldest()
+            while in_flight:
+                finish_oldest()
+        finally:
+            executor.shutdown(wait=True)
+
+        if failed:
+            self.stdout.write(self.style.WARNING(f'{failed} attempts could not be graded, see their grading_error.'))
+        self.stdout.write(self.style.SUCCESS(f'Regrade complete: {regraded} attempts.'))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from derma.ingestion import threshold_predictions
+from derma.models import AssessmentImage
+
+# Columns rewritten for every image
+RETHRESHOLD_FIELDS = ["ground_truth_labels", "ground_truth_index", "ground_truth_packed", "metadata", "date_modified"]
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds ground_truth_labels from the stored raw predictions at a new confidence/overlap, without inference'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--confidence', type=float, default=40, help='Minimum confidence in percent')
+        parser.add_argument('--overlap', type=float, default=30, help='NMS overlap in percent')
+        parser.add_argument('--image', type=int, action='append', dest='images', help='AssessmentImage id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Images per bulk_update')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how the lesion count would change')
+
+    def handle(self, *args, **options):
+        confidence, overlap = options['confidence'], options['overlap']
+        images = AssessmentImage.objects.filter(raw_predictions__isnull=False).order_by('id').only(
+            'id', 'raw_predictions', 'ground_truth_labels', 'image_width', 'image_height', 'metadata'
+        )
+        if options['images']:
+            images = images.filter(id__in=options['images'])
+
+        updated = lesions_before = lesions_after = 0
+        batch = []
+
+        def flush():
+            if batch and not options['dry_run']:
+                AssessmentImage.objects.bulk_update(batch, RETHRESHOLD_FIELDS)
+            batch.clear()
+
+        now = timezone.now()
+        for image in images.iterator(chunk_size=options['batch_size']):
+            boxes = threshold_predictions(image.raw_predictions, confidence, overlap)
+            lesions_before += len(image.ground_truth_labels or [])
+            lesions_after += len(boxes)
+
+            image.ground_truth_labels = boxes
+            image.metadata = {**(image.metadata or {}), "ai_confidence": confidence / 100, "ai_overlap": overlap / 100}
+            image.refresh_derived_fields(now)
+            batch.append(image)
+            updated += 1
+            if len(batch) >= options['batch_size']:
+                flush()
+        flush()
+
+        verb = 'Would rebuild' if options['dry_run'] else 'Rebuilt'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {updated} images at confidence {confidence}% / overlap {overlap}%: '
+            f'{lesions_before} -> {lesions_after} lesions.'
+        ))
+        if updated and not options['dry_run']:
+            self.stdout.write('Run `manage.py regrade_attempts --image ...` to regrade attempts on these images.')
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from derma.metrics import write_metrics_file
+from derma.models import AssessmentImage
+from derma.renditions import RenditionWarmer, is_warm
+
+
+class Command(BaseCommand):
+    help = 'Pre-generates the configured VersatileImageField renditions of AssessmentImages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--image', type=int, action='append', dest='images', help='AssessmentImage id (repeatable)')
+        parser.add_argument('--force', action='store_true', help='Regenerate images already recorded as warm')
+        parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+        parser.add_argument('--chunk-size', type=int, default=20, help='Images per worker task')
+        parser.add_argument('--metrics-file', help='Write Prometheus text format rendition metrics here')
+
+    def handle(self, *args, **options):
+        images = AssessmentImage.objects.exclude(image_file="").order_by("id")
+        if options['images']:
+            images = images.filter(id__in=options['images'])
+
+        skipped = 0
+        with RenditionWarmer(workers=options['workers'], chunk_size=options['chunk_size'], log=self.stdout.write) as warmer:
+            rows = images.values_list("id", "image_file", "image_ppoi", "renditions").iterator(chunk_size=2000)
+            for image_id, name, ppoi, renditions in rows:
+                if not options['force'] and is_warm(renditions, warmer.size_keys):
+                    skipped += 1
+                    continue
+                warmer.add(image_id, name, ppoi)
+
+        if options['metrics_file']:
+            write_metrics_file(options['metrics_file'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Renditions warmed for {warmer.warmed} images ({warmer.failed} incomplete, {skipped} already warm).'
+        ))
@@ -0,0 +1,97 @@
+"""
+Prometheus metrics of the ingestion pipeline.
+
+Every stage (read, hash, predict, storage_write, db_write, rendition) reports
+its latency and the number of images and bytes it handled, so a slow run
+shows whether it is bound by inference, storage or the DB.
+
+Batch commands don't live long enough to be scraped: write_metrics_file()
+dumps the metrics in the text exposition format for node_exporter's textfile
+collector or a pushgateway. With PROMETHEUS_MULTIPROC_DIR set, the file
+aggregates every process that wrote to that directory.
+"""
+import os
+import time
+
+from prometheus_client import REGISTRY, CollectorRegistry, Counter, Histogram, multiprocess, write_to_textfile
+
+INGEST_STAGES = ("read", "hash", "phash", "predict", "storage_write", "db_write", "rendition")
+
+# Per call: one file for read/hash/storage_write, one batch for predict/db_write
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+INGEST_STAGE_SECONDS = Histogram(
+    "derma_ingest_stage_seconds",
+    "Time spent in one call of an ingestion stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+INGEST_STAGE_ITEMS = Counter(
+    "derma_ingest_stage_items_total",
+    "Images that went through an ingestion stage",
+    ["stage"],
+)
+INGEST_STAGE_BYTES = Counter(
+    "derma_ingest_stage_bytes_total",
+    "Bytes read or written by an ingestion stage",
+    ["stage"],
+)
+INGEST_STAGE_ERRORS = Counter(
+    "derma_ingest_stage_errors_total",
+    "Failed calls of an ingestion stage",
+    ["stage"],
+)
+INGEST_FILES = Counter(
+    "derma_ingest_files_total",
+    "Source files by outcome (ingested, skipped, near_duplicate, failed)",
+    ["outcome"],
+)
+
+
+class stage_timer:
+    """
+    Context manager timing one call of an ingestion stage:
+
+        with stage_timer("hash", items=1, nbytes=size):
+            ...
+
+    Exceptions are counted as stage errors and re-raised.
+    """
+
+    def __init__(self, stage, items=1, nbytes=0):
+        self.stage = stage
+        self.items = items
+        self.nbytes = nbytes
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe_stage(self.stage, time.perf_counter() - self._started, self.items, error=exc_type is not None)
+        if exc_type is None and self.nbytes:
+            INGEST_STAGE_BYTES.labels(stage=self.stage).inc(self.nbytes)
+        return False
+
+
+def observe_stage(stage, seconds, items=1, error=False):
+    """
+    Records a stage call timed elsewhere, e.g. in a worker process.
+    """
+    INGEST_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+    if error:
+        INGEST_STAGE_ERRORS.labels(stage=stage).inc()
+    elif items:
+        INGEST_STAGE_ITEMS.labels(stage=stage).inc(items)
+
+
+def write_metrics_file(path):
+    """
+    Writes the current metrics to `path` (atomically) in the Prometheus text format.
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR") or os.environ.get("prometheus_multiproc_dir"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    write_to_textfile(path, registry)
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+from derma.spatial import build_grid_index
+
+
+def build_ground_truth_indexes(apps, schema_editor):
+    AssessmentImage = apps.get_model('derma', 'AssessmentImage')
+    images = AssessmentImage.objects.filter(ground_truth_labels__isnull=False).only('id', 'ground_truth_labels')
+    for image in images.iterator():
+        image.ground_truth_index = build_grid_index(image.ground_truth_labels)
+        image.save(update_fields=['ground_truth_index'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('derma', '0003_auto_20260108_2116'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentimage',
+            name='ground_truth_index',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(build_ground_truth_indexes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('derma', '0004_assessmentimage_ground_truth_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentimage',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('derma', '0005_assessmentimage_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentimage',
+            name='renditions',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('derma', '0007_packed_ground_truth'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='assessmentimage',
+            name='raw_predictions',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('derma', '0009_assessmentimage_perceptual_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='userattempt',
+            index=models.Index(fields=['date_created', 'id'], name='derma_attempt_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userattempt',
+            index=models.Index(fields=['user', 'date_created', 'id'], name='derma_attempt_user_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('derma', '0010_userattempt_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='userattempt',
+            name='derma_attempt_user_keyset_idx',
+        ),
+        migrations.AddIndex(
+            model_name='userattempt',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['user', 'date_created', 'id'], name='derma_attempt_live_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='userattempt',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['deleted_date'], name='derma_attempt_purge_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assessmentimage',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['diagnosis_class', 'id'], name='derma_image_live_class_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='assessmentimage',
+            index=models.Index(condition=models.Q(('is_deleted', True)), fields=['deleted_date'], name='derma_image_purge_idx'),
+        ),
+    ]
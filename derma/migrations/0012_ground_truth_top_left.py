@@ -0,0 +1,53 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:12
+
+from django.db import migrations
+from django.utils import timezone
+
+CONVERTED_FIELDS = ['ground_truth_labels', 'ground_truth_index', 'ground_truth_packed', 'metadata', 'date_modified']
+BATCH_SIZE = 500
+
+
+def centres_to_top_left(apps, schema_editor):
+    """
+    Ingestion used to store Roboflow box centres in ground_truth_labels, the
+    grader and the frontend read x/y as the top-left corner. Rows without
+    metadata['box_origin'] are shifted by half a box, except those ingested
+    with raw predictions, which were already converted.
+
+    The grid index and packed boxes of shifted rows are cleared (grading falls
+    back to the JSON boxes); `manage.py backfill_ground_truth` rebuilds them.
+    """
+    AssessmentImage = apps.get_model('derma', 'AssessmentImage')
+    now = timezone.now()
+    batch = []
+    images = AssessmentImage.objects.filter(ground_truth_labels__isnull=False).exclude(
+        metadata__has_key='box_origin'
+    )
+    for image in images.only('id', 'ground_truth_labels', 'raw_predictions', 'metadata').iterator(chunk_size=BATCH_SIZE):
+        if image.raw_predictions is None:
+            image.ground_truth_labels = [
+                {**box, 'x': box['x'] - box['width'] / 2, 'y': box['y'] - box['height'] / 2}
+                for box in image.ground_truth_labels
+            ]
+            image.ground_truth_index = None
+            image.ground_truth_packed = None
+        image.metadata = {**(image.metadata or {}), 'box_origin': 'top_left'}
+        # Versions the compiled ground truth cache
+        image.date_modified = now
+        batch.append(image)
+        if len(batch) >= BATCH_SIZE:
+            AssessmentImage.objects.bulk_update(batch, CONVERTED_FIELDS)
+            batch = []
+    if batch:
+        AssessmentImage.objects.bulk_update(batch, CONVERTED_FIELDS)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('derma', '0011_soft_delete_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(centres_to_top_left, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,58 @@
+import hashlib
+
+from django.core.files.images import get_image_dimensions
 from django.db import models
+from django.utils import timezone
 from users.models import User
 from core.models import TimeStampedModel, SoftDeleteModal
+from derma.packing import UNLABELLED_CLASS_ID, pack_ground_truth, unpack_ground_truth
+from derma.spatial import build_grid_index
+from derma.utils import box_label
 
 # --- NEW IMPORTS ---
 from versatileimagefield.fields import VersatileImageField, PPOIField
 
+class LesionClass(models.Model):
+    """
+    Interned lesion class names, referenced by id from AssessmentImage.ground_truth_packed.
+    """
+    name = models.CharField(max_length=50, unique=True)
+
+    _ids = {}
+    _names = {}
+
+    def __str__(self):
+        return self.name
+
+    @classmethod
+    def intern(cls, labels):
+        """
+        Ids of normalised labels (see derma.utils.box_label), creating the
+        missing classes. None maps to UNLABELLED_CLASS_ID.
+        """
+        ids = []
+        for label in labels:
+            if label is None:
+                ids.append(UNLABELLED_CLASS_ID)
+                continue
+            if label not in cls._ids:
+                lesion_class, _ = cls.objects.get_or_create(name=label)
+                cls._ids[label] = lesion_class.id
+                cls._names[lesion_class.id] = label
+            ids.append(cls._ids[label])
+        return ids
+
+    @classmethod
+    def names(cls, class_ids=()):
+        """
+        id -> name for every class, reloaded when one of `class_ids` is not known yet.
+        """
+        if not cls._names or any(class_id not in cls._names for class_id in class_ids):
+            cls._names = dict(cls.objects.values_list("id", "name"))
+            cls._ids = {name: class_id for class_id, name in cls._names.items()}
+        return cls._names
+
+
 class AssessmentImage(SoftDeleteModal, TimeStampedModel):
     """
     The 'Ground Truth' data.
@@ -13,24 +61,156 @@ class AssessmentImage(SoftDeleteModal, TimeStampedModel):
     image_file = VersatileImageField(
         'Image',
         upload_to='assessments/',
-        ppoi_field='image_ppoi' # Links to the field below
+        ppoi_field='image_ppoi', # Links to the field below
     )
     
     # Stores the "Center point" of the image (useful for automatic cropping)
     image_ppoi = PPOIField()
     
+    # Pixel size of image_file, set by ingestion and by save() when the file changes
+    # (not width_field: that would open the file on every load). Needed to read ground_truth_packed
+    image_width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    image_height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+
     # Research Metric: Diagnosis Class
     diagnosis_class = models.CharField(max_length=50, null=True,blank=True, help_text="e.g. Acne, Rosacea, Melanoma")
     
     # The Correct Answer Coordinates
     ground_truth_labels = models.JSONField(null=True,blank=True,) 
+
+    # ground_truth_labels as packed float32 relative x1, y1, x2, y2 + LesionClass id,
+    # see derma.packing. Rebuilt on every save() once the image size is known
+    ground_truth_packed = models.BinaryField(null=True, blank=True, editable=False)
+
+    # Unfiltered model output (Roboflow format, box centres) that ground_truth_labels
+    # was thresholded from, see derma.nms and `manage.py rethreshold_ground_truth`
+    raw_predictions = models.JSONField(null=True, blank=True, editable=False)
+
+    # Uniform grid over ground_truth_labels so grading only compares overlapping boxes.
+    # Rebuilt on every save(), see derma.spatial.build_grid_index
+    ground_truth_index = models.JSONField(null=True, blank=True, editable=False)
     
+    # SHA-256 of the source file, lets ingestion skip images it has already seen
+    content_hash = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+
+    # 64-bit pHash stored signed (derma.phash.to_signed64), finds near-duplicates
+    perceptual_hash = models.BigIntegerField(null=True, blank=True, editable=False)
+
+    # size key -> URL of the pre-generated renditions, see derma.renditions
+    renditions = models.JSONField(default=dict, blank=True, editable=False)
+
     # Research Metric: Image Metadata
     metadata = models.JSONField(default=dict, help_text="e.g. {'lighting': 'poor', 'zoom': '10x'}")
 
+    class Meta:
+        indexes = [
+            # Partial indexes: live rows for the default manager, deleted ones for the purge
+            models.Index(
+                fields=["diagnosis_class", "id"], condition=models.Q(is_deleted=False), name="derma_image_live_class_idx"
+            ),
+            models.Index(fields=["deleted_date"], condition=models.Q(is_deleted=True), name="derma_image_purge_idx"),
+        ]
+
     def __str__(self):
         return f"{self.diagnosis_class} - ID:{self.id}"
 
+    @property
+    def ground_truth_array(self):
+        """
+        ground_truth_packed as a read-only NumPy structured array (a view, no
+        copy), or None when it hasn't been built.
+        """
+        if self.ground_truth_packed is None:
+            return None
+        return unpack_ground_truth(self.ground_truth_packed)
+
+    def build_packed_ground_truth(self):
+        if self.ground_truth_labels is None or not (self.image_width and self.image_height):
+            return None
+        class_ids = LesionClass.intern(box_label(box) for box in self.ground_truth_labels)
+        return pack_ground_truth(self.ground_truth_labels, self.image_width, self.image_height, class_ids)
+
+    def refresh_derived_fields(self, now=None, rebuild_index=True):
+        """
+        What save() does for the columns derived from ground_truth_labels, for
+        bulk_create/bulk_update, which skip save(): rebuilds the grid index and
+        the packed boxes and sets date_modified, which versions the compiled
+        ground truth cache (see derma.cache).
+        """
+        if rebuild_index:
+            self.ground_truth_index = build_grid_index(self.ground_truth_labels)
+        self.ground_truth_packed = self.build_packed_ground_truth()
+        self.date_modified = now or timezone.now()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets save() notice a replaced image_file
+        if "image_file" in field_names:
+            instance._loaded_image_name = values[field_names.index("image_file")]
+        return instance
+
+    def image_file_replaced(self):
+        """
+        True when image_file no longer holds the file the row was loaded with
+        (a new upload or another stored name).
+        """
+        if self._state.adding or not hasattr(self, "_loaded_image_name"):
+            return False
+        return not self.image_file._committed or self.image_file.name != self._loaded_image_name
+
+    def read_image_size(self):
+        """
+        (width, height) of image_file, (None, None) when it is missing or not an image.
+        """
+        try:
+            if not self.image_file._committed:
+                # A new upload, still to be written by the storage
+                return get_image_dimensions(self.image_file.file)
+            with self.image_file.open("rb") as f:
+                return get_image_dimensions(f)
+        except OSError:
+            return None, None
+
+    def hash_image_file(self):
+        """
+        SHA-256 of image_file, or None when another image already has those bytes.
+        """
+        digest = hashlib.sha256()
+        for chunk in self.image_file.chunks():
+            digest.update(chunk)
+        content_hash = digest.hexdigest()
+        if AssessmentImage._base_manager.filter(content_hash=content_hash).exclude(pk=self.pk).exists():
+            return None
+        return content_hash
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "image_file" in update_fields:
+            replaced = self.image_file_replaced()
+            if replaced:
+                # The delivery URL and ETag name the content hash, they must not outlive the bytes
+                self.content_hash = self.hash_image_file()
+                self.renditions = {}
+            if self.image_file and (replaced or not (self.image_width and self.image_height)):
+                self.image_width, self.image_height = self.read_image_size()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {
+                    "content_hash", "renditions", "image_width", "image_height"
+                }
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "ground_truth_labels" in update_fields:
+            self.ground_truth_index = build_grid_index(self.ground_truth_labels)
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"ground_truth_index"}
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or {"ground_truth_labels", "image_width", "image_height"} & set(update_fields):
+            self.ground_truth_packed = self.build_packed_ground_truth()
+            if update_fields is not None:
+                kwargs["update_fields"] = set(update_fields) | {"ground_truth_packed"}
+        super().save(*args, **kwargs)
+        self._loaded_image_name = self.image_file.name
+
 
 class UserAttempt(SoftDeleteModal, TimeStampedModel):
     """
@@ -51,6 +231,17 @@ class UserAttempt(SoftDeleteModal, TimeStampedModel):
     iou_score = models.FloatField(null=True, blank=True)
     detailed_report = models.JSONField(null=True, blank=True)
     is_graded = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of attempt history, see core.utils.CustomPageNumberPagination
+            models.Index(fields=["date_created", "id"], name="derma_attempt_keyset_idx"),
+            # Partial indexes: live rows for the default manager, deleted ones for the purge
+            models.Index(
+                fields=["user", "date_created", "id"], condition=models.Q(is_deleted=False), name="derma_attempt_live_user_idx"
+            ),
+            models.Index(fields=["deleted_date"], condition=models.Q(is_deleted=True), name="derma_attempt_purge_idx"),
+        ]
     
     def __str__(self):
         # Handle case where image might be None or Deleted
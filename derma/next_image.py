@@ -0,0 +1,175 @@
+"""
+Precomputed per-user queues of the next images to practise on.
+
+Each user has a Redis list of ready-to-send image payloads. Serving one is a
+single LPOP; the queue is rebuilt in the background (derma.tasks.
+refill_next_image_queue) from the user's UserAttempt history once it runs low.
+While it is empty (first visit, expired queue) random_image() stands in, so a
+request never waits for a rebuild.
+
+Images are drawn without replacement with weights that favour:
+- diagnosis classes the user scores badly on (mean graded iou_score, shrunk
+  towards the user's overall mean while a class has few attempts),
+- images the user has never attempted.
+"""
+import json
+import random
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, Max, Min, Sum
+from django_redis import get_redis_connection
+
+from derma.delivery import image_delivery_url
+from derma.models import AssessmentImage, UserAttempt
+
+NEXT_IMAGE_QUEUE_KEY = "derma:next-image:{user_id}"
+# Set while a refill of the user's queue is scheduled, so only one is in flight
+NEXT_IMAGE_REFILL_KEY = "derma:next-image:refill:{user_id}"
+
+# Weakness of a class the user has no graded attempt in and has no overall mean yet
+DEFAULT_CLASS_SCORE = 0.5
+# Keeps classes the user is perfect on in the rotation
+MIN_CLASS_WEIGHT = 0.05
+
+
+def class_scores(user_id):
+    """
+    diagnosis_class -> smoothed mean iou_score of the user's graded attempts,
+    plus the user's overall mean used for unseen classes.
+    """
+    rows = (
+        UserAttempt.objects.filter(user_id=user_id, is_graded=True, iou_score__isnull=False)
+        .values("assessment_image__diagnosis_class")
+        .annotate(attempts=Count("id"), total=Sum("iou_score"))
+    )
+    stats = {row["assessment_image__diagnosis_class"]: (row["attempts"], row["total"]) for row in rows}
+    attempts = sum(count for count, _ in stats.values())
+    overall = sum(total for _, total in stats.values()) / attempts if attempts else DEFAULT_CLASS_SCORE
+
+    prior = settings.DERMA_NEXT_IMAGE_PRIOR_ATTEMPTS
+    scores = {
+        diagnosis_class: (total + overall * prior) / (count + prior)
+        for diagnosis_class, (count, total) in stats.items()
+    }
+    return scores, overall
+
+
+def image_weights(diagnosis_classes, seen, scores, overall):
+    """
+    Sampling weight per candidate image.
+
+    Args:
+        diagnosis_classes (list): diagnosis_class of each candidate.
+        seen (np.ndarray): True where the user already attempted the candidate.
+    """
+    weakness = np.array(
+        [1.0 - scores.get(diagnosis_class, overall) for diagnosis_class in diagnosis_classes],
+        dtype=np.float64,
+    )
+    weights = np.clip(weakness, MIN_CLASS_WEIGHT, None)
+    weights[~seen] *= settings.DERMA_NEXT_IMAGE_UNSEEN_BOOST
+    return weights
+
+
+def weighted_sample(weights, size, rng=None):
+    """
+    Indices of `size` items drawn without replacement with probability
+    proportional to `weights` (Efraimidis-Spirakis: largest log(u) / w keys).
+    """
+    size = min(size, len(weights))
+    if size <= 0:
+        return np.zeros(0, dtype=np.int64)
+    rng = rng or np.random.default_rng()
+    keys = np.log(rng.random(len(weights))) / weights
+    top = np.argpartition(-keys, size - 1)[:size]
+    return top[np.argsort(-keys[top])]
+
+
+def image_payload(image):
+    """
+    What the client needs to show an image. The diagnosis class is not sent,
+    it is the answer.
+    """
+    return {
+        "image_id": image.id,
+        "image_url": image_delivery_url(image),
+        "image_width": image.image_width,
+        "image_height": image.image_height,
+    }
+
+
+def random_image():
+    """
+    Payload of a random live image, for users whose queue is still empty.
+    A random primary key probe: two index lookups whatever the table size.
+
+    Returns:
+        dict: image_payload(), or None when there are no images.
+    """
+    images = AssessmentImage.objects.only(
+        "id", "image_file", "image_ppoi", "image_width", "image_height", "content_hash"
+    )
+    bounds = images.aggregate(low=Min("id"), high=Max("id"))
+    if bounds["low"] is None:
+        return None
+    probe = random.randint(bounds["low"], bounds["high"])
+    # Gaps in the ids (deleted rows) favour the image after them, fine for a stopgap
+    image = images.filter(id__gte=probe).order_by("id").first() or images.order_by("id").first()
+    return image_payload(image) if image is not None else None
+
+
+def build_next_images(user_id, size=None):
+    """
+    Draws the next `size` (DERMA_NEXT_IMAGE_QUEUE_SIZE) images for a user.
+
+    Returns:
+        list: image_payload() dicts, in serving order.
+    """
+    size = size or settings.DERMA_NEXT_IMAGE_QUEUE_SIZE
+    candidates = list(AssessmentImage.objects.values_list("id", "diagnosis_class"))
+    if not candidates:
+        return []
+
+    ids = np.array([image_id for image_id, _ in candidates], dtype=np.int64)
+    seen_ids = np.fromiter(
+        UserAttempt.objects.filter(user_id=user_id).values_list("assessment_image_id", flat=True).distinct(),
+        dtype=np.int64,
+    )
+    scores, overall = class_scores(user_id)
+    weights = image_weights([cls for _, cls in candidates], np.isin(ids, seen_ids), scores, overall)
+
+    chosen = ids[weighted_sample(weights, size)].tolist()
+    images = AssessmentImage.objects.only(
+        "id", "image_file", "image_ppoi", "image_width", "image_height", "content_hash"
+    ).in_bulk(chosen)
+    return [image_payload(images[image_id]) for image_id in chosen if image_id in images]
+
+
+def store_next_images(user_id, payloads):
+    """
+    Replaces the user's queue with `payloads` in one transaction.
+    """
+    key = NEXT_IMAGE_QUEUE_KEY.format(user_id=user_id)
+    pipe = get_redis_connection("default").pipeline()
+    pipe.delete(key)
+    if payloads:
+        pipe.rpush(key, *(json.dumps(payload) for payload in payloads))
+        pipe.expire(key, settings.DERMA_NEXT_IMAGE_QUEUE_TIMEOUT)
+    pipe.execute()
+    return len(payloads)
+
+
+def pop_next_image(user_id):
+    """
+    Takes the head of the user's queue.
+
+    Returns:
+        tuple: (payload or None when the queue is empty, images left in the queue)
+    """
+    pipe = get_redis_connection("default").pipeline()
+    key = NEXT_IMAGE_QUEUE_KEY.format(user_id=user_id)
+    pipe.lpop(key)
+    pipe.llen(key)
+    raw, remaining = pipe.execute()
+    return (json.loads(raw) if raw is not None else None), remaining
@@ -0,0 +1,82 @@
+"""
+Confidence threshold and non-max suppression over stored raw predictions.
+
+Ingestion keeps the model output before any filtering (AssessmentImage.raw_predictions),
+so ground truth can be rebuilt for another confidence/overlap setting without
+calling the model again. Thresholds use the Roboflow API scale: percentages.
+"""
+import numpy as np
+
+
+def _iou_with(box, boxes):
+    # IoU of one (4,) x1, y1, x2, y2 box against an (N, 4) array
+    inter_w = np.clip(np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None)
+    inter_h = np.clip(np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None)
+    intersection = inter_w * inter_h
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area + areas - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def non_max_suppression(xyxy, scores, class_ids, iou_threshold):
+    """
+    Greedy per-class NMS: the best scoring box suppresses every box of the
+    same class that overlaps it by more than `iou_threshold`.
+
+    Boxes of different classes are moved apart by an offset larger than the
+    whole layout, so one pass handles every class.
+
+    Returns:
+        np.ndarray: Indices of the kept boxes, best score first.
+    """
+    if len(xyxy) == 0:
+        return np.zeros(0, dtype=np.int64)
+    span = float(np.max(xyxy) - min(float(np.min(xyxy)), 0.0)) + 1.0
+    shifted = xyxy + (class_ids * span)[:, None]
+
+    order = np.argsort(-scores, kind="stable")
+    keep = []
+    while order.size:
+        best = order[0]
+        keep.append(best)
+        rest = order[1:]
+        order = rest[_iou_with(shifted[best], shifted[rest]) <= iou_threshold]
+    return np.array(keep, dtype=np.int64)
+
+
+def filter_predictions(predictions, confidence, overlap):
+    """
+    Applies what the Roboflow API does server-side to a list of raw Roboflow
+    style predictions (centre x, y).
+
+    Args:
+        predictions (list): [{'x', 'y', 'width', 'height', 'class', 'confidence'}, ...]
+        confidence (float): Minimum confidence in percent.
+        overlap (float): Maximum overlap in percent between two kept boxes of one class.
+
+    Returns:
+        list: The kept predictions, in their original order.
+    """
+    if not predictions:
+        return []
+    scores = np.array([pred['confidence'] for pred in predictions], dtype=np.float64)
+    candidates = np.flatnonzero(scores >= confidence / 100)
+    if candidates.size == 0:
+        return []
+
+    centres = np.array(
+        [[predictions[i]['x'], predictions[i]['y'], predictions[i]['width'], predictions[i]['height']] for i in candidates],
+        dtype=np.float64,
+    )
+    xyxy = np.empty_like(centres)
+    xyxy[:, 0] = centres[:, 0] - centres[:, 2] / 2
+    xyxy[:, 1] = centres[:, 1] - centres[:, 3] / 2
+    xyxy[:, 2] = centres[:, 0] + centres[:, 2] / 2
+    xyxy[:, 3] = centres[:, 1] + centres[:, 3] / 2
+
+    names = [predictions[i]['class'] for i in candidates]
+    _, class_ids = np.unique(names, return_inverse=True)
+
+    kept = non_max_suppression(xyxy, scores[candidates], class_ids.astype(np.float64), overlap / 100)
+    return [predictions[i] for i in sorted(candidates[kept].tolist())]
@@ -0,0 +1,85 @@
+"""
+Packed, resolution independent form of AssessmentImage.ground_truth_labels.
+
+One little-endian record per lesion: float32 x1, y1, x2, y2 relative to the
+image size and the uint32 id of its interned LesionClass (0 when unlabelled).
+The bytes are stored in AssessmentImage.ground_truth_packed and read back
+with np.frombuffer, so loading them is a view, not a parse.
+"""
+import numpy as np
+
+from derma.spatial import usable_index
+from derma.utils import CompiledGroundTruth
+
+PACKED_GT_DTYPE = np.dtype([
+    ("x1", "<f4"),
+    ("y1", "<f4"),
+    ("x2", "<f4"),
+    ("y2", "<f4"),
+    ("class_id", "<u4"),
+])
+UNLABELLED_CLASS_ID = 0
+
+
+def pack_ground_truth(boxes, width, height, class_ids):
+    """
+    Packs top-left {'x', 'y', 'width', 'height'} boxes of a `width` x `height`
+    image. `class_ids` holds one interned id per box.
+
+    Returns:
+        bytes: len(boxes) * PACKED_GT_DTYPE.itemsize bytes.
+    """
+    packed = np.zeros(len(boxes or []), dtype=PACKED_GT_DTYPE)
+    if len(packed):
+        xywh = np.array([[box['x'], box['y'], box['width'], box['height']] for box in boxes], dtype=np.float64)
+        packed["x1"] = xywh[:, 0] / width
+        packed["y1"] = xywh[:, 1] / height
+        packed["x2"] = (xywh[:, 0] + xywh[:, 2]) / width
+        packed["y2"] = (xywh[:, 1] + xywh[:, 3]) / height
+        packed["class_id"] = class_ids
+    return packed.tobytes()
+
+
+def unpack_ground_truth(buffer):
+    """
+    Read-only structured array over `buffer` (bytes or memoryview), no copy.
+    """
+    return np.frombuffer(buffer, dtype=PACKED_GT_DTYPE)
+
+
+def packed_to_xywh(packed, width, height):
+    """
+    (N, 4) float64 [x, y, width, height] array in pixels of a `width` x `height`
+    image, the layout derma.utils grades with.
+    """
+    xywh = np.empty((len(packed), 4), dtype=np.float64)
+    xywh[:, 0] = packed["x1"] * np.float64(width)
+    xywh[:, 1] = packed["y1"] * np.float64(height)
+    xywh[:, 2] = packed["x2"] * np.float64(width) - xywh[:, 0]
+    xywh[:, 3] = packed["y2"] * np.float64(height) - xywh[:, 1]
+    return xywh
+
+
+def compile_packed_ground_truth(buffer, width, height, class_names, index=None):
+    """
+    CompiledGroundTruth straight from the packed bytes, without decoding the
+    JSON column. Coordinates go through float32, so they can differ from
+    ground_truth_labels in the sub-pixel range.
+
+    Args:
+        class_names (dict): LesionClass id -> name.
+    """
+    packed = unpack_ground_truth(buffer)
+    array = packed_to_xywh(packed, width, height)
+    array.setflags(write=False)
+    labels = tuple(class_names.get(int(class_id)) for class_id in packed["class_id"])
+    boxes = [
+        {"x": x, "y": y, "width": w, "height": h, "label": label}
+        for (x, y, w, h), label in zip(array.tolist(), labels)
+    ]
+    return CompiledGroundTruth(
+        boxes=boxes,
+        array=array,
+        labels=labels,
+        index=usable_index(index, boxes),
+    )
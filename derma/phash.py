@@ -0,0 +1,111 @@
+"""
+Perceptual hashes and a BK-tree for near-duplicate lookups.
+
+A 64-bit pHash changes little under re-export, rescaling and recompression,
+so near-duplicates are images whose hashes are within a small Hamming
+distance. The BK-tree answers "everything within radius r" without comparing
+against every stored hash.
+"""
+import numpy as np
+from PIL import Image
+
+PHASH_SIZE = 8
+# The DCT is taken over a PHASH_SIZE * 4 square thumbnail
+PHASH_SAMPLE = PHASH_SIZE * 4
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    return np.cos(np.pi * k * (2 * i + 1) / (2 * n))
+
+
+_DCT = _dct_matrix(PHASH_SAMPLE)
+
+
+def phash_image(image):
+    """
+    64-bit pHash of a PIL image: sign of the low frequency DCT coefficients
+    against their median, as in the common imagehash implementation.
+    """
+    pixels = np.asarray(
+        image.convert("L").resize((PHASH_SAMPLE, PHASH_SAMPLE), Image.LANCZOS), dtype=np.float64
+    )
+    low = (_DCT @ pixels @ _DCT.T)[:PHASH_SIZE, :PHASH_SIZE]
+    bits = (low > np.median(low)).ravel()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def phash_file(path_or_file):
+    with Image.open(path_or_file) as image:
+        # Decode a reduced version when the format allows it (JPEG draft mode)
+        image.draft("L", (PHASH_SAMPLE * 4, PHASH_SAMPLE * 4))
+        return phash_image(image)
+
+
+def to_signed64(value):
+    """
+    Unsigned 64-bit hash -> value that fits a BigIntegerField.
+    """
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def to_unsigned64(value):
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """
+    Burkhard-Keller tree over Hamming distance. Each node keeps the items of
+    one hash and its children keyed by their distance to it; a radius search
+    only descends into children within [d - radius, d + radius].
+    """
+
+    def __init__(self, items=()):
+        self.root = None
+        self.size = 0
+        for phash, item in items:
+            self.add(phash, item)
+
+    def __len__(self):
+        return self.size
+
+    def add(self, phash, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [phash, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming_distance(phash, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [phash, [item], {}]
+                return
+            node = child
+
+    def search(self, phash, radius):
+        """
+        (distance, item) pairs within `radius` of `phash`, closest first.
+        """
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_hash, items, children = stack.pop()
+            distance = hamming_distance(phash, node_hash)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
@@ -0,0 +1,151 @@
+"""
+Puts ingested source files into storage without holding them in memory.
+
+For FileSystemStorage the file is placed with the cheapest mechanism the
+filesystem supports: a hardlink (opt-in), a reflink (copy-on-write clone),
+or an in-kernel copy (copy_file_range, then sendfile). Any other storage
+backend gets the file streamed in chunks through Storage.save().
+"""
+import errno
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+PLACEMENT_MODES = ("auto", "hardlink", "reflink", "copy", "stream")
+DEFAULT_PLACEMENT_MODE = "auto"
+
+# ioctl number of FICLONE on Linux (_IOW(0x94, 9, int))
+FICLONE = 0x40049409
+# Bytes per copy_file_range/sendfile call
+KERNEL_COPY_CHUNK = 64 * 1024 * 1024
+STREAM_CHUNK = 1024 * 1024
+
+# errnos meaning "this mechanism isn't available here", which fall through to the next one
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP, errno.ENOTTY, errno.EMLINK}
+
+
+def _reflink(src_fd, dst_fd):
+    if fcntl is None:
+        raise OSError(errno.EOPNOTSUPP, "reflinks need fcntl")
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+
+
+def _kernel_copy(src_fd, dst_fd, size):
+    copy_file_range = getattr(os, "copy_file_range", None)
+    offset = 0
+    if copy_file_range is not None:
+        try:
+            while offset < size:
+                copied = copy_file_range(src_fd, dst_fd, min(KERNEL_COPY_CHUNK, size - offset))
+                if copied == 0:
+                    break
+                offset += copied
+            return offset
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED or offset:
+                raise
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, min(KERNEL_COPY_CHUNK, size - offset))
+        if sent == 0:
+            break
+        offset += sent
+    return offset
+
+
+def _stream_copy(src, dst):
+    for chunk in iter(lambda: src.read(STREAM_CHUNK), b''):
+        dst.write(chunk)
+
+
+def _create_exclusive(storage, name):
+    """
+    Creates an empty file for `name` the way FileSystemStorage._save does,
+    moving to another available name if it is taken. Returns (name, fd).
+    """
+    while True:
+        full_path = storage.path(name)
+        os.makedirs(os.path.dirname(full_path), storage.directory_permissions_mode or 0o777, exist_ok=True)
+        try:
+            return name, os.open(full_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+        except FileExistsError:
+            name = storage.get_available_name(name)
+
+
+def _hardlink(storage, path, name):
+    while True:
+        full_path = storage.path(name)
+        os.makedirs(os.path.dirname(full_path), storage.directory_permissions_mode or 0o777, exist_ok=True)
+        try:
+            os.link(path, full_path)
+            return name
+        except FileExistsError:
+            name = storage.get_available_name(name)
+
+
+def _place_local(storage, path, name, mode):
+    name = storage.get_available_name(name)
+
+    if mode == "hardlink":
+        try:
+            # Shares the inode with the source, so the source must not be edited in place afterwards
+            return _hardlink(storage, path, name)
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+
+    name, dst_fd = _create_exclusive(storage, name)
+    try:
+        with open(path, 'rb') as src, os.fdopen(dst_fd, 'wb') as dst:
+            size = os.fstat(src.fileno()).st_size
+            done = False
+            if mode in ("auto", "hardlink", "reflink"):
+                try:
+                    _reflink(src.fileno(), dst.fileno())
+                    done = True
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+            if not done and mode != "stream":
+                try:
+                    done = _kernel_copy(src.fileno(), dst.fileno(), size) == size
+                except OSError as e:
+                    if e.errno not in _UNSUPPORTED:
+                        raise
+            if not done:
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+                _stream_copy(src, dst)
+    except BaseException:
+        os.remove(storage.path(name))
+        raise
+
+    if storage.file_permissions_mode is not None:
+        os.chmod(storage.path(name), storage.file_permissions_mode)
+    return name
+
+
+def place_file(storage, path, name, mode=DEFAULT_PLACEMENT_MODE):
+    """
+    Puts the file at `path` into `storage` under `name` (or the next
+    available name) and returns the stored name.
+
+    Args:
+        mode (str): "auto" tries a reflink, then an in-kernel copy, then a
+            streamed copy. "hardlink" links the source file into MEDIA_ROOT
+            when both are on one filesystem. "reflink" and "copy" start at
+            that step. "stream" always copies through userspace in chunks.
+            Storages other than FileSystemStorage always stream.
+    """
+    if mode not in PLACEMENT_MODES:
+        raise ValueError(f"Unknown placement mode '{mode}', expected one of {PLACEMENT_MODES}")
+    if isinstance(storage, FileSystemStorage):
+        return _place_local(storage, path, name, mode)
+    with open(path, 'rb') as f:
+        return storage.save(name, File(f))
@@ -0,0 +1,190 @@
+"""
+Predictor backends used by the ingestion pipeline.
+
+Every backend takes a batch of image paths and returns one Roboflow style
+prediction per path, in order:
+
+    {'predictions': [{'x': 100, 'y': 50, 'width': 20, 'height': 20, 'class': 'acne', 'confidence': 0.9}],
+     'image': {'width': 640, 'height': 480}}
+
+x and y are the box centre, as Roboflow reports it.
+"""
+import hashlib
+import json
+import os
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    from roboflow import Roboflow
+except ImportError:
+    Roboflow = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    from ultralytics import YOLO
+except ImportError:
+    YOLO = None
+
+
+class Predictor:
+    """
+    Base class. `batch_size` is how many paths the pipeline hands to
+    predict_batch() at once; predict_batch() is called from worker threads
+    and must not touch the DB.
+    """
+
+    batch_size = 1
+    # Stored as metadata['source'] on the ingested images
+    source = "unknown"
+
+    def __init__(self, confidence=40, overlap=30, batch_size=None):
+        # Percentages, as in the Roboflow API
+        self.confidence = confidence
+        self.overlap = overlap
+        if batch_size:
+            self.batch_size = batch_size
+
+    def predict_batch(self, paths):
+        raise NotImplementedError
+
+
+class RoboflowPredictor(Predictor):
+    """
+    Hosted Roboflow model. The API takes one image per request, so a batch is
+    a sequence of calls; concurrency comes from the pipeline's predict workers.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if Roboflow is None:
+            raise ImproperlyConfigured("The roboflow backend needs the 'roboflow' package")
+        if not settings.ROBOFLOW_API_KEY:
+            raise ImproperlyConfigured("Set ROBOFLOW_API_KEY to use the roboflow backend")
+        # (You get these from your Roboflow Dashboard)
+        rf = Roboflow(api_key=settings.ROBOFLOW_API_KEY)
+        project = rf.workspace().project(settings.ROBOFLOW_PROJECT)
+        self.model = project.version(settings.ROBOFLOW_MODEL_VERSION).model
+        self.source = f"Roboflow_Model_v{settings.ROBOFLOW_MODEL_VERSION}"
+
+    def predict_batch(self, paths):
+        return [
+            self.model.predict(path, confidence=self.confidence, overlap=self.overlap).json()
+            for path in paths
+        ]
+
+
+class LocalModelPredictor(Predictor):
+    """
+    Local Ultralytics model on CPU. Accepts .pt weights or an exported .onnx
+    model and runs the whole batch in one inference call.
+    """
+
+    batch_size = 16
+
+    def __init__(self, model_path=None, **kwargs):
+        super().__init__(**kwargs)
+        if YOLO is None:
+            raise ImproperlyConfigured("The local backend needs the 'ultralytics' package")
+        model_path = model_path or settings.DERMA_LOCAL_MODEL_PATH
+        if not model_path:
+            raise ImproperlyConfigured("Pass --model or set DERMA_LOCAL_MODEL_PATH to use the local backend")
+        self.model = YOLO(model_path, task="detect")
+        self.source = f"Local_Model_{os.path.basename(model_path)}"
+
+    def predict_batch(self, paths):
+        results = self.model.predict(
+            list(paths),
+            conf=self.confidence / 100,
+            iou=self.overlap / 100,
+            device="cpu",
+            verbose=False,
+        )
+        predictions = []
+        for result in results:
+            boxes = result.boxes
+            height, width = result.orig_shape[:2]
+            predictions.append({'image': {'width': width, 'height': height}, 'predictions': [
+                {
+                    'x': x,
+                    'y': y,
+                    'width': box_w,
+                    'height': box_h,
+                    'class': result.names[int(class_id)],
+                    'confidence': confidence,
+                }
+                for (x, y, box_w, box_h), class_id, confidence in zip(
+                    boxes.xywh.tolist(), boxes.cls.tolist(), boxes.conf.tolist()
+                )
+            ]})
+        return predictions
+
+
+class FixturePredictor(Predictor):
+    """
+    Deterministic offline backend for tests and benchmarks.
+
+    With a fixture file ({"<filename>": <prediction>, ...}) it replays the
+    stored predictions. Any other file gets one lesion whose position depends
+    only on the file name.
+    """
+
+    batch_size = 32
+    source = "Fixture"
+
+    def __init__(self, fixture_path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fixtures = {}
+        if fixture_path:
+            with open(fixture_path) as f:
+                self.fixtures = json.load(f)
+
+    def predict_one(self, path):
+        filename = os.path.basename(path)
+        if filename in self.fixtures:
+            return self.fixtures[filename]
+        seed = int(hashlib.sha256(filename.encode()).hexdigest()[:8], 16)
+        return {'image': self.image_size(path), 'predictions': [{
+            'x': 50 + seed % 400,
+            'y': 50 + (seed >> 10) % 400,
+            'width': 20 + seed % 40,
+            'height': 20 + (seed >> 5) % 40,
+            'class': 'acne',
+            'confidence': 1.0,
+        }]}
+
+    def image_size(self, path):
+        # Only the header is read; files that aren't images get no size
+        try:
+            with Image.open(path) as image:
+                return {'width': image.width, 'height': image.height}
+        except Exception:
+            return None
+
+    def predict_batch(self, paths):
+        return [self.predict_one(path) for path in paths]
+
+
+PREDICTOR_BACKENDS = {
+    "roboflow": RoboflowPredictor,
+    "local": LocalModelPredictor,
+    "fixture": FixturePredictor,
+}
+
+
+def get_predictor(name, **kwargs):
+    """
+    Instantiates the backend registered as `name` in PREDICTOR_BACKENDS.
+    """
+    try:
+        backend = PREDICTOR_BACKENDS[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            f"Unknown predictor '{name}', expected one of {sorted(PREDICTOR_BACKENDS)}"
+        )
+    return backend(**kwargs)
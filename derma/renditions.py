@@ -0,0 +1,153 @@
+"""
+Eager generation of the AssessmentImage.image_file renditions.
+
+The sizes come from VERSATILEIMAGEFIELD_RENDITION_KEY_SETS[DERMA_RENDITION_KEY_SET].
+Pillow work runs in a process pool; the parent records the URL of every
+rendition in AssessmentImage.renditions with bulk_update.
+"""
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from functools import reduce
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from versatileimagefield.utils import get_rendition_key_set, get_url_from_image_key
+
+from derma.metrics import observe_stage
+from derma.models import AssessmentImage
+
+logger = logging.getLogger(__name__)
+
+
+def rendition_size_keys():
+    """
+    Size keys ('thumbnail__200x200', ...) of the configured key set.
+    """
+    return [size_key for _, size_key in get_rendition_key_set(settings.DERMA_RENDITION_KEY_SET)]
+
+
+def ppoi_key(ppoi):
+    """
+    PPOI as stored in the DB ('0.5x0.5'); instances hold it as an (x, y) tuple.
+    """
+    if isinstance(ppoi, (tuple, list)):
+        return "x".join(str(value) for value in ppoi)
+    return str(ppoi)
+
+
+def rendition_name(field_file, size_key):
+    """
+    Storage name of one rendition ('crop__400x400', 'url', ...) of a
+    VersatileImageFieldFile. Never creates the rendition.
+    """
+    parts = size_key.split("__")
+    size = parts.pop() if "x" in parts[-1] else None
+    if parts and parts[-1] == "url":
+        parts.pop()
+    field_file.create_on_demand = False
+    target = reduce(getattr, parts, field_file)
+    return target[size].name if size else target.name
+
+
+def is_warm(renditions, size_keys):
+    return bool(renditions) and all(size_key in renditions for size_key in size_keys)
+
+
+def create_renditions(images, size_keys):
+    """
+    Runs in a worker process. Creates every size of each image from its
+    stored name and PPOI, without reading the row.
+
+    Args:
+        images (list): (image_id, image_file name, image_ppoi) tuples.
+
+    Returns:
+        list: (image_id, {size_key: url}, seconds) tuples, failed sizes left out.
+    """
+    created = []
+    for image_id, name, ppoi in images:
+        started = time.perf_counter()
+        image = AssessmentImage(id=image_id, image_file=name, image_ppoi=ppoi)
+        image.image_file.create_on_demand = True
+        urls = {}
+        for size_key in size_keys:
+            try:
+                urls[size_key] = get_url_from_image_key(image.image_file, size_key)
+            except Exception:
+                logger.exception("Rendition %s of image %s failed", size_key, image_id)
+        created.append((image_id, urls, time.perf_counter() - started))
+    return created
+
+
+class RenditionWarmer:
+    """
+    Feeds images to a process pool and records the finished renditions.
+    Use as a context manager; leaving it waits for the pool.
+
+    Args:
+        workers (int): Worker processes, defaults to the CPU count.
+        chunk_size (int): Images per task.
+        log (callable): Receives progress lines.
+    """
+
+    def __init__(self, workers=None, chunk_size=20, log=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = max(chunk_size, 1)
+        self.log = log or logger.info
+        self.size_keys = rendition_size_keys()
+        self.warmed = 0
+        self.failed = 0
+        self._pending = []
+        self._in_flight = deque()
+        self._pool = None
+
+    def __enter__(self):
+        # Spawned, not forked: ingestion runs this next to its busy thread pools,
+        # and the children never share the parent's DB connection
+        self._pool = ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn"), initializer=django.setup
+        )
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            if exc_info[0] is None:
+                self._submit_pending()
+                while self._in_flight:
+                    self._record(self._in_flight.popleft().result())
+        finally:
+            self._pool.shutdown(wait=True, cancel_futures=exc_info[0] is not None)
+
+    def add(self, image_id, name, ppoi):
+        if not name:
+            return
+        self._pending.append((image_id, str(name), ppoi_key(ppoi)))
+        if len(self._pending) >= self.chunk_size:
+            self._submit_pending()
+
+    def _submit_pending(self):
+        if not self._pending:
+            return
+        self._in_flight.append(self._pool.submit(create_renditions, self._pending, self.size_keys))
+        self._pending = []
+        # Record finished chunks as they come, and block only when the pool is saturated
+        while self._in_flight and (self._in_flight[0].done() or len(self._in_flight) >= 2 * self.workers):
+            self._record(self._in_flight.popleft().result())
+
+    def _record(self, created):
+        AssessmentImage.objects.bulk_update(
+            [AssessmentImage(id=image_id, renditions=urls) for image_id, urls, _ in created], ["renditions"]
+        )
+        for _, urls, seconds in created:
+            # Timed in the worker, recorded here so one process holds every metric
+            warm = is_warm(urls, self.size_keys)
+            observe_stage("rendition", seconds, error=not warm)
+            if warm:
+                self.warmed += 1
+            else:
+                self.failed += 1
+        self.log(f"Renditions: {self.warmed} images warmed, {self.failed} incomplete")
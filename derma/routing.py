@@ -0,0 +1,16 @@
+from django.urls import path
+
+from derma.consumers import AttemptEventStreamConsumer, AttemptLongPollConsumer
+from users.middleware import JWTAuthMiddleware
+
+# HTTP routes served by the ASGI `ws` service (dermapj.asgi)
+http_urlpatterns = [
+    path(
+        "api/derma/attempts/<int:attempt_id>/events/",
+        JWTAuthMiddleware(AttemptEventStreamConsumer.as_asgi()),
+    ),
+    path(
+        "api/derma/attempts/<int:attempt_id>/wait/",
+        JWTAuthMiddleware(AttemptLongPollConsumer.as_asgi()),
+    ),
+]
@@ -0,0 +1,11 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from derma.cache import invalidate_compiled_ground_truth
+from derma.models import AssessmentImage
+
+
+@receiver(post_save, sender=AssessmentImage)
+@receiver(post_delete, sender=AssessmentImage)
+def drop_compiled_ground_truth(sender, instance, **kwargs):
+    invalidate_compiled_ground_truth(instance)
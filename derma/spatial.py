@@ -0,0 +1,188 @@
+import hashlib
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Bumped whenever the layout of the stored index changes, older indexes are ignored
+GRID_INDEX_VERSION = 2
+
+# The index only pays for its lookup on images with many lesions that rarely
+# share cells; below either bound the dense IoU matrix is faster
+GRID_INDEX_MIN_BOXES = 50
+GRID_INDEX_MAX_PAIR_RATIO = 0.25
+
+# Stored index converted to sorted arrays for the vectorised lookup.
+# The lesions of cell keys[i] are members[starts[i]:starts[i + 1]]
+GridIndex = namedtuple("GridIndex", ["cell_size", "bounds", "keys", "starts", "members", "count"])
+
+
+def boxes_checksum(ground_truth_boxes):
+    """
+    Checksum of the box coordinates an index was built from. Rounded to a
+    tenth of a pixel so the float32 packed ground truth (derma.packing) still
+    matches the JSON boxes.
+    """
+    coords = np.array(
+        [[box['x'], box['y'], box['width'], box['height']] for box in ground_truth_boxes or []],
+        dtype=np.float64,
+    )
+    # + 0.0 folds -0.0 into 0.0
+    return hashlib.blake2b((np.round(coords, 1) + 0.0).tobytes(), digest_size=8).hexdigest()
+
+
+def _cell_range(start, end, cell_size):
+    return math.floor(start / cell_size), math.floor(end / cell_size)
+
+
+def build_grid_index(ground_truth_boxes, cell_size=None):
+    """
+    Builds a uniform grid over the ground truth lesions of one image.
+
+    Every lesion is registered in each cell its box touches, so two boxes that
+    overlap always share at least one cell. The result is plain JSON so it can
+    be stored next to the AssessmentImage record.
+
+    Args:
+        ground_truth_boxes (list): {'x', 'y', 'width', 'height'} dicts.
+        cell_size (float): Side of a grid cell. Defaults to twice the median
+            lesion side, which keeps most lesions within four cells.
+
+    Returns:
+        dict: {"version", "count", "checksum", "cell_size", "bounds", "cells"}
+            or None when there is nothing to index.
+    """
+    if not ground_truth_boxes:
+        return None
+
+    sides = [max(box['width'], box['height']) for box in ground_truth_boxes]
+    if cell_size is None:
+        cell_size = 2 * float(np.median(sides))
+    cell_size = max(float(cell_size), 1.0)
+
+    cells = {}
+    min_ix = min_iy = math.inf
+    max_ix = max_iy = -math.inf
+    for idx, box in enumerate(ground_truth_boxes):
+        ix0, ix1 = _cell_range(box['x'], box['x'] + box['width'], cell_size)
+        iy0, iy1 = _cell_range(box['y'], box['y'] + box['height'], cell_size)
+        min_ix, max_ix = min(min_ix, ix0), max(max_ix, ix1)
+        min_iy, max_iy = min(min_iy, iy0), max(max_iy, iy1)
+        for ix in range(ix0, ix1 + 1):
+            for iy in range(iy0, iy1 + 1):
+                cells.setdefault(f"{ix}:{iy}", []).append(idx)
+
+    return {
+        "version": GRID_INDEX_VERSION,
+        "count": len(ground_truth_boxes),
+        "checksum": boxes_checksum(ground_truth_boxes),
+        "cell_size": cell_size,
+        "bounds": [min_ix, min_iy, max_ix, max_iy],
+        "cells": cells,
+    }
+
+
+def is_valid_index(index, ground_truth_boxes):
+    """
+    True when `index` was built by this version from exactly these boxes.
+    Indexes go stale if ground_truth_labels is changed with queryset.update(),
+    the checksum catches moved boxes as well as added or removed ones.
+    """
+    return (
+        isinstance(index, dict)
+        and index.get("version") == GRID_INDEX_VERSION
+        and index.get("count") == len(ground_truth_boxes or [])
+        and index.get("checksum") == boxes_checksum(ground_truth_boxes)
+    )
+
+
+def _cell_keys(ix, iy, bounds):
+    min_ix, min_iy, _, max_iy = bounds
+    return (ix - min_ix) * (max_iy - min_iy + 1) + (iy - min_iy)
+
+
+def prepare_index(index):
+    """
+    GridIndex for candidate_pairs(), or None when the index would not prune
+    enough pairs to beat the dense IoU matrix (few lesions, or lesions that
+    mostly share cells).
+    """
+    count = index["count"]
+    if count < GRID_INDEX_MIN_BOXES:
+        return None
+    cells = index["cells"]
+    # Share of ground truth pairs that meet in some cell, an estimate of the
+    # share of the IoU matrix the lookup still has to compute
+    if sum(len(members) ** 2 for members in cells.values()) > GRID_INDEX_MAX_PAIR_RATIO * count ** 2:
+        return None
+
+    bounds = tuple(index["bounds"])
+    coords = np.array([[int(n) for n in key.split(":")] for key in cells], dtype=np.int64).reshape(-1, 2)
+    keys = _cell_keys(coords[:, 0], coords[:, 1], bounds)
+    order = np.argsort(keys, kind="stable")
+    lists = list(cells.values())
+    lengths = np.array([len(lists[i]) for i in order], dtype=np.int64)
+    starts = np.zeros(len(order) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=starts[1:])
+    members = np.fromiter((g for i in order for g in lists[i]), dtype=np.int64, count=int(starts[-1]))
+    return GridIndex(float(index["cell_size"]), bounds, keys[order], starts, members, count)
+
+
+def usable_index(index, ground_truth_boxes):
+    """
+    The prepared form of a stored index when it is valid for the boxes and
+    worth using, None otherwise (callers then use the dense IoU matrix).
+    """
+    if not is_valid_index(index, ground_truth_boxes):
+        return None
+    return prepare_index(index)
+
+
+def _expand(counts):
+    # For per-item counts: the item of every output slot and its rank within the item
+    owners = np.repeat(np.arange(len(counts)), counts)
+    ranks = np.arange(len(owners)) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owners, ranks
+
+
+def candidate_pairs(grid, user_array):
+    """
+    (user_idx, gt_idx) pairs whose boxes share a grid cell, without a Python
+    loop over boxes or cells.
+
+    Args:
+        grid (GridIndex): Output of prepare_index().
+        user_array (np.ndarray): (U, 4) [x, y, width, height] array.
+
+    Returns:
+        tuple: (rows, cols) int arrays sorted by row, then column.
+    """
+    min_ix, min_iy, max_ix, max_iy = grid.bounds
+    cell_size = grid.cell_size
+    # Clamp to the indexed area so a huge box can't walk an unbounded grid
+    ix0 = np.maximum(np.floor(user_array[:, 0] / cell_size), min_ix).astype(np.int64)
+    ix1 = np.minimum(np.floor((user_array[:, 0] + user_array[:, 2]) / cell_size), max_ix).astype(np.int64)
+    iy0 = np.maximum(np.floor(user_array[:, 1] / cell_size), min_iy).astype(np.int64)
+    iy1 = np.minimum(np.floor((user_array[:, 1] + user_array[:, 3]) / cell_size), max_iy).astype(np.int64)
+    span_y = np.clip(iy1 - iy0 + 1, 0, None)
+    counts = np.clip(ix1 - ix0 + 1, 0, None) * span_y
+
+    # Every cell touched by every user box
+    users, ranks = _expand(counts)
+    ix = ix0[users] + ranks // np.maximum(span_y[users], 1)
+    iy = iy0[users] + ranks % np.maximum(span_y[users], 1)
+    keys = _cell_keys(ix, iy, grid.bounds)
+
+    # Keep the non-empty ones and list their lesions
+    pos = np.searchsorted(grid.keys, keys)
+    hit = pos < len(grid.keys)
+    hit[hit] = grid.keys[pos[hit]] == keys[hit]
+    users, pos = users[hit], pos[hit]
+    lengths = grid.starts[pos + 1] - grid.starts[pos]
+    slots, offsets = _expand(lengths)
+    rows = users[slots]
+    cols = grid.members[grid.starts[pos][slots] + offsets]
+
+    # A pair meeting in several cells is reported once; unique() also sorts
+    pairs = np.unique(rows * grid.count + cols)
+    return pairs // grid.count, pairs % grid.count
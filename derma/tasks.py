@@ -0,0 +1,241 @@
+import logging
+
+from celery import group, shared_task
+from django.conf import settings
+from django.utils import timezone
+from django_redis import get_redis_connection
+from .models import UserAttempt, AssessmentImage
+from .cache import get_compiled_ground_truth
+from .events import publish_attempts_graded
+from .next_image import NEXT_IMAGE_REFILL_KEY, build_next_images, store_next_images
+from .results import cache_graded_results, forget_processing
+from .utils import grade_submission # Import the advanced logic we just wrote
+import json
+
+logger = logging.getLogger(__name__)
+
+# Redis list of attempt ids waiting for the next batched grading run
+GRADING_QUEUE_KEY = "derma:grading:pending"
+# Set while a grade_pending_attempts run is scheduled, so only one is in flight
+GRADING_FLUSH_KEY = "derma:grading:flush-scheduled"
+# Extra lifetime of the flush flag in case the scheduled task is lost
+GRADING_FLUSH_GRACE_MS = 60 * 1000
+
+# Fields written back after grading
+GRADED_FIELDS = ["iou_score", "detailed_report", "is_graded", "date_modified"]
+
+
+def attempts_for_grading():
+    """
+    UserAttempt queryset with just what grading needs. The image's ground truth
+    is not loaded: only its date_modified, which versions the compiled cache.
+    """
+    return UserAttempt.objects.select_related("assessment_image").only(
+        "id", "user", "user_boxes", *GRADED_FIELDS,
+        "assessment_image", "assessment_image__date_modified",
+    )
+
+
+def grading_options():
+    """
+    grade_submission() keyword arguments configured in settings.
+    """
+    return {
+        "iou_threshold": settings.DERMA_GRADING_IOU_THRESHOLD,
+        "engine": settings.DERMA_GRADING_ENGINE,
+        "matching": settings.DERMA_GRADING_MATCHING,
+        "iou_thresholds": settings.DERMA_GRADING_IOU_THRESHOLDS,
+    }
+
+
+def apply_grade(attempt, ground_truth=None):
+    """
+    Grades an attempt in memory. Fills iou_score, detailed_report and is_graded
+    but does not save, so callers can save() one attempt or bulk_update() many.
+    The ground truth comes pre-parsed from derma.cache unless given.
+    """
+    if ground_truth is None:
+        ground_truth = get_compiled_ground_truth(
+            attempt.assessment_image_id, attempt.assessment_image.date_modified
+        )
+    student_boxes = attempt.user_boxes
+
+    # --- THE PHD UPGRADE ---
+    # Instead of a manual loop here, we call the advanced math function
+    # that handles 'False Positives' and 'Precision/Recall'
+    results = grade_submission(ground_truth, student_boxes, **grading_options())
+    # Lets regrade_attempts find reports made under older rules
+    results['detailed_report']['grader_version'] = settings.DERMA_GRADER_VERSION
+
+    # Save the Research Metrics
+    attempt.iou_score = results['iou_score'] # The F1 Score (0.0 to 1.0)
+
+    # Save the granular data: {"false_positives": 2, "precision": 0.6, ...}
+    attempt.detailed_report = results['detailed_report']
+
+    attempt.is_graded = True
+    return attempt
+
+
+def try_grade(attempt, ground_truth=None):
+    """
+    apply_grade() that doesn't raise: an attempt that can't be graded (malformed
+    user_boxes, missing image) is marked failed in detailed_report, so it
+    neither takes the rest of its batch down nor stays "processing" forever.
+
+    Returns:
+        bool: True when graded.
+    """
+    try:
+        apply_grade(attempt, ground_truth)
+        return True
+    except Exception as exc:
+        logger.exception("Could not grade attempt %s", attempt.id)
+        attempt.iou_score = None
+        attempt.is_graded = False
+        attempt.detailed_report = {
+            "grading_error": f"{type(exc).__name__}: {exc}",
+            "grader_version": settings.DERMA_GRADER_VERSION,
+        }
+        return False
+
+
+@shared_task
+def grade_student_attempt(attempt_id):
+    """
+    Async Task:
+    1. Fetches the attempt
+    2. Runs the Greedy Matching Algorithm (Precision/Recall)
+    3. Saves detailed metrics for the Learning Curve analysis
+    """
+    try:
+        attempt = attempts_for_grading().get(id=attempt_id)
+    except UserAttempt.DoesNotExist:
+        return f"Attempt {attempt_id} not found."
+
+    graded = try_grade(attempt)
+    attempt.save()
+    if graded:
+        cache_graded_results([attempt])
+    else:
+        forget_processing([attempt.id])
+    publish_attempts_graded([attempt])
+
+    if not graded:
+        return f"Attempt {attempt_id} failed: {attempt.detailed_report['grading_error']}"
+    # Log for debugging
+    return f"Graded Attempt {attempt_id}: Score {attempt.iou_score}, Missed: {attempt.detailed_report['missed_lesions']}"
+
+
+@shared_task
+def grade_attempts(attempt_ids):
+    """
+    Async Task: grades many attempts with one select_related query and one bulk_update.
+    Each distinct image's ground truth is read through the compiled cache.
+    Attempts that fail to grade are stored as failed, the others still go through.
+    """
+    attempts = list(attempts_for_grading().filter(id__in=attempt_ids))
+    now = timezone.now()
+    graded, failed = [], []
+    for attempt in attempts:
+        (graded if try_grade(attempt) else failed).append(attempt)
+        # bulk_update() skips auto_now, keep the modified date honest
+        attempt.date_modified = now
+
+    UserAttempt.objects.bulk_update(attempts, GRADED_FIELDS)
+    cache_graded_results(graded)
+    forget_processing([attempt.id for attempt in failed])
+    publish_attempts_graded(attempts)
+    return f"Graded {len(graded)} of {len(attempt_ids)} attempts, {len(failed)} failed."
+
+
+@shared_task
+def grade_pending_attempts():
+    """
+    Async Task: drains up to DERMA_GRADING_BATCH_SIZE ids from the pending queue
+    and grades them as one batch. Re-schedules itself while the queue is not empty.
+    """
+    redis = get_redis_connection("default")
+    batch_size = settings.DERMA_GRADING_BATCH_SIZE
+
+    # Clear the flag first: anything queued from now on schedules a new run
+    redis.delete(GRADING_FLUSH_KEY)
+
+    pipe = redis.pipeline()
+    pipe.lrange(GRADING_QUEUE_KEY, 0, batch_size - 1)
+    pipe.ltrim(GRADING_QUEUE_KEY, batch_size, -1)
+    raw_ids, _ = pipe.execute()
+
+    attempt_ids = [int(attempt_id) for attempt_id in raw_ids]
+    if not attempt_ids:
+        result = "No pending attempts."
+    else:
+        try:
+            result = grade_attempts(attempt_ids)
+        except Exception:
+            # Nothing was written (bad attempts are handled per attempt): put the
+            # ids back and retry after one window rather than losing them
+            redis.rpush(GRADING_QUEUE_KEY, *attempt_ids)
+            if redis.set(GRADING_FLUSH_KEY, 1, nx=True, px=int(settings.DERMA_GRADING_BATCH_WINDOW * 1000) + GRADING_FLUSH_GRACE_MS):
+                grade_pending_attempts.apply_async(countdown=settings.DERMA_GRADING_BATCH_WINDOW)
+            raise
+
+    if redis.llen(GRADING_QUEUE_KEY):
+        grade_pending_attempts.delay()
+    return result
+
+
+def queue_attempts_for_grading(attempt_ids):
+    """
+    Hands many attempts to the grading workers at once: one Celery group of
+    grade_attempts tasks, DERMA_GRADING_BATCH_SIZE attempts each.
+    """
+    batch_size = settings.DERMA_GRADING_BATCH_SIZE
+    return group(
+        grade_attempts.s(attempt_ids[start:start + batch_size])
+        for start in range(0, len(attempt_ids), batch_size)
+    ).apply_async()
+
+
+def queue_attempt_for_grading(attempt_id):
+    """
+    Hands an attempt to the grading workers.
+
+    With DERMA_GRADING_BATCHED the id is pushed onto a Redis list that is
+    drained by grade_pending_attempts, either once DERMA_GRADING_BATCH_WINDOW
+    seconds have passed since the first pending id or as soon as
+    DERMA_GRADING_BATCH_SIZE ids are waiting. Otherwise one task per attempt.
+    """
+    if not settings.DERMA_GRADING_BATCHED:
+        grade_student_attempt.delay(attempt_id)
+        return
+
+    redis = get_redis_connection("default")
+    window = settings.DERMA_GRADING_BATCH_WINDOW
+    pending = redis.rpush(GRADING_QUEUE_KEY, attempt_id)
+
+    if pending >= settings.DERMA_GRADING_BATCH_SIZE:
+        # Size cap reached, don't wait for the window
+        grade_pending_attempts.delay()
+    elif redis.set(GRADING_FLUSH_KEY, 1, nx=True, px=int(window * 1000) + GRADING_FLUSH_GRACE_MS):
+        grade_pending_attempts.apply_async(countdown=window)
+
+
+@shared_task
+def refill_next_image_queue(user_id):
+    """
+    Async Task: rebuilds a user's next-image queue from their attempt history.
+    """
+    # Clear the flag first: a queue that runs low from now on schedules a new run
+    get_redis_connection("default").delete(NEXT_IMAGE_REFILL_KEY.format(user_id=user_id))
+    stored = store_next_images(user_id, build_next_images(user_id))
+    return f"Queued {stored} images for user {user_id}."
+
+
+def request_next_image_refill(user_id):
+    """
+    Schedules refill_next_image_queue for a user unless one is already pending.
+    """
+    redis = get_redis_connection("default")
+    if redis.set(NEXT_IMAGE_REFILL_KEY.format(user_id=user_id), 1, nx=True, ex=settings.DERMA_NEXT_IMAGE_REFILL_LOCK_TIMEOUT):
+        refill_next_image_queue.delay(user_id)
@@ -1,3 +1,603 @@
-from django.test import TestCase
+import errno
+import hashlib
+import io
+import itertools
+import os
+import random
+import shutil
+import tempfile
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from derma.benchmarks import LAYOUTS, generate_case
+from derma.ingestion import IngestionPipeline
+from derma.management.commands.regrade_attempts import grade_chunk
+from derma.models import AssessmentImage, UserAttempt
+from derma.nms import filter_predictions, non_max_suppression
+from derma.phash import BKTree, hamming_distance, phash_file, phash_image, to_signed64, to_unsigned64
+from derma.placement import PLACEMENT_MODES, place_file
+from derma.predictors import FixturePredictor
+from derma.spatial import build_grid_index
+from derma import utils
+from derma.utils import COCO_IOU_THRESHOLDS, calculate_iou, compile_ground_truth, grade_submission
+from users.models import User
+
+
+class GradingEngineTests(SimpleTestCase):
+    """
+    The 'numpy' engine (and the grid index it can use) must produce exactly
+    the report of the original nested loop, so either can be used for A/B checks.
+    """
+
+    CASES = 3000
+
+    def random_cases(self):
+        rng = random.Random(2026)
+        for seed in range(self.CASES):
+            n = rng.choice((0, 1, 2, 5, 10, 30, 60))
+            ground_truth, user_boxes = generate_case(n, rng.choice(LAYOUTS), seed)
+            # Uneven submissions: missing or extra student boxes
+            del user_boxes[rng.randint(0, len(user_boxes)):]
+            yield seed, ground_truth, user_boxes
+
+    def test_engines_agree(self):
+        for seed, ground_truth, user_boxes in self.random_cases():
+            expected = grade_submission(ground_truth, user_boxes, engine="python", iou_thresholds=COCO_IOU_THRESHOLDS)
+            indexed = compile_ground_truth(ground_truth, build_grid_index(ground_truth))
+            for engine, gt in (("numpy", ground_truth), ("numpy", indexed), ("auto", ground_truth)):
+                with self.subTest(seed=seed, engine=engine, indexed=gt is indexed):
+                    self.assertEqual(
+                        grade_submission(gt, user_boxes, engine=engine, iou_thresholds=COCO_IOU_THRESHOLDS),
+                        expected,
+                    )
+
+    def test_moved_boxes_invalidate_index(self):
+        ground_truth, user_boxes = generate_case(100, "sparse", seed=7)
+        index = build_grid_index(ground_truth)
+        moved = [dict(box, x=box["x"] + 40) for box in ground_truth]
+        self.assertIsNone(compile_ground_truth(moved, index).index)
+        self.assertEqual(
+            grade_submission(moved, user_boxes, index=index),
+            grade_submission(moved, user_boxes, engine="python"),
+        )
+
+    def test_regrade_records_malformed_attempts(self):
+        ground_truth, user_boxes = generate_case(5, "sparse", seed=3)
+        compiled = {1: compile_ground_truth(ground_truth)}
+        rows = [(10, 1, user_boxes), (11, 1, [{"x": "broken"}]), (12, 1, user_boxes)]
+
+        graded = grade_chunk(rows, compiled, {}, "test")
+
+        self.assertEqual(
+            [(attempt_id, is_graded) for attempt_id, _, _, is_graded in graded], [(10, True), (11, False), (12, True)]
+        )
+        _, iou_score, report, _ = graded[1]
+        self.assertIsNone(iou_score)
+        self.assertEqual(report["grader_version"], "test")
+        self.assertIn("grading_error", report)
+
+
+class OptimalMatchingTests(SimpleTestCase):
+    """
+    matching='optimal': same class only, global assignment, per-class breakdown.
+    """
+
+    def box(self, x, y, label, side=10):
+        return {"x": x, "y": y, "width": side, "height": side, "label": label}
+
+    def grade(self, ground_truth, user_boxes, **kwargs):
+        return grade_submission(ground_truth, user_boxes, matching="optimal", **kwargs)["detailed_report"]
+
+    def brute_force_hits(self, ground_truth, user_boxes, threshold):
+        def compatible(user_box, gt_box):
+            labels = {utils.box_label(user_box), utils.box_label(gt_box)}
+            return (len(labels) == 1 or None in labels) and calculate_iou(user_box, gt_box) >= threshold
+
+        size = min(len(user_boxes), len(ground_truth))
+        best = 0
+        for users in itertools.combinations(range(len(user_boxes)), size):
+            for gts in itertools.permutations(range(len(ground_truth)), size):
+                best = max(best, sum(compatible(user_boxes[u], ground_truth[g]) for u, g in zip(users, gts)))
+        return best
+
+    def test_label_mismatch_is_never_matched(self):
+        ground_truth = [self.box(0, 0, "papule")]
+        self.assertEqual(self.grade(ground_truth, [self.box(0, 0, "cyst")])["correct_finds"], 0)
+        self.assertEqual(self.grade(ground_truth, [self.box(0, 0, "Papule ")])["correct_finds"], 1)
+        # Unlabelled boxes match any class
+        self.assertEqual(self.grade(ground_truth, [self.box(0, 0, None)])["correct_finds"], 1)
+
+    def test_global_assignment_beats_drawing_order(self):
+        # The first drawn box overlaps both lesions; greedy gives it the one
+        # the second box needed
+        ground_truth = [self.box(0, 0, "papule"), self.box(6, 0, "papule")]
+        user_boxes = [self.box(3, 0, "papule"), self.box(0, 0, "papule")]
+        self.assertEqual(self.grade(ground_truth, user_boxes, iou_threshold=0.3)["correct_finds"], 2)
+
+    def test_matches_brute_force(self):
+        rng = random.Random(11)
+        for seed in range(200):
+            ground_truth, user_boxes = generate_case(rng.randint(0, 5), rng.choice(LAYOUTS), seed)
+            del user_boxes[rng.randint(0, len(user_boxes)):]
+            threshold = rng.choice((0.1, 0.3, 0.5))
+            with self.subTest(seed=seed):
+                self.assertEqual(
+                    self.grade(ground_truth, user_boxes, iou_threshold=threshold)["correct_finds"],
+                    self.brute_force_hits(ground_truth, user_boxes, threshold),
+                )
+
+    def test_drawing_order_does_not_matter(self):
+        rng = random.Random(12)
+        for seed in range(200):
+            ground_truth, user_boxes = generate_case(rng.choice((3, 10, 40)), rng.choice(LAYOUTS), seed)
+            shuffled = rng.sample(user_boxes, len(user_boxes))
+            with self.subTest(seed=seed):
+                self.assertEqual(
+                    self.grade(ground_truth, shuffled, iou_thresholds=COCO_IOU_THRESHOLDS),
+                    self.grade(ground_truth, user_boxes, iou_thresholds=COCO_IOU_THRESHOLDS),
+                )
+
+    def test_per_class_counts(self):
+        ground_truth = [self.box(0, 0, "papule"), self.box(100, 0, "papule"), self.box(200, 0, "cyst")]
+        user_boxes = [
+            self.box(0, 0, "papule"),   # hit
+            self.box(200, 0, "papule"),  # right place, wrong class: false positive
+            self.box(300, 0, None),      # nothing there
+        ]
+        report = self.grade(ground_truth, user_boxes)
+
+        self.assertEqual(report["matching"], "optimal")
+        self.assertEqual(report["per_class"], {
+            "papule": {"correct_finds": 1, "false_positives": 1, "missed_lesions": 1},
+            "cyst": {"correct_finds": 0, "false_positives": 0, "missed_lesions": 1},
+            "unlabelled": {"correct_finds": 0, "false_positives": 1, "missed_lesions": 0},
+        })
+        self.assertEqual((report["correct_finds"], report["false_positives"], report["missed_lesions"]), (1, 2, 2))
+
+    def test_fallback_assignment_agrees_with_scipy(self):
+        try:
+            from scipy.optimize import linear_sum_assignment
+        except ImportError:
+            self.skipTest("scipy is not installed")
+        rng = np.random.default_rng(13)
+        for trial in range(300):
+            shape = tuple(rng.integers(1, 9, size=2))
+            # Sparse weights with ties, like the bonus + IoU matrices of _match_optimal
+            weight = np.where(rng.random(shape) < 0.4, rng.integers(0, 4, size=shape) + rng.random(shape).round(1), 0.0)
+            with self.subTest(trial=trial, shape=shape):
+                expected_rows, expected_cols = linear_sum_assignment(weight, maximize=True)
+                with mock.patch.object(utils, "linear_sum_assignment", None):
+                    rows, cols = utils._max_weight_assignment(weight)
+                self.assertEqual(len(rows), min(shape))
+                self.assertEqual(len(set(rows.tolist())), len(rows))
+                self.assertEqual(len(set(cols.tolist())), len(cols))
+                self.assertAlmostEqual(weight[rows, cols].sum(), weight[expected_rows, expected_cols].sum())
+
+    def test_fallback_grades_like_scipy(self):
+        rng = random.Random(14)
+        cases = [generate_case(rng.choice((5, 20, 60)), rng.choice(LAYOUTS), seed) for seed in range(50)]
+        expected = [self.grade(*case, iou_thresholds=COCO_IOU_THRESHOLDS) for case in cases]
+        with mock.patch.object(utils, "linear_sum_assignment", None):
+            self.assertEqual([self.grade(*case, iou_thresholds=COCO_IOU_THRESHOLDS) for case in cases], expected)
+
+
+class NonMaxSuppressionTests(SimpleTestCase):
+    """
+    derma.nms against a plain per-class loop.
+    """
+
+    def prediction(self, x, y, side, label, confidence):
+        return {"x": x, "y": y, "width": side, "height": side, "class": label, "confidence": confidence}
+
+    def reference(self, predictions, confidence, overlap):
+        def iou(a, b):
+            # Roboflow boxes are centred on x, y
+            a = {**a, "x": a["x"] - a["width"] / 2, "y": a["y"] - a["height"] / 2}
+            b = {**b, "x": b["x"] - b["width"] / 2, "y": b["y"] - b["height"] / 2}
+            return calculate_iou(a, b)
+
+        kept = []
+        for label in {pred["class"] for pred in predictions}:
+            candidates = [
+                i for i, pred in enumerate(predictions)
+                if pred["class"] == label and pred["confidence"] >= confidence / 100
+            ]
+            candidates.sort(key=lambda i: -predictions[i]["confidence"])
+            while candidates:
+                best = candidates.pop(0)
+                kept.append(best)
+                candidates = [i for i in candidates if iou(predictions[best], predictions[i]) <= overlap / 100]
+        return [predictions[i] for i in sorted(kept)]
+
+    def test_overlapping_box_of_the_same_class_is_suppressed(self):
+        predictions = [self.prediction(50, 50, 20, "papule", 0.6), self.prediction(52, 50, 20, "papule", 0.9)]
+        self.assertEqual(filter_predictions(predictions, 40, 30), [predictions[1]])
+
+    def test_classes_are_suppressed_separately(self):
+        predictions = [self.prediction(50, 50, 20, "papule", 0.6), self.prediction(50, 50, 20, "cyst", 0.9)]
+        self.assertEqual(filter_predictions(predictions, 40, 30), predictions)
+
+    def test_confidence_is_a_percentage(self):
+        predictions = [self.prediction(0, 0, 10, "papule", 0.39), self.prediction(100, 0, 10, "papule", 0.4)]
+        self.assertEqual(filter_predictions(predictions, 40, 30), [predictions[1]])
+        self.assertEqual(filter_predictions([], 40, 30), [])
+        self.assertEqual(len(non_max_suppression(np.zeros((0, 4)), np.zeros(0), np.zeros(0), 0.3)), 0)
+
+    def test_class_offsets_never_make_classes_collide(self):
+        # Negative and large coordinates: the per-class offset must still move
+        # every class clear of the others
+        rng = random.Random(21)
+        for seed in range(300):
+            predictions = [
+                self.prediction(
+                    rng.uniform(-200, 2000), rng.uniform(-200, 2000), rng.uniform(1, 400),
+                    rng.choice(("papule", "pustule", "cyst")), round(rng.random(), 3),
+                )
+                for _ in range(rng.randint(1, 30))
+            ]
+            confidence, overlap = rng.choice((0, 40)), rng.choice((0, 30, 70))
+            with self.subTest(seed=seed):
+                self.assertEqual(
+                    filter_predictions(predictions, confidence, overlap),
+                    self.reference(predictions, confidence, overlap),
+                )
+
+
+class PerceptualHashTests(SimpleTestCase):
+    def photo(self, seed=0, size=(256, 192)):
+        # Smooth random blobs, closer to a photo than noise is
+        rng = np.random.default_rng(seed)
+        small = rng.integers(0, 256, (6, 8, 3), dtype=np.uint8)
+        return Image.fromarray(small).resize(size, Image.BICUBIC)
+
+    def test_rescaled_recompressed_copy_stays_close(self):
+        original = self.photo()
+        jpeg = io.BytesIO()
+        original.resize((128, 96)).save(jpeg, format="JPEG", quality=60)
+        jpeg.seek(0)
+
+        self.assertLessEqual(hamming_distance(phash_image(original), phash_file(jpeg)), 4)
+        self.assertGreater(hamming_distance(phash_image(original), phash_image(self.photo(seed=1))), 10)
+
+    def test_signed_round_trip(self):
+        for value in (0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) - 1):
+            signed = to_signed64(value)
+            self.assertTrue(-(1 << 63) <= signed < (1 << 63))
+            self.assertEqual(to_unsigned64(signed), value)
+
+    def test_bk_tree_matches_brute_force(self):
+        rng = random.Random(5)
+        hashes = [rng.getrandbits(64) for _ in range(300)]
+        # Near copies and exact duplicates
+        hashes += [value ^ (1 << rng.randrange(64)) for value in hashes[:50]] + hashes[:10]
+        tree = BKTree((value, position) for position, value in enumerate(hashes))
+        self.assertEqual(len(tree), len(hashes))
+
+        for query in hashes[:40] + [rng.getrandbits(64) for _ in range(10)]:
+            for radius in (0, 1, 3, 20):
+                expected = sorted(
+                    (hamming_distance(query, value), position)
+                    for position, value in enumerate(hashes)
+                    if hamming_distance(query, value) <= radius
+                )
+                found = tree.search(query, radius)
+                self.assertEqual(sorted(found), expected)
+                self.assertEqual([distance for distance, _ in found], sorted(distance for distance, _ in found))
+
+    def test_empty_tree(self):
+        self.assertEqual(BKTree().search(0, 64), [])
+
+
+class PlacementTests(SimpleTestCase):
+    """
+    place_file into a temporary FileSystemStorage.
+    """
+
+    CONTENT = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.storage = FileSystemStorage(location=self.media_root)
+        self.source = os.path.join(self.source_dir, "lesion.jpg")
+        with open(self.source, "wb") as f:
+            f.write(self.CONTENT)
+
+    def read(self, name):
+        with self.storage.open(name, "rb") as f:
+            return f.read()
+
+    def test_every_mode_places_the_content(self):
+        for mode in PLACEMENT_MODES:
+            with self.subTest(mode=mode):
+                name = place_file(self.storage, self.source, f"{mode}/lesion.jpg", mode=mode)
+                self.assertEqual(name, f"{mode}/lesion.jpg")
+                self.assertEqual(self.read(name), self.CONTENT)
+
+    def test_stream_copies_in_chunks_through_userspace(self):
+        with mock.patch("derma.placement.STREAM_CHUNK", 1000), \
+                mock.patch("derma.placement._reflink", side_effect=AssertionError), \
+                mock.patch("derma.placement._kernel_copy", side_effect=AssertionError):
+            name = place_file(self.storage, self.source, "lesion.jpg", mode="stream")
+        self.assertEqual(self.read(name), self.CONTENT)
+
+    def test_copy_skips_the_reflink(self):
+        with mock.patch("derma.placement._reflink", side_effect=AssertionError):
+            name = place_file(self.storage, self.source, "lesion.jpg", mode="copy")
+        self.assertEqual(self.read(name), self.CONTENT)
+
+    def test_hardlink_shares_the_source_inode(self):
+        name = place_file(self.storage, self.source, "lesion.jpg", mode="hardlink")
+        self.assertEqual(os.stat(self.storage.path(name)).st_ino, os.stat(self.source).st_ino)
+
+    def test_taken_name_moves_to_an_available_one(self):
+        for mode in ("stream", "copy", "hardlink"):
+            with self.subTest(mode=mode):
+                self.storage.save(f"{mode}/lesion.jpg", ContentFile(b"existing"))
+                name = place_file(self.storage, self.source, f"{mode}/lesion.jpg", mode=mode)
+                self.assertNotEqual(name, f"{mode}/lesion.jpg")
+                self.assertEqual(self.read(name), self.CONTENT)
+                self.assertEqual(self.read(f"{mode}/lesion.jpg"), b"existing")
+
+    def test_partial_file_is_removed_on_error(self):
+        def fail_midway(src, dst):
+            dst.write(src.read(100))
+            raise OSError(errno.EIO, "read error")
+
+        with mock.patch("derma.placement._stream_copy", side_effect=fail_midway), \
+                self.assertRaises(OSError):
+            place_file(self.storage, self.source, "scans/lesion.jpg", mode="stream")
+        self.assertEqual(os.listdir(self.storage.path("scans")), [])
+
+    def test_unknown_mode_is_rejected(self):
+        with self.assertRaises(ValueError):
+            place_file(self.storage, self.source, "lesion.jpg", mode="symlink")
+
+
+class FailingPredictor(FixturePredictor):
+    """
+    FixturePredictor whose whole batch fails when it holds a file named in `failing`.
+    """
+
+    def __init__(self, failing=(), **kwargs):
+        super().__init__(**kwargs)
+        self.failing = set(failing)
+
+    def predict_batch(self, paths):
+        if self.failing & {os.path.basename(path) for path in paths}:
+            raise RuntimeError("model unavailable")
+        return super().predict_batch(paths)
+
+
+class IngestionPipelineTests(TestCase):
+    """
+    IngestionPipeline against the offline FixturePredictor and a temporary MEDIA_ROOT.
+    """
+
+    def setUp(self):
+        self.source_dir = tempfile.mkdtemp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.source_dir)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def write(self, name, content=None):
+        path = os.path.join(self.source_dir, name)
+        with open(path, "wb") as f:
+            f.write(content if content is not None else name.encode())
+        return path
+
+    def pipeline(self, predictor=None, **kwargs):
+        # Several workers and small batches so results come back out of order
+        options = dict(predict_workers=3, storage_workers=3, hash_workers=2, batch_size=3)
+        options.update(kwargs)
+        return IngestionPipeline(predictor or FixturePredictor(batch_size=2), **options)
+
+    def stored_files(self):
+        folder = os.path.join(self.media_root, "assessments")
+        return sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+
+    def test_rows_follow_input_order(self):
+        paths = [self.write(f"lesion_{i}.jpg") for i in range(9)]
+        stats = self.pipeline().run(paths)
+
+        self.assertEqual((stats.ingested, stats.skipped, stats.failed), (9, 0, 0))
+        expected = [hashlib.sha256(os.path.basename(path).encode()).hexdigest() for path in paths]
+        self.assertEqual(list(AssessmentImage.objects.order_by("id").values_list("content_hash", flat=True)), expected)
+        for image in AssessmentImage.objects.all():
+            self.assertEqual(len(image.ground_truth_labels), 1)
+            self.assertEqual(image.metadata["box_origin"], "top_left")
+
+    def test_duplicates_are_skipped(self):
+        known = self.write("known.jpg")
+        self.pipeline().run([known])
+
+        paths = [
+            self.write("copy_of_known.jpg", b"known.jpg"),
+            self.write("new.jpg"),
+            self.write("copy_of_new.jpg", b"new.jpg"),
+        ]
+        stats = self.pipeline().run(paths)
+
+        self.assertEqual((stats.ingested, stats.skipped, stats.failed), (1, 2, 0))
+        self.assertEqual(AssessmentImage.objects.count(), 2)
+        self.assertEqual(len(self.stored_files()), 2)
+        # A second pass over the same files does nothing
+        stats = self.pipeline().run(paths)
+        self.assertEqual((stats.ingested, stats.skipped), (0, 3))
+
+    def test_known_files_are_not_perceptually_hashed(self):
+        paths = [self.write(f"lesion_{i}.jpg") for i in range(3)]
+        self.pipeline().run(paths)
+
+        new = self.write("new.jpg")
+        pipeline = self.pipeline(near_duplicate_radius=4)
+        with mock.patch.object(pipeline, "perceptual_hash", return_value=0) as perceptual_hash:
+            stats = pipeline.run(paths + [new])
+
+        self.assertEqual((stats.ingested, stats.skipped), (1, 3))
+        perceptual_hash.assert_called_once_with(new)
+
+    def test_failed_prediction_leaves_no_file_and_is_retried(self):
+        paths = [self.write(f"lesion_{i}.jpg") for i in range(4)]
+        predictor = FailingPredictor(failing={"lesion_2.jpg"}, batch_size=2)
+        stats = self.pipeline(predictor).run(paths)
+
+        # lesion_2 and lesion_3 share the failed batch
+        self.assertEqual((stats.ingested, stats.failed), (2, 2))
+        self.assertEqual(AssessmentImage.objects.count(), 2)
+        self.assertEqual(len(self.stored_files()), 2)
+
+        stats = self.pipeline().run(paths)
+        self.assertEqual((stats.ingested, stats.skipped, stats.failed), (2, 2, 0))
+        self.assertEqual(AssessmentImage.objects.count(), 4)
+
+
+class ReplacedImageFileTests(TestCase):
+    """
+    A replaced image_file must not keep the content hash (and immutable URL)
+    or the size of the old bytes.
+    """
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media = override_settings(MEDIA_ROOT=self.media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.image = AssessmentImage.objects.create(
+            image_file="assessments/old.jpg",
+            image_width=10,
+            image_height=10,
+            content_hash=hashlib.sha256(b"old").hexdigest(),
+            renditions={"thumbnail__100x100": "/media/old-thumbnail.jpg"},
+        )
+
+    def test_new_upload_is_rehashed(self):
+        image = AssessmentImage.objects.get(id=self.image.id)
+        image.image_file.save("new.jpg", ContentFile(b"new"), save=False)
+        image.save()
+
+        image.refresh_from_db()
+        self.assertEqual(image.content_hash, hashlib.sha256(b"new").hexdigest())
+        self.assertEqual(image.renditions, {})
+
+    def test_new_upload_sets_the_image_size(self):
+        png = io.BytesIO()
+        Image.new("RGB", (3, 2)).save(png, format="PNG")
+        image = AssessmentImage.objects.get(id=self.image.id)
+        image.image_file.save("new.png", ContentFile(png.getvalue()), save=False)
+        image.save()
+
+        image.refresh_from_db()
+        self.assertEqual((image.image_width, image.image_height), (3, 2))
+
+    def test_row_with_missing_file_and_no_size_loads_and_saves(self):
+        # Legacy rows: no size yet and the stored file may be gone
+        AssessmentImage.objects.filter(id=self.image.id).update(image_width=None, image_height=None)
+        image = AssessmentImage.objects.get(id=self.image.id)
+        image.diagnosis_class = "Acne"
+        image.save()
+
+        image.refresh_from_db()
+        self.assertEqual((image.image_width, image.image_height), (None, None))
+
+    def test_unchanged_file_keeps_its_hash(self):
+        image = AssessmentImage.objects.get(id=self.image.id)
+        image.diagnosis_class = "Acne"
+        image.save()
+
+        image.refresh_from_db()
+        self.assertEqual(image.content_hash, self.image.content_hash)
+        self.assertEqual(image.renditions, self.image.renditions)
+
+
+class DermaUrlTests(TestCase):
+    """
+    Requests through the root URLconf, so import errors in the derma views show up.
+    """
+
+    def test_next_image_needs_a_login(self):
+        response = self.client.get(reverse("derma-next-image"))
+        self.assertEqual(response.status_code, 401)
+
+    def test_unknown_image_is_not_found(self):
+        url = reverse("derma-image", kwargs={"content_hash": "0" * 64, "variant": "original"})
+        self.assertEqual(url, "/api/derma/images/%s/original/" % ("0" * 64))
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_asgi_application_loads(self):
+        # The push endpoints import derma.consumers and the grading tasks
+        from dermapj.asgi import application
+
+        self.assertIsNotNone(application)
+
+
+class CeleryTaskDiscoveryTests(SimpleTestCase):
+    def test_worker_registers_the_derma_tasks(self):
+        # What the worker does at startup: autodiscovery imports <app>.tasks
+        from dermapj.celery import app
+
+        app.loader.import_default_modules()
+        for name in ("grade_student_attempt", "grade_attempts", "grade_pending_attempts", "refill_next_image_queue"):
+            self.assertIn(f"derma.tasks.{name}", app.tasks)
+
+
+@override_settings(DERMA_INLINE_GRADING_MAX_BOXES=50)
+class InlineGradingTests(TestCase):
+    """
+    SubmitAssessmentView grading small submissions inside the request.
+    """
+
+    def setUp(self):
+        user = User.objects.create_user(username="student", password="secret")
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        ground_truth, self.user_boxes = generate_case(3, "sparse", seed=1)
+        self.image = AssessmentImage.objects.create(
+            image_file="assessments/x.jpg", image_width=1000, image_height=1000, ground_truth_labels=ground_truth
+        )
+        compiled = compile_ground_truth(ground_truth)
+        for name, options in (
+            ("get_compiled_ground_truth", {"return_value": compiled}),
+            ("cache_graded_results", {}),
+            ("mark_attempts_processing", {}),
+            ("queue_attempt_for_grading", {}),
+        ):
+            patcher = mock.patch(f"derma.views.{name}", **options)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def submit(self, boxes):
+        return self.client.post(
+            reverse("derma-submit-attempt"), {"image_id": self.image.id, "boxes": boxes}, format="json"
+        )
+
+    def test_small_submission_is_graded_inline(self):
+        response = self.submit(self.user_boxes)
+
+        self.assertEqual(response.data["status"], "complete")
+        attempt = UserAttempt.objects.get()
+        self.assertTrue(attempt.is_graded)
+        self.queue_attempt_for_grading.assert_not_called()
+
+    def test_malformed_submission_is_saved_and_queued(self):
+        response = self.submit([{"x": "broken"}])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["status"], "processing")
+        attempt = UserAttempt.objects.get()
+        self.assertFalse(attempt.is_graded)
+        self.assertIsNone(attempt.detailed_report)
+        self.queue_attempt_for_grading.assert_called_once_with(attempt.id)
@@ -0,0 +1,16 @@
+from django.urls import path, re_path
+
+from derma.delivery import serve_image
+from derma.views import AssessmentResultView, BatchSubmitAssessmentView, NextImageView, SubmitAssessmentView
+
+urlpatterns = [
+    re_path(
+        r"^images/(?P<content_hash>[0-9a-f]{64})/(?P<variant>[\w.@]+)/$",
+        serve_image,
+        name="derma-image",
+    ),
+    path("images/next/", NextImageView.as_view(), name="derma-next-image"),
+    path("attempts/", SubmitAssessmentView.as_view(), name="derma-submit-attempt"),
+    path("attempts/batch/", BatchSubmitAssessmentView.as_view(), name="derma-submit-attempts"),
+    path("attempts/<int:attempt_id>/", AssessmentResultView.as_view(), name="derma-attempt-result"),
+]
@@ -1,3 +1,46 @@
+from collections import namedtuple
+
+import numpy as np
+
+from derma.spatial import candidate_pairs, usable_index
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    # scipy is optional, _solve_assignment() below is used instead
+    linear_sum_assignment = None
+
+# Engines accepted by grade_submission().
+# 'python' is the original nested-loop implementation and is kept for A/B checks,
+# 'numpy' builds the full IoU matrix in a single broadcast,
+# 'auto' picks the faster of the two from the size of the submission.
+GRADING_ENGINES = ("python", "numpy", "auto")
+DEFAULT_GRADING_ENGINE = "auto"
+
+# 'auto' keeps the nested loop up to this many box pairs x thresholds: below it
+# NumPy's fixed overhead costs more than the loop (about 10 x 10 boxes at one
+# threshold, see `python -m derma.benchmarks`)
+AUTO_ENGINE_MAX_WORK = 120
+
+# Matching modes accepted by grade_submission().
+# 'greedy' is first-come matching in drawing order, ignoring labels.
+# 'optimal' only pairs boxes of the same class and solves the assignment globally.
+MATCHING_MODES = ("greedy", "optimal")
+DEFAULT_MATCHING_MODE = "greedy"
+
+# IoU 0.50:0.05:0.95, the thresholds COCO averages over
+COCO_IOU_THRESHOLDS = tuple(round(0.5 + 0.05 * step, 2) for step in range(10))
+
+# Bucket used in the per-class breakdown for boxes without a 'label'
+UNLABELLED_CLASS = "unlabelled"
+
+# Ground truth of one image, parsed once and reusable across many grades
+# (see derma.cache). `boxes` is the raw list, `array` its boxes_to_array() form,
+# `labels` the normalised class labels and `index` a prepared grid index
+# (derma.spatial.GridIndex) when the stored one is valid and worth using, else None.
+CompiledGroundTruth = namedtuple("CompiledGroundTruth", ["boxes", "array", "labels", "index"])
+
+
 def calculate_iou(box_a, box_b):
     """
     Calculates Intersection over Union (IoU) between two boxes.
@@ -28,17 +71,81 @@ def calculate_iou(box_a, box_b):
         return 0.0
     return intersection_area / union_area
 
-def grade_submission(ground_truth_boxes, user_boxes, iou_threshold=0.5):
+def boxes_to_array(boxes):
     """
-    PhD-Grade Logic: Compares list of user boxes against list of correct boxes.
-    
-    Args:
-        ground_truth_boxes (list): The correct answers.
-        user_boxes (list): The student's drawings.
-        iou_threshold (float): How accurate the box must be to count as a 'Hit' (standard is 0.5).
-        
+    Converts a list of box dicts into an (N, 4) float array.
+    Format expected: {'x': int, 'y': int, 'width': int, 'height': int}
+    Columns are kept as [x, y, width, height] so the vectorised maths below
+    performs exactly the same floating point operations as calculate_iou().
+    """
+    if not boxes:
+        return np.zeros((0, 4), dtype=np.float64)
+    return np.array(
+        [[box['x'], box['y'], box['width'], box['height']] for box in boxes],
+        dtype=np.float64,
+    )
+
+
+def _iou(boxes_a, boxes_b):
+    """
+    Element-wise IoU of two broadcastable [..., 4] arrays in [x, y, width, height] form.
+    """
+    x_a, y_a, w_a, h_a = (boxes_a[..., i] for i in range(4))
+    x_b, y_b, w_b, h_b = (boxes_b[..., i] for i in range(4))
+
+    # 1. Intersection rectangle for every pair
+    x_left   = np.maximum(x_a, x_b)
+    y_top    = np.maximum(y_a, y_b)
+    x_right  = np.minimum(x_a + w_a, x_b + w_b)
+    y_bottom = np.minimum(y_a + h_a, y_b + h_b)
+
+    # 2. Area of intersection (0 where the boxes do not overlap)
+    intersection_area = np.maximum(x_right - x_left, 0.0) * np.maximum(y_bottom - y_top, 0.0)
+
+    # 3. Union (Area A + Area B - Intersection)
+    union_area = (w_a * h_a) + (w_b * h_b) - intersection_area
+
+    # 4. Score, guarding against division by zero
+    iou = np.zeros_like(union_area)
+    np.divide(intersection_area, union_area, out=iou, where=union_area != 0)
+    return iou
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Vectorised calculate_iou(): returns the (len(a), len(b)) IoU matrix of two
+    arrays produced by boxes_to_array() in one broadcast.
+    """
+    return _iou(boxes_a[:, None, :], boxes_b[None, :, :])
+
+
+def overlap_pairs(user_array, gt_array, index=None):
+    """
+    Sparse form of the IoU matrix: only the pairs that actually overlap.
+
+    With a prepared grid index (derma.spatial.GridIndex) IoU is only computed
+    for candidate pairs sharing a cell, so the cost follows the number of
+    overlaps instead of U x G. Without one the dense matrix is computed and
+    thinned out.
+
     Returns:
-        dict: Detailed statistics for the Learning Curve.
+        tuple: (rows, cols, ious) sorted by user box, then ground truth box.
+    """
+    if index is not None:
+        rows, cols = candidate_pairs(index, user_array)
+        ious = _iou(user_array[rows], gt_array[cols])
+    else:
+        dense = iou_matrix(user_array, gt_array)
+        rows, cols = np.nonzero(dense)
+        ious = dense[rows, cols]
+
+    keep = ious > 0
+    return rows[keep], cols[keep], ious[keep]
+
+
+def _match_python(ground_truth_boxes, user_boxes, iou_threshold):
+    """
+    Original nested-loop greedy matching. Kept as the 'python' engine.
     """
     true_positives = 0
     false_positives = 0
@@ -73,11 +180,248 @@ def grade_submission(ground_truth_boxes, user_boxes, iou_threshold=0.5):
             # MISS: The user drew a box where there was nothing (Hallucination)
             false_positives += 1
 
-    # --- STEP 3: Calculate what they missed ---
-    total_lesions = len(ground_truth_boxes)
-    false_negatives = total_lesions - len(matched_gt_indices)
+    return true_positives, false_positives, len(matched_gt_indices)
 
-    # --- STEP 4: Calculate Research Metrics ---
+
+def _match_numpy(rows, cols, ious, n_user, n_gt, iou_thresholds):
+    """
+    Greedy matching on the sparse IoU matrix from overlap_pairs(), for several
+    thresholds at once. Produces the same matches as _match_python(): every
+    user box, in drawing order, takes the unmatched ground truth box it
+    overlaps the most (lowest index on ties).
+
+    Returns:
+        tuple: (true_positives, matched_counts) int arrays, one entry per threshold.
+    """
+    thresholds = np.asarray(iou_thresholds, dtype=np.float64)
+    all_thresholds = np.arange(len(thresholds))
+    # Slice of the pair arrays that belongs to each user box
+    bounds = np.searchsorted(rows, np.arange(n_user + 1))
+
+    true_positives = np.zeros(len(thresholds), dtype=np.int64)
+    matched = np.zeros((len(thresholds), n_gt), dtype=bool)
+
+    for u in range(n_user):
+        row_cols = cols[bounds[u]:bounds[u + 1]]
+        if not row_cols.size:
+            continue  # overlaps nothing: a false positive at every threshold
+        # Already matched spots can never win, same as the 'continue' above
+        candidates = np.where(matched[:, row_cols], 0.0, ious[None, bounds[u]:bounds[u + 1]])
+        best = candidates.argmax(axis=1)
+        best_iou = candidates[all_thresholds, best]
+
+        hit = (best_iou > 0) & (best_iou >= thresholds)
+        true_positives += hit
+        matched[all_thresholds[hit], row_cols[best[hit]]] = True
+
+    return true_positives, matched.sum(axis=1)
+
+
+def box_label(box):
+    """
+    Normalised class label of a box, or None when the box has no label.
+    Ingestion writes the Roboflow class into the 'label' key.
+    """
+    label = box.get('label')
+    if label is None or str(label).strip() == "":
+        return None
+    return str(label).strip().lower()
+
+
+def class_ids(user_labels, gt_labels):
+    """
+    Interns two lists of box_label() values into integer class ids sharing one
+    vocabulary. A box without a label gets -1 and is treated as a wildcard.
+
+    Returns:
+        tuple: (user_ids, gt_ids) int arrays.
+    """
+    vocabulary = {}
+
+    def to_ids(labels):
+        return np.array(
+            [-1 if label is None else vocabulary.setdefault(label, len(vocabulary))
+             for label in labels],
+            dtype=np.int64,
+        ).reshape(-1)
+
+    return to_ids(user_labels), to_ids(gt_labels)
+
+
+def _connected_components(rows, cols):
+    """
+    Splits the bipartite graph given by edge lists (rows[i], cols[i]) into
+    connected components using union-find.
+
+    Returns:
+        list: (edge_indices) arrays, one per component.
+    """
+    parent = {}
+
+    def find(node):
+        while parent.setdefault(node, node) != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for r, c in zip(rows.tolist(), cols.tolist()):
+        root_r, root_c = find(("u", r)), find(("g", c))
+        if root_r != root_c:
+            parent[root_r] = root_c
+
+    components = {}
+    for edge, r in enumerate(rows.tolist()):
+        components.setdefault(find(("u", r)), []).append(edge)
+    return [np.array(edges) for edges in components.values()]
+
+
+def _solve_assignment(cost):
+    """
+    Minimum cost assignment of every row of `cost` to a distinct column
+    (Hungarian algorithm with potentials, requires rows <= cols).
+    Only used when scipy is not installed.
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=int)    # p[j]: row (1-based) assigned to column j
+    way = np.zeros(m + 1, dtype=int)
+
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = ~used
+            free[0] = False
+            reduced = cost[i0 - 1] - u[i0] - v[1:]
+            better = free[1:] & (reduced < minv[1:])
+            minv[1:][better] = reduced[better]
+            way[1:][better] = j0
+
+            candidates = np.where(free, minv, np.inf)
+            j1 = int(candidates.argmin())
+            delta = candidates[j1]
+
+            used_cols = np.nonzero(used)[0]
+            u[p[used_cols]] += delta
+            v[used_cols] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Augment along the alternating path
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+
+    cols = np.nonzero(p[1:])[0]
+    rows = p[1:][cols] - 1
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def _max_weight_assignment(weight):
+    """
+    Row/column indices of the assignment maximising the total weight.
+    """
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(weight, maximize=True)
+    if weight.shape[0] > weight.shape[1]:
+        cols, rows = _solve_assignment(-weight.T)
+        order = np.argsort(rows)
+        return rows[order], cols[order]
+    return _solve_assignment(-weight)
+
+
+def same_class_pairs(ground_truth, user_boxes, rows, cols):
+    """
+    Boolean mask over overlap_pairs() output: True where the labels agree
+    or one of the two boxes is unlabelled.
+    """
+    user_ids, gt_ids = class_ids([box_label(box) for box in user_boxes], ground_truth.labels)
+    return (user_ids[rows] == gt_ids[cols]) | (user_ids[rows] < 0) | (gt_ids[cols] < 0)
+
+
+def _match_optimal(rows, cols, ious, iou_threshold):
+    """
+    Class-aware global matching on the sparse IoU matrix of same-class pairs.
+
+    Pairs below the threshold are dropped and each connected component of
+    what is left is solved on its own with a linear-sum-assignment that first
+    maximises the number of hits and then the total IoU of those hits.
+
+    Returns:
+        list: (user_idx, gt_idx) pairs of the matched boxes.
+    """
+    keep = ious >= iou_threshold
+    rows, cols, ious = rows[keep], cols[keep], ious[keep]
+
+    matches = []
+    for edges in _connected_components(rows, cols):
+        comp_rows, row_pos = np.unique(rows[edges], return_inverse=True)
+        comp_cols, col_pos = np.unique(cols[edges], return_inverse=True)
+
+        # A hit is worth more than any sum of IoUs, so the solver never
+        # trades a match for a tighter overlap elsewhere.
+        bonus = min(len(comp_rows), len(comp_cols)) + 1
+        weight = np.zeros((len(comp_rows), len(comp_cols)))
+        weight[row_pos, col_pos] = bonus + ious[edges]
+
+        for r, c in zip(*_max_weight_assignment(weight)):
+            if weight[r, c] > 0:
+                matches.append((int(comp_rows[r]), int(comp_cols[c])))
+    return sorted(matches)
+
+
+def per_class_breakdown(ground_truth_boxes, user_boxes, matches):
+    """
+    Correct finds / false positives / missed lesions per class label.
+    Hits and misses are counted under the ground truth label, false positives
+    under the label the student gave the box.
+    """
+    breakdown = {}
+
+    def bucket(box):
+        label = box_label(box) or UNLABELLED_CLASS
+        return breakdown.setdefault(
+            label, {"correct_finds": 0, "false_positives": 0, "missed_lesions": 0}
+        )
+
+    matched_users = {u for u, _ in matches}
+    matched_gts = {g for _, g in matches}
+    for g, gt_box in enumerate(ground_truth_boxes):
+        bucket(gt_box)["correct_finds" if g in matched_gts else "missed_lesions"] += 1
+    for u, u_box in enumerate(user_boxes):
+        if u not in matched_users:
+            bucket(u_box)["false_positives"] += 1
+    return breakdown
+
+
+def compile_ground_truth(ground_truth_boxes, index=None):
+    """
+    Parses the ground truth of one image into a CompiledGroundTruth.
+    The array is made read-only because compiled objects are shared through the cache.
+    """
+    boxes = ground_truth_boxes or []
+    array = boxes_to_array(boxes)
+    array.setflags(write=False)
+    return CompiledGroundTruth(
+        boxes=boxes,
+        array=array,
+        labels=tuple(box_label(box) for box in boxes),
+        index=usable_index(index, boxes),
+    )
+
+
+def research_metrics(true_positives, false_positives, total_lesions):
+    """
+    Precision, recall and F1 from hit/miss counts.
+    """
     # Precision: When they draw a box, how often is it right?
     # Recall: Out of all the acne spots, how many did they find?
     
@@ -94,14 +438,127 @@ def grade_submission(ground_truth_boxes, user_boxes, iou_threshold=0.5):
     if (precision + recall) > 0:
         f1_score = 2 * (precision * recall) / (precision + recall)
 
+    return precision, recall, f1_score
+
+
+def grade_submission(
+    ground_truth_boxes,
+    user_boxes,
+    iou_threshold=0.5,
+    engine=DEFAULT_GRADING_ENGINE,
+    matching=DEFAULT_MATCHING_MODE,
+    index=None,
+    iou_thresholds=None,
+):
+    """
+    PhD-Grade Logic: Compares list of user boxes against list of correct boxes.
+    
+    Args:
+        ground_truth_boxes (list): The correct answers, or a CompiledGroundTruth.
+        user_boxes (list): The student's drawings.
+        iou_threshold (float): How accurate the box must be to count as a 'Hit' (standard is 0.5).
+        engine (str): 'numpy' (IoU matrix), 'python' (original nested loop) or
+            'auto' (the loop for small greedy submissions, numpy otherwise).
+        matching (str): 'greedy' (drawing order, any class) or 'optimal'
+            (same class only, global assignment, adds a per-class breakdown).
+        index (dict): Optional grid index of the ground truth (AssessmentImage.ground_truth_index).
+            Only candidate pairs are compared; ignored by the 'python' engine or when stale.
+            Not needed with a CompiledGroundTruth, which carries its own.
+        iou_thresholds (list): Extra thresholds (e.g. COCO_IOU_THRESHOLDS) reported
+            under detailed_report['thresholds']. The IoU matrix is computed once for all of them.
+        
+    Returns:
+        dict: Detailed statistics for the Learning Curve.
+    """
+    if isinstance(ground_truth_boxes, CompiledGroundTruth):
+        ground_truth = ground_truth_boxes
+    else:
+        ground_truth = compile_ground_truth(ground_truth_boxes, index)
+    ground_truth_boxes = ground_truth.boxes
+    user_boxes = user_boxes or []
+
+    if engine not in GRADING_ENGINES:
+        raise ValueError(f"Unknown grading engine '{engine}', expected one of {GRADING_ENGINES}")
+    if matching not in MATCHING_MODES:
+        raise ValueError(f"Unknown matching mode '{matching}', expected one of {MATCHING_MODES}")
+
+    # The first threshold is the one the grade is based on
+    thresholds = [iou_threshold] + list(iou_thresholds or [])
+    total_lesions = len(ground_truth_boxes)
+    per_class = None
+    if engine == "auto":
+        small = len(user_boxes) * total_lesions * len(thresholds) <= AUTO_ENGINE_MAX_WORK
+        engine = "python" if small and matching == "greedy" else "numpy"
+
+    # --- STEP 1 & 2: Match user boxes to lesions, hits per threshold ---
+    if matching == "greedy" and engine == "python":
+        true_positives = [
+            _match_python(ground_truth_boxes, user_boxes, threshold)[0] for threshold in thresholds
+        ]
+    else:
+        rows, cols, ious = overlap_pairs(boxes_to_array(user_boxes), ground_truth.array, ground_truth.index)
+        if matching == "optimal":
+            same_class = same_class_pairs(ground_truth, user_boxes, rows, cols)
+            rows, cols, ious = rows[same_class], cols[same_class], ious[same_class]
+            matches = [_match_optimal(rows, cols, ious, threshold) for threshold in thresholds]
+            true_positives = [len(threshold_matches) for threshold_matches in matches]
+            per_class = per_class_breakdown(ground_truth_boxes, user_boxes, matches[0])
+        else:
+            true_positives, _ = _match_numpy(
+                rows, cols, ious, len(user_boxes), total_lesions, thresholds
+            )
+            true_positives = true_positives.tolist()
+
+    # Every user box is either a hit or a false positive, and every hit
+    # consumes exactly one lesion
+    false_positives = [len(user_boxes) - hits for hits in true_positives]
+    # --- STEP 3: Calculate what they missed ---
+    false_negatives = [total_lesions - hits for hits in true_positives]
+
+    # --- STEP 4: Calculate Research Metrics ---
+    precision, recall, f1_score = research_metrics(
+        true_positives[0], false_positives[0], total_lesions
+    )
+
+    detailed_report = {
+        "total_lesions": total_lesions,
+        "correct_finds": true_positives[0],
+        "false_positives": false_positives[0], # Student saw things that weren't there
+        "missed_lesions": false_negatives[0],  # Student missed these
+        "precision": round(precision, 2),
+        "recall": round(recall, 2)
+    }
+    if per_class is not None:
+        detailed_report["matching"] = matching
+        detailed_report["per_class"] = per_class
+    if iou_thresholds:
+        detailed_report["thresholds"] = threshold_report(
+            thresholds[1:], true_positives[1:], false_positives[1:], total_lesions
+        )
+
     return {
         "iou_score": round(f1_score, 2),  # This is the simplified score we save to DB
-        "detailed_report": {
-            "total_lesions": total_lesions,
-            "correct_finds": true_positives,
-            "false_positives": false_positives, # Student saw things that weren't there
-            "missed_lesions": false_negatives,  # Student missed these
-            "precision": round(precision, 2),
-            "recall": round(recall, 2)
-        }
-    }
\ No newline at end of file
+        "detailed_report": detailed_report
+    }
+
+
+def threshold_report(thresholds, true_positives, false_positives, total_lesions):
+    """
+    Compact column-wise report of the metrics at every threshold, plus the
+    COCO-style averages over all of them.
+    """
+    metrics = [
+        research_metrics(hits, misses, total_lesions)
+        for hits, misses in zip(true_positives, false_positives)
+    ]
+    precision = [round(p, 3) for p, _, _ in metrics]
+    recall = [round(r, 3) for _, r, _ in metrics]
+    return {
+        "iou": [round(float(threshold), 2) for threshold in thresholds],
+        "correct_finds": list(true_positives),
+        "false_positives": list(false_positives),
+        "precision": precision,
+        "recall": recall,
+        "mean_precision": round(sum(p for p, _, _ in metrics) / len(metrics), 3),
+        "mean_recall": round(sum(r for _, r, _ in metrics) / len(metrics), 3),
+    }
@@ -1,8 +1,30 @@
+from django.conf import settings
+from django.utils.http import parse_etags
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from .models import UserAttempt, AssessmentImage
-from derma.task import grade_student_attempt
+from derma.cache import get_compiled_ground_truth
+from derma.events import failed_payload, graded_payload, grading_failed
+from derma.next_image import pop_next_image, random_image
+from derma.results import cache_graded_results, cached_result, mark_attempts_processing, payload_etag
+from derma.tasks import (
+    attempts_for_grading,
+    queue_attempt_for_grading,
+    queue_attempts_for_grading,
+    request_next_image_refill,
+    try_grade,
+)
+
+
+def can_grade_inline(ground_truth_boxes, user_boxes):
+    """
+    True when grading is cheap enough to run inside the request.
+    DERMA_INLINE_GRADING_MAX_BOXES = 0 disables the inline path.
+    """
+    budget = settings.DERMA_INLINE_GRADING_MAX_BOXES
+    return budget > 0 and len(ground_truth_boxes or []) + len(user_boxes or []) <= budget
+
 
 class SubmitAssessmentView(APIView):
     permission_classes = [IsAuthenticated] # Ensure only logged-in students can submit
@@ -22,11 +44,18 @@ class SubmitAssessmentView(APIView):
         classification = request.data.get('classification', "Unknown") 
 
         # 3. Validation
-        if not AssessmentImage.objects.filter(id=image_id).exists():
+        # The inline path needs the ground truth version anyway, so fetch it in the same query
+        if settings.DERMA_INLINE_GRADING_MAX_BOXES > 0:
+            image = AssessmentImage.objects.filter(id=image_id).only("id", "date_modified").first()
+            if image is None:
+                return Response({"error": "Invalid Image ID"}, status=400)
+        elif not AssessmentImage.objects.filter(id=image_id).exists():
             return Response({"error": "Invalid Image ID"}, status=400)
+        else:
+            image = None
 
         # 4. Save to Database (The "filing cabinet")
-        attempt = UserAttempt.objects.create(
+        attempt = UserAttempt(
             user=user,
             assessment_image_id=image_id,
             user_boxes=user_boxes,
@@ -35,9 +64,24 @@ class SubmitAssessmentView(APIView):
             iou_score=None # Will be filled by Celery
         )
 
-        # 5. Trigger the Async Worker (The "Muscle")
-        # .delay() puts it in Redis so the user gets an instant response
-        grade_student_attempt.delay(attempt.id)
+        # 5a. Fast path: small submissions are graded right here, which saves
+        # the queue round trip and the polling of AssessmentResultView
+        if image is not None:
+            ground_truth = get_compiled_ground_truth(image.id, image.date_modified)
+            if can_grade_inline(ground_truth.boxes, user_boxes):
+                if try_grade(attempt, ground_truth):
+                    attempt.save()
+                    cache_graded_results([attempt], {image.id: ground_truth})
+                    return Response(graded_payload(attempt, ground_truth))
+                # Malformed boxes: keep the submission and let the worker grade or fail it
+                attempt.detailed_report = None
+
+        attempt.save()
+        mark_attempts_processing([attempt])
+
+        # 5b. Trigger the Async Worker (The "Muscle")
+        # Queued in Redis (per attempt or micro-batched) so the user gets an instant response
+        queue_attempt_for_grading(attempt.id)
 
         return Response({
             "message": "Submission received. Grading in progress...", 
@@ -46,25 +90,132 @@ class SubmitAssessmentView(APIView):
         })
         
         
+class BatchSubmitAssessmentView(APIView):
+    """
+    POST {"items": [{"image_id", "boxes", "time_taken", "classification"}, ...]}
+
+    Saves every attempt with one validation query and one bulk INSERT, then
+    grades them through one Celery group. The batch is all or nothing: any
+    invalid item rejects it with the per-item errors.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        items = request.data.get('items')
+        if not isinstance(items, list) or not items:
+            return Response({"error": "items must be a non-empty list"}, status=400)
+        if len(items) > settings.DERMA_BATCH_SUBMIT_MAX_ITEMS:
+            return Response(
+                {"error": f"At most {settings.DERMA_BATCH_SUBMIT_MAX_ITEMS} items per batch"}, status=400
+            )
+
+        errors = {}
+        parsed = []
+        for position, item in enumerate(items):
+            try:
+                parsed.append((int(item['image_id']), float(item.get('time_taken', 0.0))))
+            except (KeyError, TypeError, ValueError, AttributeError):
+                errors[position] = "image_id and time_taken must be numbers"
+                parsed.append(None)
+
+        # One IN query validates every image
+        requested = {row[0] for row in parsed if row is not None}
+        existing = set(AssessmentImage.objects.filter(id__in=requested).values_list('id', flat=True))
+        for position, row in enumerate(parsed):
+            if row is not None and row[0] not in existing:
+                errors[position] = "Invalid Image ID"
+        if errors:
+            return Response({"error": "Invalid items", "items": errors}, status=400)
+
+        attempts = UserAttempt.objects.bulk_create([
+            UserAttempt(
+                user=request.user,
+                assessment_image_id=image_id,
+                user_boxes=item.get('boxes'),
+                time_taken_seconds=time_taken,
+                user_classification=item.get('classification', "Unknown"),
+                iou_score=None,
+            )
+            for item, (image_id, time_taken) in zip(items, parsed)
+        ])
+        mark_attempts_processing(attempts)
+        queue_attempts_for_grading([attempt.id for attempt in attempts])
+
+        return Response({
+            "message": "Submissions received. Grading in progress...",
+            "status": "processing",
+            # Same order as the request items
+            "attempts": [
+                {"image_id": attempt.assessment_image_id, "attempt_id": attempt.id} for attempt in attempts
+            ],
+        })
+
+
 class AssessmentResultView(APIView):
+    """
+    GET: the graded report of an attempt, or {"status": "processing"}.
+
+    Answered from derma.results whenever possible, so polling doesn't reach
+    Postgres. Graded reports carry a strong ETag and If-None-Match gets a 304.
+    """
     permission_classes = [IsAuthenticated]
+    # Clients may keep the report but have to revalidate it
+    cache_control = "private, no-cache"
+
+    def graded_response(self, request, payload, etag):
+        headers = {"ETag": etag, "Cache-Control": self.cache_control}
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH")
+        if if_none_match and (etag in parse_etags(if_none_match) or if_none_match.strip() == "*"):
+            return Response(status=304, headers=headers)
+        return Response(payload, headers=headers)
+
+    def processing_response(self):
+        return Response({"status": "processing"}, headers={"Cache-Control": "no-store"})
 
     def get(self, request, attempt_id):
+        entry, processing_user_id = cached_result(attempt_id)
+        if entry is not None and entry["user_id"] == request.user.id:
+            return self.graded_response(request, entry["payload"], entry["etag"])
+        if entry is None and processing_user_id == request.user.id:
+            return self.processing_response()
+
         try:
-            attempt = UserAttempt.objects.get(id=attempt_id, user=request.user)
+            attempt = attempts_for_grading().get(id=attempt_id, user=request.user)
             
             if attempt.is_graded:
                 # Return the full Research Report
-                return Response({
-                    "status": "complete",
-                    "score": attempt.iou_score,
-                    "feedback": attempt.detailed_report, # e.g. "You missed 2 cysts"
-                    # Return the Ground Truths so the Frontend can draw the "Correct" boxes
-                    # on top of the student's boxes for visual comparison
-                    "ground_truth_boxes": attempt.assessment_image.ground_truth_labels
-                })
+                ground_truth = get_compiled_ground_truth(
+                    attempt.assessment_image_id, attempt.assessment_image.date_modified
+                )
+                cache_graded_results([attempt], {attempt.assessment_image_id: ground_truth})
+                payload = graded_payload(attempt, ground_truth)
+                return self.graded_response(request, payload, payload_etag(payload))
+            elif grading_failed(attempt):
+                return Response(failed_payload(attempt), headers={"Cache-Control": "no-store"})
             else:
-                return Response({"status": "processing"})
+                mark_attempts_processing([attempt])
+                return self.processing_response()
                 
         except UserAttempt.DoesNotExist:
-            return Response({"error": "Attempt not found"}, status=404)        
\ No newline at end of file
+            return Response({"error": "Attempt not found"}, status=404)
+
+
+class NextImageView(APIView):
+    """
+    GET: the next image the student should practise on, served from the
+    precomputed queue in derma.next_image.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        user_id = request.user.id
+        payload, remaining = pop_next_image(user_id)
+        if payload is None:
+            # Cold start (first visit or expired queue): a random image while the refill runs
+            payload = random_image()
+            if payload is None:
+                return Response({"error": "No images available"}, status=404)
+
+        if remaining <= settings.DERMA_NEXT_IMAGE_REFILL_AT:
+            request_next_image_refill(user_id)
+        return Response(payload)
@@ -10,7 +10,18 @@ https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 import os
 
 from django.core.asgi import get_asgi_application
+from django.urls import re_path
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'dermapj.settings')
 
-application = get_asgi_application()
+# Initialise Django before importing anything that touches models
+django_application = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+
+from derma.routing import http_urlpatterns  # noqa: E402
+
+application = ProtocolTypeRouter({
+    # Push endpoints for grading results, everything else goes to Django
+    "http": URLRouter(http_urlpatterns + [re_path(r"", django_application)]),
+})
@@ -210,6 +210,28 @@ MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 AUTH_USER_MODEL = "users.User"
 
+# Renditions of AssessmentImage.image_file, pre-generated by `manage.py warm_renditions`
+# and at ingestion (derma.renditions)
+VERSATILEIMAGEFIELD_RENDITION_KEY_SETS = {
+    "assessment_image": [
+        ("full_size", "url"),
+        ("thumbnail", "thumbnail__200x200"),
+        ("medium", "thumbnail__800x800"),
+        ("square_crop", "crop__400x400"),
+    ],
+}
+# Turn off once every image is warmed so web workers never resize
+VERSATILEIMAGEFIELD_SETTINGS = {
+    "create_images_on_demand": config("VERSATILEIMAGEFIELD_CREATE_ON_DEMAND", cast=bool, default=True),
+}
+DERMA_RENDITION_KEY_SET = "assessment_image"
+
+# Hand image bodies served by derma.delivery to the web server: "x-accel-redirect" (nginx),
+# "x-sendfile" (Apache/lighttpd) or "" to stream them from Django. For nginx:
+#   location /protected-media/ { internal; alias <MEDIA_ROOT>/; }
+DERMA_MEDIA_SENDFILE = config("DERMA_MEDIA_SENDFILE", default="")
+DERMA_MEDIA_ACCEL_PREFIX = config("DERMA_MEDIA_ACCEL_PREFIX", default="/protected-media/")
+
 
 # =========================================================
 #  REST FRAMEWORK
@@ -333,6 +355,95 @@ CACHES = {
     }
 }
 
+CELERY_BEAT_SCHEDULE = {
+    "purge-soft-deleted": {
+        "task": "core.tasks.purge_soft_deleted",
+        "schedule": 60 * 60 * 24,
+    },
+}
+
+# =========================================================
+#  SOFT DELETE
+# =========================================================
+
+# Rows soft deleted longer ago than this are purged by core.tasks.purge_soft_deleted.
+# Purging follows on_delete: an AssessmentImage or User takes its UserAttempts with it
+SOFT_DELETE_RETENTION_DAYS = config("SOFT_DELETE_RETENTION_DAYS", cast=int, default=90)
+SOFT_DELETE_PURGE_MODELS = config(
+    "SOFT_DELETE_PURGE_MODELS",
+    cast=lambda v: [s.strip() for s in v.split(",") if s.strip()],
+    default="derma.UserAttempt",
+)
+# Rows per UPDATE/DELETE of the batched soft delete, restore and purge (core.managers)
+SOFT_DELETE_CHUNK_SIZE = config("SOFT_DELETE_CHUNK_SIZE", cast=int, default=1000)
+
+# =========================================================
+#  DERMA GRADING
+# =========================================================
+
+# Stored in every detailed_report. Bump it when the rules below change and
+# run `manage.py regrade_attempts --outdated` to regrade older attempts
+DERMA_GRADER_VERSION = config("DERMA_GRADER_VERSION", default="1")
+
+# IoU a box needs to count as a hit
+DERMA_GRADING_IOU_THRESHOLD = config("DERMA_GRADING_IOU_THRESHOLD", cast=float, default=0.5)
+
+# 'auto' (picks by submission size), 'numpy' (vectorised IoU matrix) or
+# 'python' (original nested loop, for A/B checks)
+DERMA_GRADING_ENGINE = config("DERMA_GRADING_ENGINE", default="auto")
+# 'greedy' (drawing order, labels ignored) or 'optimal' (class-aware global assignment)
+DERMA_GRADING_MATCHING = config("DERMA_GRADING_MATCHING", default="greedy")
+# Extra IoU thresholds reported in detailed_report['thresholds'] (COCO 0.5:0.95 by default).
+# Set to an empty string to skip the per-threshold report.
+DERMA_GRADING_IOU_THRESHOLDS = config(
+    "DERMA_GRADING_IOU_THRESHOLDS",
+    cast=lambda v: [float(s) for s in v.split(",") if s.strip()],
+    default="0.5,0.55,0.6,0.65,0.7,0.75,0.8,0.85,0.9,0.95",
+)
+
+# Micro-batched grading: submissions are collected in Redis and graded together
+# after DERMA_GRADING_BATCH_WINDOW seconds or once DERMA_GRADING_BATCH_SIZE are pending
+DERMA_GRADING_BATCHED = config("DERMA_GRADING_BATCHED", cast=bool, default=False)
+DERMA_GRADING_BATCH_WINDOW = config("DERMA_GRADING_BATCH_WINDOW", cast=float, default=0.5)
+DERMA_GRADING_BATCH_SIZE = config("DERMA_GRADING_BATCH_SIZE", cast=int, default=200)
+
+# Largest accepted POST /api/derma/attempts/batch/
+DERMA_BATCH_SUBMIT_MAX_ITEMS = config("DERMA_BATCH_SUBMIT_MAX_ITEMS", cast=int, default=100)
+
+# Submissions whose user + ground truth box count is at most this are graded inside
+# SubmitAssessmentView and answered with the full report. 0 disables the fast path.
+DERMA_INLINE_GRADING_MAX_BOXES = config("DERMA_INLINE_GRADING_MAX_BOXES", cast=int, default=0)
+
+# Where the compiled ground truth is read from: "json" (ground_truth_labels) or
+# "packed" (AssessmentImage.ground_truth_packed, float32, falls back to json when missing)
+DERMA_GROUND_TRUTH_SOURCE = config("DERMA_GROUND_TRUTH_SOURCE", default="json")
+
+# Compiled ground truth cache (derma.cache): in-process LRU entries, then Redis timeout in seconds
+DERMA_GROUND_TRUTH_LRU_SIZE = config("DERMA_GROUND_TRUTH_LRU_SIZE", cast=int, default=512)
+DERMA_GROUND_TRUTH_CACHE_TIMEOUT = config("DERMA_GROUND_TRUTH_CACHE_TIMEOUT", cast=int, default=60 * 60 * 24)
+
+# AssessmentResultView cache (derma.results), in seconds: graded payloads, and the
+# "processing" flag of attempts in the grading queue (expired flags fall back to the DB)
+DERMA_RESULT_CACHE_TIMEOUT = config("DERMA_RESULT_CACHE_TIMEOUT", cast=int, default=60 * 60 * 24)
+DERMA_RESULT_STATUS_TIMEOUT = config("DERMA_RESULT_STATUS_TIMEOUT", cast=int, default=5 * 60)
+
+# Push endpoints on the ASGI service (derma.consumers), in seconds
+DERMA_RESULT_STREAM_TIMEOUT = config("DERMA_RESULT_STREAM_TIMEOUT", cast=int, default=120)
+DERMA_RESULT_STREAM_KEEPALIVE = config("DERMA_RESULT_STREAM_KEEPALIVE", cast=int, default=15)
+DERMA_RESULT_LONG_POLL_TIMEOUT = config("DERMA_RESULT_LONG_POLL_TIMEOUT", cast=int, default=25)
+
+# Per-user next-image queues (derma.next_image): images queued per refill, and the
+# queue length that triggers a background refill
+DERMA_NEXT_IMAGE_QUEUE_SIZE = config("DERMA_NEXT_IMAGE_QUEUE_SIZE", cast=int, default=50)
+DERMA_NEXT_IMAGE_REFILL_AT = config("DERMA_NEXT_IMAGE_REFILL_AT", cast=int, default=10)
+# Weight multiplier of images the user never attempted
+DERMA_NEXT_IMAGE_UNSEEN_BOOST = config("DERMA_NEXT_IMAGE_UNSEEN_BOOST", cast=float, default=3.0)
+# Pseudo-attempts at the user's overall mean added to every class score
+DERMA_NEXT_IMAGE_PRIOR_ATTEMPTS = config("DERMA_NEXT_IMAGE_PRIOR_ATTEMPTS", cast=float, default=3.0)
+# Lifetimes in seconds of an idle queue and of the refill-scheduled flag
+DERMA_NEXT_IMAGE_QUEUE_TIMEOUT = config("DERMA_NEXT_IMAGE_QUEUE_TIMEOUT", cast=int, default=60 * 60 * 24 * 7)
+DERMA_NEXT_IMAGE_REFILL_LOCK_TIMEOUT = config("DERMA_NEXT_IMAGE_REFILL_LOCK_TIMEOUT", cast=int, default=60)
+
 # =========================================================
 #  3RD PARTY API KEYS (From .env)
 # =========================================================
@@ -351,6 +462,19 @@ ESEWA_MERCHANT_SECRET_KEY = config("ESEWA_MERCHANT_SECRET_KEY", default="")
 GEMINI_API_KEY = config("GEMINI_API_KEY", default="")
 DEEPSEEK_API_KEY = config("DEEPSEEK_API_KEY", default="")
 
+# Ingestion predictors (derma.predictors)
+ROBOFLOW_API_KEY = config("ROBOFLOW_API_KEY", default="")
+ROBOFLOW_PROJECT = config("ROBOFLOW_PROJECT", default="DermaVal")
+ROBOFLOW_MODEL_VERSION = config("ROBOFLOW_MODEL_VERSION", cast=int, default=1)
+# Confidence floor (percent) of the raw predictions stored at ingestion. Anything
+# below it can't be recovered by `manage.py rethreshold_ground_truth`
+DERMA_RAW_PREDICTION_CONFIDENCE = config("DERMA_RAW_PREDICTION_CONFIDENCE", cast=float, default=1)
+# Hamming distance between 64-bit pHashes below which two images count as
+# near-duplicates (ingestion and `manage.py audit_near_duplicates`). -1 disables the check
+DERMA_NEAR_DUPLICATE_RADIUS = config("DERMA_NEAR_DUPLICATE_RADIUS", cast=int, default=6)
+# .pt or .onnx weights for the 'local' Ultralytics backend
+DERMA_LOCAL_MODEL_PATH = config("DERMA_LOCAL_MODEL_PATH", default="")
+
 # Import local settings if available
 try:
     from dermapj.local_settings import *
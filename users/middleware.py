@@ -0,0 +1,40 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+
+@database_sync_to_async
+def get_user_for_token(raw_token):
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        # AuthenticationFailed: the token is valid but its user is gone or inactive
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Channels middleware that puts the user of a simplejwt access token into scope["user"].
+    The token is read from the "Authorization: Bearer <token>" header or, for
+    EventSource clients that can't set headers, from the ?token= query parameter.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        raw_token = None
+
+        headers = dict(scope.get("headers", []))
+        authorization = headers.get(b"authorization", b"").decode().split()
+        if len(authorization) == 2 and authorization[0] == "Bearer":
+            raw_token = authorization[1]
+        else:
+            raw_token = parse_qs(scope.get("query_string", b"").decode()).get("token", [None])[0]
+
+        scope["user"] = await get_user_for_token(raw_token) if raw_token else AnonymousUser()
+        return await super().__call__(scope, receive, send)
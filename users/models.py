@@ -42,6 +42,13 @@ class User(AbstractUser, SoftDeleteModal):
     
     address = models.CharField(max_length=200, null=True, blank=True)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # Partial indexes: live accounts, and deleted ones for the purge
+            models.Index(fields=["date_joined"], condition=models.Q(is_deleted=False), name="users_user_live_joined_idx"),
+            models.Index(fields=["deleted_date"], condition=models.Q(is_deleted=True), name="users_user_purge_idx"),
+        ]
+
     def soft_delete(self, *args, **kwargs):
         """
         Soft delete the model instance.
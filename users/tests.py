@@ -1,3 +1,24 @@
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser
 from django.test import TestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from users.middleware import get_user_for_token
+from users.models import User
+
+
+class JWTAuthMiddlewareTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="student", password="secret")
+        self.token = str(RefreshToken.for_user(self.user).access_token)
+
+    def test_token_resolves_its_user(self):
+        self.assertEqual(async_to_sync(get_user_for_token)(self.token), self.user)
+
+    def test_inactive_user_is_anonymous(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsInstance(async_to_sync(get_user_for_token)(self.token), AnonymousUser)
+
+    def test_invalid_token_is_anonymous(self):
+        self.assertIsInstance(async_to_sync(get_user_for_token)("not-a-token"), AnonymousUser)